@@ -0,0 +1,167 @@
+"""
+Single pass analysis of an OSM XML file.
+
+The file is parsed once and every element is passed to a list of visitors, which replace the separate full file
+scans of mapparser.count_tags, count_k_attribute_value.get_types_of_k_attrib, audit.audit and
+from_osm_to_csv.process_map.
+"""
+import argparse
+import operator
+import pprint
+import time
+from collections import defaultdict
+
+import audit
+import osm_parsers
+import osm_pbf
+from osm_parsers import OSMElement, TOP_LEVEL_TAGS
+from schema_validator import CompiledValidator
+from from_osm_to_csv import shape_element, validate_element, CsvWriters, OSM_PATH, CSV_PATHS
+
+
+class Visitor(object):
+    """Base visitor, subclasses override the hooks they need"""
+
+    def end(self, elem):
+        """Called for every element of the file once its end tag is parsed"""
+        pass
+
+    def element(self, elem):
+        """Called for every complete node, way or relation"""
+        pass
+
+    def close(self):
+        """Called after the last element, returns the result of the visitor"""
+        return None
+
+
+class TagCounter(Visitor):
+    """The top tags and how many of each, as in mapparser.count_tags"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def end(self, elem):
+        self.counts[elem.tag] += 1
+
+    def close(self):
+        return self.counts
+
+
+class KAttribCounter(Visitor):
+    """Frequency of the 'k' attribute of node and way tags, as in count_k_attribute_value.get_types_of_k_attrib"""
+
+    def __init__(self):
+        self.k_attrib_values_dict = {}
+
+    def element(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                k = tag.attrib['k']
+                if k not in self.k_attrib_values_dict:
+                    self.k_attrib_values_dict[k] = 1
+                else:
+                    self.k_attrib_values_dict[k] += 1
+
+    def close(self):
+        return self.k_attrib_values_dict
+
+
+class AuditVisitor(Visitor):
+    """Run the audit.py checks into the given audit.Audit, a new one by default, as audit.audit(..., into=) does"""
+
+    def __init__(self, into=None):
+        self.audit_data = audit.Audit() if into is None else into
+
+    def element(self, elem):
+        self.audit_data.audit_elements((elem,))
+
+    def close(self):
+        return self.audit_data.results()
+
+
+class ShapeWriterVisitor(Visitor):
+    """Shape nodes, ways and relations and pass them to a writer with write(el) and close(), e.g. CsvWriters or
+    from_osm_to_sqlite.SQLiteBulkLoader (whose finish() is called instead of close())"""
+
+    def __init__(self, writer, validate=False):
+        self.writer = writer
+        self.validate = validate
+        self.validator = CompiledValidator()
+
+    def element(self, elem):
+        if elem.tag == 'node' or elem.tag == 'way' or elem.tag == 'relation':
+            el = shape_element(elem)
+            if el:
+                if self.validate is True:
+                    validate_element(el, self.validator)
+                self.writer.write(el)
+
+    def close(self):
+        if hasattr(self.writer, 'finish'):
+            return self.writer.finish()
+        return self.writer.close()
+
+
+def analyse(osm_file, visitors):
+    """Stream the file once with osm_parsers.iter_osm, pass every element to the visitors and return their results
+    in order"""
+    end_visitors = [visitor for visitor in visitors if type(visitor).end is not Visitor.end]
+    element_visitors = [visitor for visitor in visitors if type(visitor).element is not Visitor.element]
+
+    # .osm.pbf files keep the <bounds> of an XML file in their header
+    bbox = osm_pbf.read_header(osm_file)['bbox'] if osm_pbf.is_pbf(osm_file) else None
+    if bbox:
+        for visitor in end_visitors:
+            visitor.end(OSMElement('bounds', bbox))
+
+    for elem in osm_parsers.iter_osm(osm_file, tags=None):
+        if end_visitors:
+            # the children of a top level element have no children of their own and end before it does
+            ended = list(elem.iter())
+            ended.append(ended.pop(0))
+            for visitor in end_visitors:
+                for child in ended:
+                    visitor.end(child)
+        if elem.tag in TOP_LEVEL_TAGS:
+            for visitor in element_visitors:
+                visitor.element(elem)
+
+    # the XML root ends last
+    for visitor in end_visitors:
+        visitor.end(OSMElement('osm', {}))
+    return [visitor.close() for visitor in visitors]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count, audit and convert an OSM XML file in a single pass')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm, .osm.bz2/.gz/.xz or .osm.pbf file')
+    parser.add_argument('--db', help='load the shaped elements into this SQLite database instead of the csv(s)')
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    if args.db:
+        from from_osm_to_sqlite import SQLiteBulkLoader
+        writer = SQLiteBulkLoader(args.db)
+    else:
+        writer = CsvWriters(CSV_PATHS)
+
+    audit_visitor = AuditVisitor()
+    tag_counts, k_attrib_values_dict, _, load_report = analyse(
+        args.osm_file, [TagCounter(), KAttribCounter(), audit_visitor, ShapeWriterVisitor(writer)])
+
+    print("tag counts:")
+    pprint.pprint(tag_counts)
+    print()
+    print("top k values:")
+    pprint.pprint(sorted(k_attrib_values_dict.items(), key=operator.itemgetter(1), reverse=True)[1:21])
+    audit.print_audit_report(audit_visitor.audit_data)
+    if load_report:
+        print()
+        print("load report:")
+        pprint.pprint(load_report)
+
+    print()
+    elapsed_time = time.time() - start_time
+    print("minutes elapsed {:.3}".format(elapsed_time/60))
@@ -0,0 +1,173 @@
+"""
+Apply an osmChange diff (.osc, optionally compressed) to a database loaded by from_osm_to_sqlite.
+
+The <create> and <modify> elements are shaped and cleaned by shape_element exactly as in the full conversion and
+replace the rows of their id in nodes, nodes_tags, ways, ways_tags, ways_nodes, relations, relations_tags and
+relations_members; the <delete> elements remove them.
+The actions are applied in file order inside a single transaction, the R*Tree spatial index follows the changed nodes
+and ways (and the ways of a moved node) when the database has one, and so do the ways_geometry rows when the load
+filled them and the osm_reports summary tables when the database has them.
+"""
+import argparse
+import pprint
+import sqlite3
+import time
+
+import osm_locations
+import osm_parsers
+import osm_reports
+import osm_spatial
+from from_osm_to_csv import shape_element, validate_element, \
+    NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS, \
+    RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS, WAY_GEOMETRY_FIELDS
+from from_osm_to_sqlite import DB_PATH
+from schema_validator import CompiledValidator
+
+# Actions of an osmChange file
+ACTIONS = ('create', 'modify', 'delete')
+
+# Element tables and the child tables whose rows are replaced with them
+ELEMENT_TABLES = {'node': ('nodes', ['nodes_tags']),
+                  'way': ('ways', ['ways_tags', 'ways_nodes']),
+                  'relation': ('relations', ['relations_tags', 'relations_members'])}
+
+# Shaped element keys, their tables and columns
+TABLES = [('node', 'nodes', NODE_FIELDS),
+          ('node_tags', 'nodes_tags', NODE_TAGS_FIELDS),
+          ('way', 'ways', WAY_FIELDS),
+          ('way_nodes', 'ways_nodes', WAY_NODES_FIELDS),
+          ('way_tags', 'ways_tags', WAY_TAGS_FIELDS),
+          ('relation', 'relations', RELATION_FIELDS),
+          ('relation_members', 'relations_members', RELATION_MEMBERS_FIELDS),
+          ('relation_tags', 'relations_tags', RELATION_TAGS_FIELDS),
+          ('way_geometry', 'ways_geometry', WAY_GEOMETRY_FIELDS)]
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for every node, way and relation of an osmChange file, in file order"""
+    block = None
+    depth = 0
+    for event, elem in osm_parsers.iterparse_osm(osc_file, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                block = elem
+        else:
+            depth -= 1
+            if depth == 2:
+                if block.tag in ACTIONS and elem.tag in ELEMENT_TABLES:
+                    yield block.tag, elem
+                # release the elements of the action block already handled
+                block.clear()
+
+
+class ChangeApplier(object):
+    """Replace or delete the rows of changed elements"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.inserts = {}
+        for key, table, fields in TABLES:
+            self.inserts[key] = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                table, ', '.join(fields), ', '.join('?' * len(fields)))
+        self.fields = dict((key, fields) for key, _, fields in TABLES)
+        self.counts = dict(((action, tag), 0) for action in ACTIONS for tag in ELEMENT_TABLES)
+        self.spatial = osm_spatial.has_spatial_index(connection)
+        self.locations = osm_locations.SQLiteNodeLocations(connection) \
+            if osm_spatial.has_way_geometry(connection) else None
+        self.summaries = osm_reports.has_summaries(connection)
+
+    def delete(self, tag, element_id):
+        table, child_tables = ELEMENT_TABLES[tag]
+        for child_table in child_tables:
+            self.connection.execute("DELETE FROM {0} WHERE id = ?".format(child_table), (element_id,))
+        self.connection.execute("DELETE FROM {0} WHERE id = ?".format(table), (element_id,))
+
+    def upsert(self, el):
+        for key, rows in el.items():
+            fields = self.fields[key]
+            if isinstance(rows, dict):
+                self.connection.execute(self.inserts[key], [rows[field] for field in fields])
+            elif rows:
+                self.connection.executemany(self.inserts[key], [[row[field] for field in fields] for row in rows])
+
+    def apply(self, action, elem, validator=None):
+        element_id = int(elem.attrib['id'])
+        # a modified element replaces all of its rows, so its old tags and way nodes go first
+        if self.summaries:
+            osm_reports.remove_element(self.connection, elem.tag, element_id)
+        self.delete(elem.tag, element_id)
+        if action != 'delete':
+            el = shape_element(elem)
+            if validator is not None:
+                validate_element(el, validator)
+            self.upsert(el)
+            if self.summaries:
+                osm_reports.add_element(self.connection, elem.tag, element_id)
+        if self.locations is not None:
+            self.update_geometry(elem.tag, element_id)
+        if self.spatial:
+            self.reindex(elem.tag, element_id)
+        self.counts[(action, elem.tag)] += 1
+
+    def update_geometry(self, tag, element_id):
+        """Recompute the ways_geometry rows of a changed way, or of the ways through a changed node"""
+        if tag == 'node':
+            way_ids = [way_id for (way_id,) in self.connection.execute(
+                "SELECT DISTINCT id FROM ways_nodes WHERE node_id = ?", (element_id,)).fetchall()]
+        elif tag == 'way':
+            way_ids = [element_id]
+        else:
+            return
+        for way_id in way_ids:
+            self.connection.execute("DELETE FROM ways_geometry WHERE id = ?", (way_id,))
+            node_refs = [node_id for (node_id,) in self.connection.execute(
+                "SELECT node_id FROM ways_nodes WHERE id = ? ORDER BY position", (way_id,))]
+            # a deleted way has no nodes left and no geometry
+            geometry = osm_locations.way_geometry(way_id, node_refs, self.locations)
+            if geometry:
+                self.upsert({'way_geometry': geometry})
+
+    def reindex(self, tag, element_id):
+        if tag == 'node':
+            osm_spatial.index_node(self.connection, element_id)
+            # a moved node moves the box of every way through it
+            for (way_id,) in self.connection.execute(
+                    "SELECT DISTINCT id FROM ways_nodes WHERE node_id = ?", (element_id,)).fetchall():
+                osm_spatial.index_way(self.connection, way_id)
+        elif tag == 'way':
+            osm_spatial.index_way(self.connection, element_id)
+
+
+def apply_change(osc_file, db_path=DB_PATH, validate=False):
+    """Apply an osmChange file to the database and return the number of elements per action"""
+    start_time = time.time()
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    applier = ChangeApplier(connection)
+    validator = CompiledValidator() if validate else None
+
+    connection.execute("BEGIN")
+    try:
+        for action, elem in iter_changes(osc_file):
+            applier.apply(action, elem, validator)
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    else:
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+
+    report = dict(('{0}_{1}'.format(action, tag), count) for (action, tag), count in applier.counts.items())
+    report['seconds'] = round(time.time() - start_time, 3)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply an osmChange diff to the SQLite database')
+    parser.add_argument('osc_file', help='input .osc file, optionally .bz2/.gz/.xz compressed')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database loaded by from_osm_to_sqlite.py')
+    parser.add_argument('--validate', action='store_true', help='validate the shaped elements against the schema')
+    args = parser.parse_args()
+
+    pprint.pprint(apply_change(args.osc_file, args.db, args.validate))
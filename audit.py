@@ -9,37 +9,29 @@ Your task in this exercise has two steps:
     The function takes a string with street name as an argument and should return the fixed name
     We have provided a simple test so that you see what exactly is expected
 """
-import xml.etree.cElementTree as ET
 from collections import defaultdict
+import argparse
+import math
+import multiprocessing
 import re
 import pprint
 import time
 
+import osm_parsers
+import osm_pbf
+from from_osm_to_csv import find_shard_boundaries, ShardFile
+
 # Pinpointing the OSM input file
 OSMFILE = "maps-xml/london_full.osm"
 
-# Dictionaries to store data types
-node_field_types = defaultdict(set)
-node_tag_field_types = defaultdict(set)
-way_field_types = defaultdict(set)
-way_tag_field_types = defaultdict(set)
-way_node_field_types = defaultdict(set)
-
-# Data structure used to store wrong coordinates
-coordinates_out_of_area = {}
-
-# Data structure to store street types
-street_types = defaultdict(set)
+# Area of the map (min lat, min lon, max lat, max lon), the nodes outside of it are stored in coordinates_out_of_area
+AREA_BBOX = (51.2550, -0.8253, 51.7573, 0.5699)
 
-# Data structure to store postal code types
-postal_code_types = defaultdict(set)
+# Top level elements audited
+AUDIT_TAGS = ('node', 'way')
 
-# Counter for postal code types
-counter_postal_code_types = {'postal_code_no_space': 0, 'postal_code_with_space': 0, 'unknown': 0}
-
-# Counter for address name types
-counter_address_types = {"uppercase": 0, "capitalized": 0, "lower": 0, "uppercase_colon": 0, "capitalized_colon": 0,
-                "lower_colon": 0, "problem_chars": 0, "other": 0}
+# z score of the two sided 95% bounds of the sampled audit estimates
+SAMPLE_Z = 1.96
 
 # a list of regular expressions for auditing and cleaning street types
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
@@ -61,11 +53,8 @@ postal_code_no_space_re = re.compile(r'^([Gg][Ii][Rr] 0[Aa]{2})|((([A-Za-z][0-9]
 postal_code_with_space_re = re.compile(r'^([Gg][Ii][Rr] 0[Aa]{2})|((([A-Za-z][0-9]{1,2})|(([A-Za-z][A-Ha-hJ-Yj-y][0-9]{1,2})|(([A-Za-z][0-9][A-Za-z])|([A-Za-z][A-Ha-hJ-Yj-y][0-9]?[A-Za-z])))) {0,1}[0-9][A-Za-z]{2})$')
 
 
-# a set with all the candidate street types
-candidate_street_type_set = set()
-
-# expected street endings
-expected_list = ["Street", "Road", "Avenue", "Boulevard"]
+# expected street endings, every audit starts from them and appends the new valid street types it finds
+EXPECTED_STREET_TYPES = ["Street", "Road", "Avenue", "Boulevard"]
 
 # UPDATE THIS VARIABLE, this variable contains address' endings writen in different forms and have the same meaning
 # in order to contain this issue a mapping variable was created in order to map the different endings who have the
@@ -81,52 +70,6 @@ mapping = {"St": "Street", "street": "Street", "road": "Road", "St.": "Street",
            "Lower)": "Lower"}
 
 
-# the function audit the street names, extracts the street type and corrects possible street type abbreviations
-def audit_street_type(street_name):
-
-    # debug print
-    # print(street_name)
-
-    # get the final word which will be the street type from the address
-    candidate_street_type = street_type_re.search(street_name)
-
-    if candidate_street_type:
-        street_type = candidate_street_type.group()
-        street_type = street_type.strip()
-
-        # add the candidate street type into a set
-        candidate_street_type_set.add(street_type)
-
-        # cleaning process:
-        # omit street types that end with numbers or numbers with letters
-        check_for_strange_ending_address = cleaning_re_omit_streets_ending_with_numbers_re.search(street_type)
-        if not check_for_strange_ending_address:
-
-            # if the newly found street type is in the expected_list, then append to the dict with key
-            # the street type and value the street name
-            if street_type in expected_list:
-                # debug print
-                # print("expected street:", street_type, ",", street_name)
-                street_types[street_type].add(street_name)
-
-            # else if the newly found street type is not in expected list then search it in mapping list
-            elif street_type not in expected_list and street_type in mapping:
-
-                street_name = update_name(street_name)
-                # debug print
-                # print("mapping new key:", street_type, ",", street_name)
-                street_types[mapping[street_type]].add(street_name)
-
-            # else check if is a valid written in english street type then add it to expected list
-            elif street_type not in expected_list and street_type not in mapping:
-
-                if cleaning_re_at_least_three_words_re.search(street_type) and is_english_word(street_type):
-                    # debug print
-                    # print("Adding new key:", street_type, ",", street_name)
-                    street_types[street_type].add(street_name)
-                    expected_list.append(street_type)
-
-
 # A function which checks whether or not a string is written in english or not
 def is_english_word(s):
     try:
@@ -155,27 +98,6 @@ def is_number(v):
             return False
 
 
-# A function which categorizes an address based on the way is written
-def audit_address_name(element):
-
-        if lower_re.search(element):
-            counter_address_types['lower'] = counter_address_types['lower'] + 1
-        elif uppercase_re.search(element):
-            counter_address_types['uppercase'] = counter_address_types['uppercase'] + 1
-        elif capitalized_re.search(element):
-            counter_address_types['capitalized'] = counter_address_types['capitalized'] + 1
-        elif lower_colon_re.search(element):
-            counter_address_types['lower_colon'] = counter_address_types['lower_colon'] + 1
-        elif uppercase_colon_re.search(element):
-            counter_address_types['uppercase_colon'] = counter_address_types['uppercase_colon'] + 1
-        elif capitalized_colon_re.search(element):
-            counter_address_types['capitalized_colon'] = counter_address_types['capitalized_colon'] + 1
-        elif problem_chars_re.search(element):
-            counter_address_types['problem_chars'] = counter_address_types['problem_chars'] + 1
-        else:
-            counter_address_types['other'] = counter_address_types['other'] + 1
-
-
 # A function to audits the type of the attributes of an element
 def audit_attribute_type(types_dictionary, attributes):
     for attribute in attributes:
@@ -201,127 +123,393 @@ def audit_coordinates(coordinates_out_area, element_attributes):
     lati = float(element_attributes['lat'])
     longi = float(element_attributes['lon'])
     # Evaluates if the latitude and longitude fall outside the area of interest
-    if not (51.7573 < lati < 51.2550) or not (-0.8253 < longi < 0.5699):
+    min_lat, min_lon, max_lat, max_lon = AREA_BBOX
+    if not (min_lat < lati < max_lat) or not (min_lon < longi < max_lon):
         coordinates_out_area[node_id] = (lati, longi)
 
 
-# A function which audits postal codes and catagorizes based on the way are written
-def audit_postal_code(child_attributes):
-    if child_attributes['k'] == 'postal_code':
-        postal_code = child_attributes['v']
-        if postal_code_no_space_re.match(postal_code):
-            postal_code_types['postal_code_no_space'].add(postal_code)
-            counter_postal_code_types['postal_code_no_space'] += 1
-        elif postal_code_with_space_re.match(postal_code):
-            postal_code_types['postal_code_with_space'].add(postal_code)
-            counter_postal_code_types['postal_code_with_space'] += 1
-        else:
-            postal_code_types['unknown'].add(postal_code)
-            counter_postal_code_types['unknown'] += 1
+# Merge the sets of a defaultdict(set) into another one, new keys keep their first seen order
+def merge_sets(sets, other_sets):
+    for key, values in other_sets.items():
+        sets[key] |= values
 
 
-# The main audit node function
-def audit_node(element):
-    # get element's attributes
-    element_attribute = element.attrib
+class Audit(object):
+    """Every audit data structure of a run.
 
-    # audit node's attributes types
-    audit_attribute_type(node_field_types, element_attribute)
+    Audits of consecutive parts of a file merge, in file order, into the state a single audit of the whole file
+    would have: counters add up, sets and dictionaries are united and the street types a part appended to its
+    expected_list are appended in the order the part found them.
+    """
 
-    # audit node's coordinates if they are valid
-    audit_coordinates(coordinates_out_of_area, element_attribute)
+    def __init__(self):
+        # Dictionaries to store data types
+        self.node_field_types = defaultdict(set)
+        self.node_tag_field_types = defaultdict(set)
+        self.way_field_types = defaultdict(set)
+        self.way_tag_field_types = defaultdict(set)
+        self.way_node_field_types = defaultdict(set)
 
-    for tag in element.iter("tag"):
+        # Data structure used to store wrong coordinates
+        self.coordinates_out_of_area = {}
 
-        # get children Attributes
-        child_attributes = tag.attrib
+        # Data structure to store street types
+        self.street_types = defaultdict(set)
 
-        # audit child Type
-        audit_attribute_type(node_tag_field_types, child_attributes)
+        # Data structure to store postal code types
+        self.postal_code_types = defaultdict(set)
 
-        # audit postal codes
-        audit_postal_code(child_attributes)
+        # Counter for postal code types
+        self.counter_postal_code_types = {'postal_code_no_space': 0, 'postal_code_with_space': 0, 'unknown': 0}
 
-        # audit way Streets
-        if is_street_name(tag):
-            audit_address_name(tag.attrib['v'])
-            audit_street_type(tag.attrib['v'])
+        # Counter for address name types
+        self.counter_address_types = {"uppercase": 0, "capitalized": 0, "lower": 0, "uppercase_colon": 0,
+                                      "capitalized_colon": 0, "lower_colon": 0, "problem_chars": 0, "other": 0}
 
+        # a set with all the candidate street types
+        self.candidate_street_type_set = set()
 
-# The main audit way function
-def audit_way(element):
-    # get element attributes
-    element_attributes = element.attrib
+        # expected street endings
+        self.expected_list = list(EXPECTED_STREET_TYPES)
 
-    # check element attribute types
-    audit_attribute_type(way_field_types, element_attributes)
+    # the function audit the street names, extracts the street type and corrects possible street type abbreviations
+    def audit_street_type(self, street_name):
+        expected_list = self.expected_list
+        street_types = self.street_types
 
-    for tag in element.iter("tag"):
+        # get the final word which will be the street type from the address
+        candidate_street_type = street_type_re.search(street_name)
 
-        # get children attributes
-        child_attributes = tag.attrib
+        if candidate_street_type:
+            street_type = candidate_street_type.group()
+            street_type = street_type.strip()
 
-        # audit child type
-        audit_attribute_type(way_tag_field_types, child_attributes)
+            # add the candidate street type into a set
+            self.candidate_street_type_set.add(street_type)
 
-        # audit postal codes
-        audit_postal_code(child_attributes)
+            # cleaning process:
+            # omit street types that end with numbers or numbers with letters
+            check_for_strange_ending_address = cleaning_re_omit_streets_ending_with_numbers_re.search(street_type)
+            if not check_for_strange_ending_address:
 
-        # audit nodes Streets
-        if is_street_name(tag):
-            audit_address_name(tag.attrib['v'])
-            audit_street_type(tag.attrib['v'])
+                # if the newly found street type is in the expected_list, then append to the dict with key
+                # the street type and value the street name
+                if street_type in expected_list:
+                    street_types[street_type].add(street_name)
 
-    # get way children nd tags
-    for child in element.iter('nd'):
+                # else if the newly found street type is not in expected list then search it in mapping list
+                elif street_type not in expected_list and street_type in mapping:
 
-        # get children attributes
-        child_attributes = child.attrib
-        # print(child_attributes)
+                    street_name = self.update_name(street_name)
+                    street_types[mapping[street_type]].add(street_name)
 
-        # audit nd types
-        audit_attribute_type(way_node_field_types, child_attributes)
+                # else check if is a valid written in english street type then add it to expected list
+                elif street_type not in expected_list and street_type not in mapping:
 
+                    if cleaning_re_at_least_three_words_re.search(street_type) and is_english_word(street_type):
+                        street_types[street_type].add(street_name)
+                        expected_list.append(street_type)
 
-# The main audit function
-def audit(osmfile):
-    # open the file with encoding = utf8 for windows
-    osm_file = open(osmfile, "r", encoding="utf8")
+    # A function which categorizes an address based on the way is written
+    def audit_address_name(self, element):
+        counter_address_types = self.counter_address_types
+
+        if lower_re.search(element):
+            counter_address_types['lower'] = counter_address_types['lower'] + 1
+        elif uppercase_re.search(element):
+            counter_address_types['uppercase'] = counter_address_types['uppercase'] + 1
+        elif capitalized_re.search(element):
+            counter_address_types['capitalized'] = counter_address_types['capitalized'] + 1
+        elif lower_colon_re.search(element):
+            counter_address_types['lower_colon'] = counter_address_types['lower_colon'] + 1
+        elif uppercase_colon_re.search(element):
+            counter_address_types['uppercase_colon'] = counter_address_types['uppercase_colon'] + 1
+        elif capitalized_colon_re.search(element):
+            counter_address_types['capitalized_colon'] = counter_address_types['capitalized_colon'] + 1
+        elif problem_chars_re.search(element):
+            counter_address_types['problem_chars'] = counter_address_types['problem_chars'] + 1
+        else:
+            counter_address_types['other'] = counter_address_types['other'] + 1
 
-    # iterate through every main tag from the xml file
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
+    # A function which audits postal codes and catagorizes based on the way are written
+    def audit_postal_code(self, child_attributes):
+        if child_attributes['k'] == 'postal_code':
+            postal_code = child_attributes['v']
+            if postal_code_no_space_re.match(postal_code):
+                self.postal_code_types['postal_code_no_space'].add(postal_code)
+                self.counter_postal_code_types['postal_code_no_space'] += 1
+            elif postal_code_with_space_re.match(postal_code):
+                self.postal_code_types['postal_code_with_space'].add(postal_code)
+                self.counter_postal_code_types['postal_code_with_space'] += 1
+            else:
+                self.postal_code_types['unknown'].add(postal_code)
+                self.counter_postal_code_types['unknown'] += 1
+
+    # The main audit node function
+    def audit_node(self, element):
+        # get element's attributes
+        element_attribute = element.attrib
+
+        # audit node's attributes types
+        audit_attribute_type(self.node_field_types, element_attribute)
+
+        # audit node's coordinates if they are valid
+        audit_coordinates(self.coordinates_out_of_area, element_attribute)
+
+        for tag in element.iter("tag"):
+
+            # get children Attributes
+            child_attributes = tag.attrib
+
+            # audit child Type
+            audit_attribute_type(self.node_tag_field_types, child_attributes)
+
+            # audit postal codes
+            self.audit_postal_code(child_attributes)
+
+            # audit way Streets
+            if is_street_name(tag):
+                self.audit_address_name(tag.attrib['v'])
+                self.audit_street_type(tag.attrib['v'])
+
+    # The main audit way function
+    def audit_way(self, element):
+        # get element attributes
+        element_attributes = element.attrib
+
+        # check element attribute types
+        audit_attribute_type(self.way_field_types, element_attributes)
+
+        for tag in element.iter("tag"):
+
+            # get children attributes
+            child_attributes = tag.attrib
+
+            # audit child type
+            audit_attribute_type(self.way_tag_field_types, child_attributes)
+
+            # audit postal codes
+            self.audit_postal_code(child_attributes)
+
+            # audit nodes Streets
+            if is_street_name(tag):
+                self.audit_address_name(tag.attrib['v'])
+                self.audit_street_type(tag.attrib['v'])
+
+        # get way children nd tags
+        for child in element.iter('nd'):
+
+            # audit nd types
+            audit_attribute_type(self.way_node_field_types, child.attrib)
+
+    def audit_elements(self, elements):
+        for elem in elements:
+            if elem.tag == "node":
+                self.audit_node(elem)
+            elif elem.tag == "way":
+                self.audit_way(elem)
+
+    def update_name(self, name):
+        m = street_type_re.search(name)
+        if m:
+            street_type = m.group()
+            if street_type not in self.expected_list and street_type in mapping:
+                name = re.sub(street_type_re, mapping[street_type], name)
+
+        return name
+
+    def merge(self, other):
+        """Add the audit of the part of the file that follows this one, in place"""
+        for types, other_types in ((self.node_field_types, other.node_field_types),
+                                   (self.node_tag_field_types, other.node_tag_field_types),
+                                   (self.way_field_types, other.way_field_types),
+                                   (self.way_tag_field_types, other.way_tag_field_types),
+                                   (self.way_node_field_types, other.way_node_field_types),
+                                   (self.street_types, other.street_types),
+                                   (self.postal_code_types, other.postal_code_types)):
+            merge_sets(types, other_types)
+        self.coordinates_out_of_area.update(other.coordinates_out_of_area)
+        for counter, other_counter in ((self.counter_postal_code_types, other.counter_postal_code_types),
+                                       (self.counter_address_types, other.counter_address_types)):
+            for key, count in other_counter.items():
+                counter[key] += count
+        self.candidate_street_type_set |= other.candidate_street_type_set
+        for street_type in other.expected_list:
+            if street_type not in self.expected_list:
+                self.expected_list.append(street_type)
+        return self
+
+    def results(self):
+        """The audit data structures by name"""
+        return {'expected_list': self.expected_list,
+                'street_types': self.street_types,
+                'counter_postal_code_types': self.counter_postal_code_types,
+                'counter_address_types': self.counter_address_types,
+                'coordinates_out_of_area': self.coordinates_out_of_area,
+                'node_field_types': self.node_field_types,
+                'node_tag_field_types': self.node_tag_field_types,
+                'way_field_types': self.way_field_types,
+                'way_tag_field_types': self.way_tag_field_types,
+                'way_node_field_types': self.way_node_field_types}
+
+
+# The audit of the module functions, its data structures are also available under their historic module names
+AUDIT = Audit()
+node_field_types = AUDIT.node_field_types
+node_tag_field_types = AUDIT.node_tag_field_types
+way_field_types = AUDIT.way_field_types
+way_tag_field_types = AUDIT.way_tag_field_types
+way_node_field_types = AUDIT.way_node_field_types
+coordinates_out_of_area = AUDIT.coordinates_out_of_area
+street_types = AUDIT.street_types
+postal_code_types = AUDIT.postal_code_types
+counter_postal_code_types = AUDIT.counter_postal_code_types
+counter_address_types = AUDIT.counter_address_types
+candidate_street_type_set = AUDIT.candidate_street_type_set
+expected_list = AUDIT.expected_list
 
-        if elem.tag == "node":
-            audit_node(elem)
-        elif elem.tag == "way":
-            audit_way(elem)
 
-        elem.clear()
-    osm_file.close()
+def audit_street_type(street_name):
+    AUDIT.audit_street_type(street_name)
 
 
-def update_name(name):
-    m = street_type_re.search(name)
-    if m:
-        street_type = m.group()
-        if street_type not in expected_list and street_type in mapping:
-            name = re.sub(street_type_re, mapping[street_type], name)
+def audit_address_name(element):
+    AUDIT.audit_address_name(element)
 
-    return name
 
+def audit_postal_code(child_attributes):
+    AUDIT.audit_postal_code(child_attributes)
 
-if __name__ == '__main__':
-    # here is the __main__ area where the auditing procedure will be executed
 
-    start_time = time.time()
+def audit_node(element):
+    AUDIT.audit_node(element)
 
-    # start the main audit function
-    audit(OSMFILE)
-    #
-    #
+
+def audit_way(element):
+    AUDIT.audit_way(element)
+
+
+def update_name(name):
+    return AUDIT.update_name(name)
+
+
+# Audit one byte range of a plain .osm file on a worker process
+def audit_shard(args):
+    osmfile, start, end = args
+    shard_audit = Audit()
+    shard_file = ShardFile(osmfile, start, end)
+    try:
+        shard_audit.audit_elements(osm_parsers.iter_elements(shard_file, AUDIT_TAGS))
+    finally:
+        shard_file.close()
+    return shard_audit
+
+
+# The main audit function
+def audit(osmfile, workers=1, into=AUDIT):
+    """Audit the complete node and way elements of osmfile into the given Audit, the module one by default, and
+    return it. With workers > 1 a plain .osm file is split into byte range shards audited on as many processes and
+    merged in file order, .osm.pbf blocks and .bz2 streams are decoded on the workers instead."""
+    if workers > 1 and not osm_pbf.is_pbf(osmfile) and not osm_parsers.is_compressed(osmfile):
+        pool = multiprocessing.Pool(workers)
+        try:
+            # imap() returns the shard audits in the order of the input file
+            for shard_audit in pool.imap(audit_shard, [(osmfile, start, end) for start, end in
+                                                       find_shard_boundaries(osmfile, workers)]):
+                into.merge(shard_audit)
+        finally:
+            pool.close()
+            pool.join()
+        return into
+
+    # complete node and way elements, one at a time, compressed files are decompressed on the fly and .osm.pbf
+    # blocks decoded on the workers
+    into.audit_elements(osm_parsers.iter_osm(osmfile, AUDIT_TAGS, workers=workers))
+    return into
+
+
+# The counters a sampled audit estimates, keyed by (data structure, key)
+def counter_values(audit_data):
+    values = {}
+    for name in ('counter_postal_code_types', 'counter_address_types'):
+        for key, count in getattr(audit_data, name).items():
+            values[(name, key)] = count
+    values[('coordinates_out_of_area', 'nodes')] = len(audit_data.coordinates_out_of_area)
+    return values
+
+
+def estimate_counters(strata, z=SAMPLE_Z):
+    """Stratified estimates of the counters of the whole file and the half widths of their confidence intervals
+
+    Within a stratum the systematic sample is treated as a simple random one, the estimate of a total is the
+    population times the mean per sampled element and its variance carries the finite population correction.
+    The sample variance of a counter few sampled elements hit says little, none at all when no sampled element hits
+    it, so the half width is the larger of the normal one and of the upper half of the Poisson score interval of the
+    hits of each stratum, z * z / 2 + z * sqrt(hits + z * z / 4), scaled to the population. That bound is not zero
+    for a counter no sampled element hits, but a counter only a handful of elements of the file hit is still not
+    covered at the 95% level: when the sample misses them all, the true count may exceed the bound.
+    """
+    estimates = defaultdict(dict)
+    for name, key in sorted(counter_values(Audit())):
+        total = variance = poisson_variance = 0.0
+        for stratum in strata.values():
+            population, sampled = stratum['population'], stratum['sampled']
+            if not sampled:
+                continue
+            hits = stratum['sums'][(name, key)]
+            mean = hits / sampled
+            total += population * mean
+            correction = 1 - sampled / population
+            poisson_bound = population / sampled * (z * z / 2 + z * math.sqrt(hits + z * z / 4))
+            poisson_variance += correction * poisson_bound * poisson_bound
+            if sampled > 1:
+                sample_variance = (stratum['squares'][(name, key)] - sampled * mean * mean) / (sampled - 1)
+                variance += population * population * correction * sample_variance / sampled
+        bound = max(z * math.sqrt(max(variance, 0.0)), math.sqrt(poisson_variance))
+        estimates[name][key] = {'estimate': round(total, 1), 'bound': round(bound, 1)}
+    return dict(estimates)
+
+
+# The sampled audit function
+def audit_sample(osmfile, every=100, workers=1, into=AUDIT):
+    """Audit every Kth node and every Kth way of osmfile into the given Audit and return the number of elements
+    read and audited per type and the estimates of the counters of the whole file (see estimate_counters).
+
+    The sets and lists of the Audit only hold what the sample shows, a rare street type may be missing from them.
+    """
+    if every < 1:
+        raise ValueError("every must be a positive number of elements, not {0}".format(every))
+    elements = osm_parsers.iter_osm(osmfile, AUDIT_TAGS, workers=workers)
+
+    strata = dict((tag, {'population': 0, 'sampled': 0, 'sums': defaultdict(int), 'squares': defaultdict(int)})
+                  for tag in AUDIT_TAGS)
+    for elem in elements:
+        stratum = strata[elem.tag]
+        index = stratum['population']
+        stratum['population'] += 1
+        if index % every:
+            continue
+
+        # the counts this element adds are the sampled values of the estimated totals
+        before = counter_values(into)
+        into.audit_elements((elem,))
+        stratum['sampled'] += 1
+        for key, value in counter_values(into).items():
+            added = value - before[key]
+            if added:
+                stratum['sums'][key] += added
+                stratum['squares'][key] += added * added
+
+    return {'elements': dict((tag, {'read': stratum['population'], 'audited': stratum['sampled']})
+                             for tag, stratum in strata.items()),
+            'estimates': estimate_counters(strata)}
+
+
+# Print every audit data structure
+def print_audit_report(audit_data=AUDIT):
     print()
     print("expected list:")
-    pprint.pprint(sorted(expected_list))
+    pprint.pprint(sorted(audit_data.expected_list))
     #
     #
     print()
@@ -331,47 +519,78 @@ if __name__ == '__main__':
     #
     print()
     print("street_types:")
-    pprint.pprint(street_types)
+    pprint.pprint(audit_data.street_types)
     #
     #
     print()
     print("counter_postal_code_types:")
-    pprint.pprint(counter_postal_code_types)
+    pprint.pprint(audit_data.counter_postal_code_types)
     #
     #
     print()
     print("counter_address_types:")
-    pprint.pprint(counter_address_types)
+    pprint.pprint(audit_data.counter_address_types)
     #
     #
     print()
     print("number of coordinates_out_of_area:")
-    pprint.pprint(len(coordinates_out_of_area))
+    pprint.pprint(len(audit_data.coordinates_out_of_area))
     #
     #
     print()
     print("node_field_types:")
-    pprint.pprint(node_field_types)
+    pprint.pprint(audit_data.node_field_types)
     #
     #
     print()
     print("node_tag_field_types:")
-    pprint.pprint(node_tag_field_types)
+    pprint.pprint(audit_data.node_tag_field_types)
     #
     #
     print()
     print("was_fields_types:")
-    pprint.pprint(way_field_types)
+    pprint.pprint(audit_data.way_field_types)
     #
     #
     print()
     print("way_tag_field_types:")
-    pprint.pprint(way_tag_field_types)
+    pprint.pprint(audit_data.way_tag_field_types)
     #
     #
     print()
     print("way_node_field_types:")
-    pprint.pprint(way_node_field_types)
+    pprint.pprint(audit_data.way_node_field_types)
+
+
+if __name__ == '__main__':
+    # here is the __main__ area where the auditing procedure will be executed
+    parser = argparse.ArgumentParser(description='Audit the street names, postcodes, coordinates and field types '
+                                                 'of an OSM file')
+    parser.add_argument('osm_file', nargs='?', default=OSMFILE, help='input .osm, .osm.bz2/.gz/.xz or .osm.pbf file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes auditing byte range shards of the file, '
+                             'or decoding .osm.pbf blocks and .bz2 streams')
+    parser.add_argument('--sample', type=int, metavar='K',
+                        help='audit every Kth node and way only and estimate the counters of the whole file')
+    args = parser.parse_args()
+
+    start_time = time.time()
+
+    # start the main audit function, or its sampled version
+    if args.sample:
+        sample_report = audit_sample(args.osm_file, args.sample, args.workers)
+    else:
+        audit(args.osm_file, args.workers)
+    #
+    #
+    print_audit_report()
+    if args.sample:
+        print()
+        print("audited elements:")
+        pprint.pprint(sample_report['elements'])
+        print()
+        print("estimated counters of the whole file (estimate +/- bound at 95%):")
+        pprint.pprint(sample_report['estimates'])
     #
     #
     print()
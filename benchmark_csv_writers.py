@@ -0,0 +1,56 @@
+"""
+Time and peak memory of the dict based csv path (write_csvs) against the columnar one (write_csvs_columnar).
+
+Both paths convert the same file into a temporary directory, the peak memory is the tracemalloc peak of the Python
+allocations and the csv(s) of the two paths are compared byte for byte.
+"""
+import argparse
+import filecmp
+import os
+import pprint
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from from_osm_to_csv import get_element, write_csvs, write_csvs_columnar, OSM_PATH, ELEMENT_TAGS, CSV_PATHS
+
+CSV_NAMES = CSV_PATHS
+
+
+def measure(write, osm_file, out_dir, backend='etree'):
+    """Run one csv path and return its seconds and tracemalloc peak"""
+    paths = [os.path.join(out_dir, name) for name in CSV_NAMES]
+    tracemalloc.start()
+    start_time = time.time()
+    write(get_element(osm_file, tags=ELEMENT_TAGS, backend=backend), paths, validate=False)
+    seconds = time.time() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(seconds, 3), 'peak_mib': round(peak / 1048576.0, 2)}
+
+
+def compare_csv_paths(osm_file, backend='etree'):
+    out_dir = tempfile.mkdtemp(prefix='osm_csv_bench_')
+    try:
+        dict_dir = os.path.join(out_dir, 'dict')
+        columnar_dir = os.path.join(out_dir, 'columnar')
+        os.mkdir(dict_dir)
+        os.mkdir(columnar_dir)
+
+        report = {'dict': measure(write_csvs, osm_file, dict_dir, backend),
+                  'columnar': measure(write_csvs_columnar, osm_file, columnar_dir, backend)}
+        report['byte_identical'] = all(filecmp.cmp(os.path.join(dict_dir, name), os.path.join(columnar_dir, name),
+                                                   shallow=False) for name in CSV_NAMES)
+        return report
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the dict and columnar csv paths')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm file')
+    parser.add_argument('--parser', default='etree', help='XML parser backend')
+    args = parser.parse_args()
+
+    pprint.pprint(compare_csv_paths(args.osm_file, args.parser))
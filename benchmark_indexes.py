@@ -0,0 +1,197 @@
+"""
+Query plans and latency of an analytic workload on a loaded database, and the covering indexes that would help it.
+
+Every query of WORKLOAD runs against the database with EXPLAIN QUERY PLAN and is timed. The tables a plan scans in
+full, or builds an automatic index on, get a candidate covering index: the columns the query compares first, then
+the other columns of the table the query names. With --build the candidates are created, ANALYZE runs, the workload
+is timed again and checked to give the same answers, and the candidates no plan uses are dropped. The databases of
+from_osm_to_sqlite already have the INDEXES of the loader, the ones imported from the csvs with the bare schema
+have none.
+"""
+import argparse
+import pprint
+import re
+import sqlite3
+
+from benchmark_tag_storage import QUERIES, time_query
+from from_osm_to_sqlite import DB_PATH
+from osm_reports import REPORTS
+
+# Analytic queries, with the query that picks their parameters from the database or None
+WORKLOAD = dict((name, (query, None)) for name, query in QUERIES.items())
+WORKLOAD.update({
+    'top_contributors': (REPORTS['top_contributors'][1], "SELECT 10"),
+    'amenity_names': (REPORTS['amenity_tag_values'][1], "SELECT 'fast_food', 'name', 5"),
+    'ways_of_node': ("SELECT id, position FROM ways_nodes WHERE node_id = ?", "SELECT MAX(node_id) FROM ways_nodes"),
+    'nodes_of_way': ("SELECT nodes.id, nodes.lat, nodes.lon FROM ways_nodes "
+                     "JOIN nodes ON nodes.id = ways_nodes.node_id WHERE ways_nodes.id = ? "
+                     "ORDER BY ways_nodes.position", "SELECT MAX(id) FROM ways_nodes"),
+    'relations_of_way': ("SELECT id, role FROM relations_members WHERE type = 'way' AND member_id = ?",
+                         "SELECT MAX(member_id) FROM relations_members WHERE type = 'way'"),
+    'ways_of_tag': ("SELECT id FROM ways_tags WHERE key = ? AND value = ?", "SELECT 'highway', 'residential'"),
+})
+
+# Prefix of the names of the advised indexes
+INDEX_PREFIX = 'advised_'
+
+# Table names and aliases of the FROM and JOIN clauses, and the columns compared by a query
+TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+COMPARISON_PATTERN = re.compile(r'\b(?:(\w+)\.)?(\w+)\s*(=|IN\b|LIKE\b|<|>)', re.IGNORECASE)
+# Plan steps reading a whole table, the covering index scans excepted, or building an automatic index on it
+FULL_SCAN_PATTERN = re.compile(r'^(?:SCAN (\w+)(?!.*COVERING INDEX)|SEARCH (\w+) USING AUTOMATIC)')
+# Plan steps using an index
+INDEX_USE_PATTERN = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+# Keywords the table pattern picks up as aliases
+SQL_KEYWORDS = {'where', 'join', 'on', 'group', 'order', 'limit', 'union', 'left', 'inner', 'cross'}
+
+
+def query_plan(connection, query, parameters=()):
+    return [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + query, parameters)]
+
+
+def table_columns(connection):
+    """Columns of every table of the database, views and virtual tables left out"""
+    tables = [name for (name,) in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql NOT LIKE 'CREATE VIRTUAL%' "
+        "AND name NOT LIKE 'sqlite_%'")]
+    return dict((table, [row[1] for row in connection.execute("PRAGMA table_info({0})".format(table))])
+                for table in tables)
+
+
+def query_aliases(query):
+    """Tables of the FROM and JOIN clauses of a query, keyed by their names and aliases"""
+    aliases = {}
+    for table, alias in TABLE_PATTERN.findall(query):
+        aliases[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def scanned_tables(query, plan, columns):
+    """Tables of the database a plan reads in full"""
+    aliases = query_aliases(query)
+    tables = []
+    for detail in plan:
+        match = FULL_SCAN_PATTERN.match(detail)
+        if match:
+            table = aliases.get(match.group(1) or match.group(2))
+            if table in columns and table not in tables:
+                tables.append(table)
+    return tables
+
+
+def candidate_index(query, table, columns):
+    """Columns of a covering index of table for query: the compared ones, equalities first, then the others named"""
+    aliases = query_aliases(query)
+    equalities, comparisons = [], []
+    for alias, column, operator in COMPARISON_PATTERN.findall(query):
+        # the aliases of subqueries are not in aliases and may stand for any table
+        if column not in columns or aliases.get(alias, table) != table:
+            continue
+        (equalities if operator.upper() in ('=', 'IN') else comparisons).append(column)
+    named = set(re.findall(r'\w+', query))
+    index = []
+    for column in equalities + comparisons + [column for column in columns if column in named]:
+        if column not in index:
+            index.append(column)
+    return index
+
+
+def index_statement(table, index):
+    return "CREATE INDEX IF NOT EXISTS {0}{1}_{2} ON {1} ({3})".format(
+        INDEX_PREFIX, table, '_'.join(index), ', '.join(index))
+
+
+def existing_indexes(connection, table):
+    """Column lists of the indexes of a table"""
+    return [[row[2] for row in connection.execute("PRAGMA index_info({0})".format(name))]
+            for (name,) in connection.execute("SELECT name FROM pragma_index_list(?)", (table,))]
+
+
+def run_workload(connection, workload, repeat):
+    """Plan, best time and answer of every query of the workload"""
+    runs = {}
+    for name, (query, parameters_query) in sorted(workload.items()):
+        parameters = connection.execute(parameters_query).fetchone() if parameters_query else ()
+        seconds, answer = time_query(connection, query, repeat, parameters)
+        runs[name] = {'plan': query_plan(connection, query, parameters), 'ms': round(seconds * 1000, 3),
+                      'answer': answer}
+    return runs
+
+
+def advise_indexes(connection, workload, runs):
+    """CREATE INDEX statements of the candidate indexes of the queries and the queries asking for each"""
+    columns = table_columns(connection)
+    candidates = {}
+    for name, (query, _) in sorted(workload.items()):
+        for table in scanned_tables(query, runs[name]['plan'], columns):
+            index = candidate_index(query, table, columns[table])
+            # an index whose columns start with the candidate already serves it
+            if index and not any(existing[:len(index)] == index for existing in existing_indexes(connection, table)):
+                candidates.setdefault((table, tuple(index)), []).append(name)
+
+    advice = {}
+    for (table, index), names in sorted(candidates.items()):
+        # and so does a longer candidate starting with it
+        longer = [other for other in candidates if other[0] == table and len(other[1]) > len(index) and
+                  other[1][:len(index)] == index]
+        if longer:
+            candidates[max(longer)].extend(names)
+    for (table, index), names in sorted(candidates.items()):
+        if not any(other[0] == table and len(other[1]) > len(index) and other[1][:len(index)] == index
+                   for other in candidates):
+            advice[index_statement(table, index)] = sorted(set(names))
+    return advice
+
+
+def benchmark_indexes(db_path, build=False, repeat=5, workload=WORKLOAD):
+    connection = sqlite3.connect(db_path)
+    try:
+        before = run_workload(connection, workload, repeat)
+        advice = advise_indexes(connection, workload, before)
+        report = {'queries': dict((name, {'plan': run['plan'], 'ms': run['ms']}) for name, run in before.items()),
+                  'advised_indexes': advice}
+        if not build:
+            return report
+
+        with connection:
+            for statement in advice:
+                connection.execute(statement)
+            connection.execute("ANALYZE")
+        after = run_workload(connection, workload, repeat)
+
+        used = set()
+        for name, run in after.items():
+            used.update(INDEX_USE_PATTERN.findall(' '.join(run['plan'])))
+            report['queries'][name] = {'plan_before': before[name]['plan'], 'plan_after': run['plan'],
+                                       'ms_before': before[name]['ms'], 'ms_after': run['ms'],
+                                       'speedup': round(before[name]['ms'] / run['ms'], 1) if run['ms'] else None,
+                                       'plan_changed': before[name]['plan'] != run['plan'],
+                                       'same_answer': before[name]['answer'] == run['answer']}
+        # the candidates no plan picked only cost space and insert time
+        report['built_indexes'], report['dropped_indexes'] = [], []
+        with connection:
+            for statement in advice:
+                index_name = statement.split()[5]
+                if index_name in used:
+                    report['built_indexes'].append(statement)
+                else:
+                    connection.execute("DROP INDEX {0}".format(index_name))
+                    report['dropped_indexes'].append(statement)
+        return report
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query plans and latency of the analytic workload and the covering '
+                                                 'indexes that would help it')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database loaded by from_osm_to_sqlite.py')
+    parser.add_argument('--build', action='store_true', help='build the advised indexes, run ANALYZE and time the '
+                                                             'workload again')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each query, the best one is reported')
+    args = parser.parse_args()
+
+    pprint.pprint(benchmark_indexes(args.db, args.build, args.repeat))
@@ -0,0 +1,55 @@
+"""
+Throughput benchmark of the XML parser backends of osm_parsers.
+
+Every backend streams the same file, the elements per second are measured for parsing alone and for parsing
+followed by shape_element, and the shaped dicts of every backend are checked against the stdlib ElementTree ones.
+"""
+import argparse
+import hashlib
+import pprint
+import time
+
+import osm_parsers
+from from_osm_to_csv import shape_element, OSM_PATH
+
+
+def benchmark_backend(osm_file, backend, tags=('node', 'way')):
+    """Return elements/sec for parsing and for parsing plus shaping, and a digest of the shaped dicts"""
+    start_time = time.time()
+    count = 0
+    for _ in osm_parsers.BACKENDS[backend](osm_file, tags):
+        count += 1
+    parse_seconds = time.time() - start_time
+
+    digest = hashlib.md5()
+    start_time = time.time()
+    for element in osm_parsers.BACKENDS[backend](osm_file, tags):
+        digest.update(repr(shape_element(element)).encode('utf8'))
+    shape_seconds = time.time() - start_time
+
+    return {'elements': count,
+            'parse_elements_per_sec': int(count / parse_seconds) if parse_seconds else 0,
+            'shape_elements_per_sec': int(count / shape_seconds) if shape_seconds else 0,
+            'digest': digest.hexdigest()}
+
+
+def benchmark_backends(osm_file, backends=None):
+    """Benchmark every available backend and flag the ones whose shaped dicts differ from etree"""
+    results = {}
+    for backend in backends or osm_parsers.available_backends():
+        results[backend] = benchmark_backend(osm_file, backend)
+
+    reference = results.get('etree', {}).get('digest')
+    for result in results.values():
+        result['same_as_etree'] = reference is None or result['digest'] == reference
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the XML parser backends')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm file')
+    parser.add_argument('--parser', action='append', choices=sorted(osm_parsers.BACKENDS),
+                        help='backend to benchmark, may be repeated (default: every available backend)')
+    args = parser.parse_args()
+
+    pprint.pprint(benchmark_backends(args.osm_file, args.parser))
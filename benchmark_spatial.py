@@ -0,0 +1,69 @@
+"""
+Queries per second of the osm_spatial area queries with the R*Tree index against the same queries in plain SQL.
+
+Random query points are drawn with a fixed seed inside the bounding box of the nodes, every query runs in both modes
+and the two answers are checked to be the same.
+"""
+import argparse
+import pprint
+import random
+import sqlite3
+import time
+
+import osm_spatial
+from from_osm_to_sqlite import DB_PATH
+
+# Side of the bbox queries and radius of the radius queries, in metres
+BBOX_SIZE = 1000.0
+RADIUS = 500.0
+
+
+def time_queries(function, queries):
+    """Seconds to answer every query and the answers"""
+    start_time = time.perf_counter()
+    answers = [function(*query) for query in queries]
+    return time.perf_counter() - start_time, answers
+
+
+def benchmark_spatial(db_path, queries=50, seed=1):
+    connection = sqlite3.connect(db_path)
+    try:
+        if not osm_spatial.has_spatial_index(connection):
+            with connection:
+                osm_spatial.build_spatial_index(connection)
+
+        min_lat, max_lat, min_lon, max_lon = connection.execute(
+            "SELECT MIN(lat), MAX(lat), MIN(lon), MAX(lon) FROM nodes").fetchone()
+        rng = random.Random(seed)
+        points = [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(queries)]
+
+        benchmarks = {
+            'elements_in_bbox': (lambda lat, lon, indexed: osm_spatial.elements_in_bbox(
+                connection, osm_spatial.radius_bbox(lat, lon, BBOX_SIZE / 2), indexed)),
+            'nearest_amenity': (lambda lat, lon, indexed: osm_spatial.nearest_amenity(
+                connection, lat, lon, indexed=indexed)),
+            'tags_within_radius': (lambda lat, lon, indexed: osm_spatial.tags_within_radius(
+                connection, lat, lon, RADIUS, indexed=indexed)),
+        }
+
+        report = {}
+        for name, query in sorted(benchmarks.items()):
+            indexed_seconds, indexed_answers = time_queries(query, [point + (True,) for point in points])
+            plain_seconds, plain_answers = time_queries(query, [point + (False,) for point in points])
+            report[name] = {'indexed_queries_per_sec': round(queries / indexed_seconds, 1),
+                            'sql_queries_per_sec': round(queries / plain_seconds, 1),
+                            'speedup': round(plain_seconds / indexed_seconds, 1),
+                            'same_answers': indexed_answers == plain_answers}
+        return report
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the R*Tree area queries against plain SQL')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database loaded by from_osm_to_sqlite.py')
+    parser.add_argument('--queries', type=int, default=50, help='queries of each kind')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the query points')
+    args = parser.parse_args()
+
+    pprint.pprint(benchmark_spatial(args.db, args.queries, args.seed))
@@ -0,0 +1,301 @@
+"""
+Reproducible benchmark suite of the cleaning and conversion code.
+
+A synthetic map is written by generate_osm with a fixed seed (or an existing file is used), then
+- the hot functions shape_element, update_street_name, update_postal_code, audit.update_name, validate_element,
+  get_element, audit.audit and both mapparser counters are timed in process, best of --repeat runs,
+- every script runs end to end in its own process, measuring elements/sec and the peak RSS of that process,
+- with --memory-scaling, the five entry points streaming through osm_parsers.iter_osm run on synthetic maps of
+  growing size and their peak RSS must stay flat, the process exits with an error otherwise.
+
+The results are saved as JSON in benchmark_results/ and --compare prints the speed ratio against an earlier run.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import pprint
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import audit
+import mapparser
+import osm_parsers
+from generate_osm import generate_osm
+from from_osm_to_csv import shape_element, update_street_name, update_postal_code, validate_element, get_element, \
+    clean_street_name, clean_postal_code
+from schema_validator import CompiledValidator
+
+# Directory of the saved results
+RESULTS_DIR = "benchmark_results"
+
+# Elements loaded in memory for the micro-benchmarks
+MICRO_ELEMENTS = 20000
+
+# Directory of the scripts run end to end
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Converting processes of the pipelined conversion, one core is left to the process writing the csv(s)
+PIPELINE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Scripts run end to end, the target (a script path or Python code) and its arguments for an input file and an
+# output directory
+END_TO_END = {
+    'from_osm_to_csv': lambda osm_file, out_dir: [os.path.join(REPO_DIR, 'from_osm_to_csv.py'), osm_file],
+    'from_osm_to_csv.pipeline': lambda osm_file, out_dir: [os.path.join(REPO_DIR, 'from_osm_to_csv.py'), osm_file,
+                                                           '--pipeline', str(PIPELINE_WORKERS)],
+    'from_osm_to_sqlite': lambda osm_file, out_dir: [os.path.join(REPO_DIR, 'from_osm_to_sqlite.py'), osm_file,
+                                                     '--db', os.path.join(out_dir, 'benchmark.db')],
+    'analyse_osm': lambda osm_file, out_dir: [os.path.join(REPO_DIR, 'analyse_osm.py'), osm_file],
+    # the scripts below read a fixed path in __main__, their main function is called instead
+    'audit': lambda osm_file, out_dir: ['import sys, audit; audit.audit(sys.argv[1])', osm_file],
+    'mapparser': lambda osm_file, out_dir: ['import sys, mapparser; mapparser.count_tags(sys.argv[1])', osm_file],
+    'count_k_attribute_value': lambda osm_file, out_dir: [
+        'import sys, count_k_attribute_value as c; c.get_types_of_k_attrib(sys.argv[1], {})', osm_file],
+}
+
+# Entry points streaming through osm_parsers.iter_osm, as code targets run on an input file. get_element only keeps
+# the relations, which come last, so every node and way has to be dropped without being handed out.
+STREAMING_ENTRY_POINTS = {
+    'audit.audit': 'import sys, audit; audit.audit(sys.argv[1])',
+    'mapparser.count_tags': 'import sys, mapparser; mapparser.count_tags(sys.argv[1])',
+    'count_k_attribute_value.get_types_of_k_attrib':
+        'import sys, count_k_attribute_value as c; c.get_types_of_k_attrib(sys.argv[1], {})',
+    'from_osm_to_csv.get_element':
+        "import sys, from_osm_to_csv as f; [0 for _ in f.get_element(sys.argv[1], tags=('relation',))]",
+    'analyse_osm.analyse':
+        'import sys, analyse_osm as a; a.analyse(sys.argv[1], [a.TagCounter(), a.KAttribCounter(), a.AuditVisitor()])',
+}
+
+# Sizes of the synthetic maps of the memory check, in multiples of the generator nodes, and the peak RSS growth in
+# MiB from the smallest to the largest map still counted as flat
+MEMORY_SCALES = (1, 4)
+MEMORY_GROWTH_MIB = 4.0
+
+# Child process launcher running a target and printing its own peak RSS in KiB as the last stderr line. The peak
+# is read from /proc because on Linux ru_maxrss carries the high-water mark of the forking parent across exec.
+LAUNCHER = """
+import resource, runpy, sys
+target = sys.argv[1]
+sys.argv = sys.argv[1:]
+try:
+    if target.endswith('.py'):
+        runpy.run_path(target, run_name='__main__')
+    else:
+        exec(target)
+finally:
+    try:
+        with open('/proc/self/status') as status:
+            peak = [int(line.split()[1]) for line in status if line.startswith('VmHWM:')][0]
+    except (IOError, OSError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak // 1024 if sys.platform == 'darwin' else peak
+    sys.stderr.write('\\npeak_rss_kib %d\\n' % peak)
+"""
+
+
+def best_time(function, repeat):
+    """Smallest wall time of repeat calls of function"""
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    return min(seconds)
+
+
+def rate(count, seconds):
+    return int(count / seconds) if seconds else 0
+
+
+def micro_benchmarks(osm_file, repeat=3):
+    """Calls per second of every hot function"""
+    # expat records stay complete after they are yielded, unlike the cleared ElementTree elements
+    elements = list(itertools.islice(osm_parsers.iter_expat(osm_file, ('node', 'way')), MICRO_ELEMENTS))
+    tag_values = [(tag.attrib['k'], tag.attrib['v']) for element in elements for tag in element.iter('tag')]
+    streets = [value for key, value in tag_values if key == 'addr:street']
+    postcodes = [value for key, value in tag_values if key == 'postal_code']
+    validator = CompiledValidator()
+    shaped = [shape_element(element) for element in elements]
+    elements_count = sum(1 for _ in osm_parsers.iter_expat(osm_file))
+
+    def shape_all():
+        # the cleaning caches would turn every repeat after the first into cache hits
+        clean_street_name.cache_clear()
+        clean_postal_code.cache_clear()
+        for element in elements:
+            shape_element(element)
+
+    def parse_all(backend):
+        for _ in get_element(osm_file, backend=backend):
+            pass
+
+    results = {
+        'shape_element': rate(len(elements), best_time(shape_all, repeat)),
+        'update_street_name': rate(len(streets), best_time(lambda: [update_street_name(s) for s in streets], repeat)),
+        'update_postal_code': rate(len(postcodes),
+                                   best_time(lambda: [update_postal_code(p) for p in postcodes], repeat)),
+        'audit.update_name': rate(len(streets), best_time(lambda: [audit.update_name(s) for s in streets], repeat)),
+        'validate_element': rate(len(shaped),
+                                 best_time(lambda: [validate_element(el, validator) for el in shaped], repeat)),
+        'audit.audit': rate(elements_count, best_time(lambda: audit.audit(osm_file), repeat)),
+        'mapparser.count_tags': rate(elements_count, best_time(lambda: mapparser.count_tags(osm_file), repeat)),
+        'mapparser.count_tags_fast': rate(elements_count,
+                                          best_time(lambda: mapparser.count_tags_fast(osm_file), repeat)),
+    }
+    for backend in osm_parsers.available_backends():
+        results['get_element.' + backend] = rate(elements_count, best_time(lambda: parse_all(backend), repeat))
+    return {'calls_per_sec': results,
+            'sample': {'elements': len(elements), 'streets': len(streets), 'postcodes': len(postcodes)}}
+
+
+def run_script(argv, cwd):
+    """Run a script or code target in a child process and return its seconds and peak RSS in MiB"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get('PYTHONPATH', '')]))
+    start_time = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', LAUNCHER] + argv, cwd=cwd, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    seconds = time.perf_counter() - start_time
+    stderr = completed.stderr.decode('utf8', 'replace')
+    if completed.returncode != 0:
+        raise RuntimeError("{0} failed:\n{1}".format(argv[0], stderr))
+    peak_rss_kib = int(stderr.rsplit('peak_rss_kib', 1)[1])
+    return seconds, round(peak_rss_kib / 1024.0, 1)
+
+
+def end_to_end(osm_file, scripts=None):
+    """Elements/sec and peak RSS of every script run on the whole file"""
+    elements_count = sum(1 for _ in osm_parsers.iter_expat(osm_file))
+    osm_file = os.path.abspath(osm_file)
+    results = {}
+    for name in scripts or sorted(END_TO_END):
+        out_dir = tempfile.mkdtemp(prefix='osm_bench_')
+        try:
+            seconds, peak_rss_mib = run_script(END_TO_END[name](osm_file, out_dir), out_dir)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        results[name] = {'seconds': round(seconds, 3), 'elements_per_sec': rate(elements_count, seconds),
+                         'peak_rss_mib': peak_rss_mib}
+    return results
+
+
+def memory_scaling(generator=None, scales=MEMORY_SCALES, max_growth_mib=MEMORY_GROWTH_MIB):
+    """Peak RSS in MiB of every streaming entry point on synthetic maps of growing size, flat when the largest map
+    needs at most max_growth_mib more than the smallest"""
+    generator = dict((key, value) for key, value in (generator or {}).items() if key != 'counts')
+    nodes = generator.pop('nodes', 100000)
+    work_dir = tempfile.mkdtemp(prefix='osm_bench_memory_')
+    try:
+        paths = []
+        for scale in scales:
+            paths.append(os.path.join(work_dir, 'synthetic_{0}.osm'.format(scale)))
+            generate_osm(paths[-1], nodes=nodes * scale, **generator)
+        results = {}
+        for name, code in sorted(STREAMING_ENTRY_POINTS.items()):
+            peaks = [run_script([code, path], work_dir)[1] for path in paths]
+            results[name] = {'peak_rss_mib': peaks, 'flat': peaks[-1] - peaks[0] <= max_growth_mib}
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '/'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare_results(old, new):
+    """Ratio new/old of every rate (above 1 is faster) and peak RSS (above 1 is larger) found in both runs"""
+    old_flat = flatten(old)
+    ratios = {}
+    for key, value in flatten(new).items():
+        if key.startswith(('micro/calls_per_sec/', 'end_to_end/')) and not key.endswith('/seconds') \
+                and old_flat.get(key):
+            ratios[key] = round(value / float(old_flat[key]), 3)
+    return ratios
+
+
+def run_suite(osm_file=None, generator=None, repeat=3, scripts=None, skip_end_to_end=False, memory=False):
+    """Run the micro and end to end benchmarks, on a generated file when osm_file is None, and the memory scaling
+    check if memory is True"""
+    generator = dict(generator or {})
+    work_dir = None
+    if osm_file is None:
+        work_dir = tempfile.mkdtemp(prefix='osm_bench_input_')
+        osm_file = os.path.join(work_dir, 'synthetic.osm')
+        generator['counts'] = generate_osm(osm_file, **generator)
+
+    try:
+        results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'input': osm_file if work_dir is None else None,
+                   'input_bytes': os.path.getsize(osm_file),
+                   'generator': generator if work_dir is not None else None,
+                   'micro': micro_benchmarks(osm_file, repeat)}
+        if not skip_end_to_end:
+            results['end_to_end'] = end_to_end(osm_file, scripts)
+        if memory:
+            results['memory_scaling'] = memory_scaling(generator)
+        return results
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def save_results(results, results_dir=RESULTS_DIR):
+    """Write the results to a timestamped JSON file and return its path"""
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    path = os.path.join(results_dir, 'benchmark_{0}.json'.format(results['created'].replace(':', '')))
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and save the results as JSON')
+    parser.add_argument('osm_file', nargs='?', help='input .osm file (default: a generated synthetic map)')
+    parser.add_argument('--nodes', type=int, default=100000, help='nodes of the synthetic map')
+    parser.add_argument('--way-ratio', type=float, default=0.15, help='ways per node of the synthetic map')
+    parser.add_argument('--tags-per-element', type=float, default=1.0, help='average tags per node and way')
+    parser.add_argument('--dirty-share', type=float, default=0.2,
+                        help='share of street names and postcodes that need cleaning')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the synthetic map')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each micro-benchmark, the best one counts')
+    parser.add_argument('--script', action='append', choices=sorted(END_TO_END),
+                        help='script to run end to end, may be repeated (default: every script)')
+    parser.add_argument('--skip-end-to-end', action='store_true', help='only run the micro-benchmarks')
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help='directory of the JSON results')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    parser.add_argument('--memory-scaling', action='store_true',
+                        help='check that the peak RSS of the streaming entry points stays flat on maps {0} times '
+                             'the size of the synthetic map'.format(MEMORY_SCALES[-1]))
+    args = parser.parse_args()
+
+    generator = {'nodes': args.nodes, 'way_ratio': args.way_ratio, 'tags_per_element': args.tags_per_element,
+                 'dirty_share': args.dirty_share, 'seed': args.seed}
+    results = run_suite(args.osm_file, generator, args.repeat, args.script, args.skip_end_to_end,
+                        args.memory_scaling)
+    pprint.pprint(results)
+    print("saved to", save_results(results, args.results_dir))
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            print()
+            print("new/old ratios:")
+            pprint.pprint(compare_results(json.load(old_file), results))
+
+    growing = sorted(name for name, result in results.get('memory_scaling', {}).items() if not result['flat'])
+    if growing:
+        sys.exit("peak RSS grows with the input size: {0}".format(', '.join(growing)))
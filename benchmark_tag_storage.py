@@ -0,0 +1,125 @@
+"""
+Size and query time of the dictionary encoded tag storage against the plain tag tables.
+
+The same OSM file is loaded twice by from_osm_to_sqlite, with and without --dictionary. The tag queries of the
+notebook run unchanged on both databases, on the dictionary one through the compatibility views, and the GROUP BY
+queries also run rewritten on the encoded tables, grouping on the integer ids. Every query is checked to give the
+same answer in every form.
+"""
+import argparse
+import os
+import pprint
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from from_osm_to_csv import OSM_PATH
+from from_osm_to_sqlite import process_map_to_sqlite
+
+# Tables and indexes of the tag storage in each layout, by name prefix
+TAG_OBJECTS = ('nodes_tags', 'ways_tags', 'relations_tags', 'tag_keys', 'tag_values', 'sqlite_autoindex_tag_')
+
+# Tag queries of the notebook, run on both layouts
+QUERIES = {
+    'tourism_values': """
+        SELECT tags.value, COUNT(*) AS count FROM (SELECT * FROM nodes_tags UNION ALL SELECT * FROM ways_tags) tags
+        WHERE tags.key LIKE '%tourism' GROUP BY tags.value ORDER BY count DESC, tags.value LIMIT 10""",
+    'fast_food_names': """
+        SELECT nodes_tags.value, COUNT(*) AS num FROM nodes_tags
+        JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value = 'fast_food') i ON nodes_tags.id = i.id
+        WHERE nodes_tags.key = 'name' GROUP BY nodes_tags.value ORDER BY num DESC, nodes_tags.value LIMIT 5""",
+    'restaurant_cuisines': """
+        SELECT nodes_tags.value, COUNT(*) AS num FROM nodes_tags
+        JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value = 'restaurant') i ON nodes_tags.id = i.id
+        WHERE nodes_tags.key = 'cuisine' GROUP BY nodes_tags.value ORDER BY num DESC, nodes_tags.value LIMIT 10""",
+    'top_streets': """
+        SELECT tags.value, COUNT(*) AS count FROM (SELECT * FROM nodes_tags UNION ALL SELECT * FROM ways_tags) tags
+        WHERE tags.key = 'street' GROUP BY tags.value ORDER BY count DESC, tags.value LIMIT 10""",
+    'top_keys': """
+        SELECT key, COUNT(*) AS count FROM nodes_tags GROUP BY key ORDER BY count DESC, key LIMIT 10""",
+}
+
+# The GROUP BY queries rewritten on the encoded tables of the dictionary layout
+ENCODED_QUERIES = {
+    'top_streets': """
+        SELECT COALESCE(tag_values.value, tags.value) AS tag_value, SUM(tags.count) AS count FROM (
+            SELECT value_id, value, COUNT(*) AS count FROM (
+                SELECT key_id, value_id, value FROM nodes_tags_encoded
+                UNION ALL SELECT key_id, value_id, value FROM ways_tags_encoded)
+            WHERE key_id IN (SELECT id FROM tag_keys WHERE key = 'street')
+            GROUP BY value_id, value) tags
+        LEFT JOIN tag_values ON tag_values.id = tags.value_id
+        GROUP BY tag_value ORDER BY count DESC, tag_value LIMIT 10""",
+    'top_keys': """
+        SELECT tag_keys.key, SUM(keys.count) AS count FROM (
+            SELECT key_id, COUNT(*) AS count FROM nodes_tags_encoded GROUP BY key_id) keys
+        JOIN tag_keys ON tag_keys.id = keys.key_id
+        GROUP BY tag_keys.key ORDER BY count DESC, tag_keys.key LIMIT 10""",
+}
+
+
+def tag_storage_bytes(connection):
+    """Bytes of the pages of the tag tables and their indexes, None without the dbstat virtual table"""
+    try:
+        sizes = connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return sum(size for name, size in sizes if name.startswith(TAG_OBJECTS))
+
+
+def time_query(connection, query, repeat, parameters=()):
+    """Best time of repeat runs of a query and its answer"""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        answer = connection.execute(query, parameters).fetchall()
+        seconds = time.perf_counter() - start_time
+        best = seconds if best is None else min(best, seconds)
+    return best, answer
+
+
+def benchmark_tag_storage(osm_file, repeat=5, work_dir=None):
+    work_dir = tempfile.mkdtemp(prefix='osm_tag_storage_', dir=work_dir)
+    try:
+        report = {}
+        answers = {}
+        for layout, dictionary in (('plain', False), ('dictionary', True)):
+            db_path = os.path.join(work_dir, layout + '.db')
+            load_seconds = process_map_to_sqlite(osm_file, db_path, validate=False, dictionary=dictionary)[
+                'load_seconds']
+            connection = sqlite3.connect(db_path)
+            try:
+                queries = dict((name, query) for name, query in QUERIES.items())
+                if dictionary:
+                    queries.update(('{0}_encoded'.format(name), query) for name, query in ENCODED_QUERIES.items())
+                query_seconds = {}
+                for name, query in sorted(queries.items()):
+                    seconds, answers[(layout, name)] = time_query(connection, query, repeat)
+                    query_seconds[name] = round(seconds * 1000, 3)
+                report[layout] = {'file_bytes': os.path.getsize(db_path),
+                                  'tag_bytes': tag_storage_bytes(connection),
+                                  'load_seconds': load_seconds,
+                                  'query_ms': query_seconds}
+            finally:
+                connection.close()
+
+        report['same_answers'] = dict(
+            (name, answers[('plain', name)] == answers[('dictionary', name)] and
+             (name not in ENCODED_QUERIES or answers[('plain', name)] == answers[('dictionary', name + '_encoded')]))
+            for name in sorted(QUERIES))
+        if report['plain']['tag_bytes'] and report['dictionary']['tag_bytes']:
+            report['tag_bytes_ratio'] = round(report['dictionary']['tag_bytes'] / report['plain']['tag_bytes'], 3)
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the dictionary encoded tag storage with the plain tag tables')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm file')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each query, the best one is reported')
+    parser.add_argument('--work-dir', help='directory of the temporary databases')
+    args = parser.parse_args()
+
+    pprint.pprint(benchmark_tag_storage(args.osm_file, args.repeat, args.work_dir))
@@ -1,18 +1,17 @@
 import pprint
-import xml.etree.cElementTree as ET
+
+import osm_parsers
 
 
 def get_types_of_k_attrib(filename, k_attrib_values_dict):
-    for _, element in ET.iterparse(filename):
-        if element.tag == "node" or element.tag == "way":
-            for tag in element.iter("tag"):
-                # print(tag.attrib['k'])
-                if tag.attrib['k'] not in k_attrib_values_dict:
-                    k_attrib_values_dict[tag.attrib['k']] = 1
-                else:
-                    k_attrib_values_dict[tag.attrib['k']] += 1
-                tag.clear()
-            element.clear()
+    # complete node and way elements of .osm, compressed .osm or .osm.pbf files, one at a time
+    for element in osm_parsers.iter_osm(filename, ('node', 'way')):
+        for tag in element.iter("tag"):
+            # print(tag.attrib['k'])
+            if tag.attrib['k'] not in k_attrib_values_dict:
+                k_attrib_values_dict[tag.attrib['k']] = 1
+            else:
+                k_attrib_values_dict[tag.attrib['k']] += 1
 
 
 if __name__ == '__main__':
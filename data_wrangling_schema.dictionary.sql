@@ -0,0 +1,121 @@
+-- Dictionary encoded tag storage, run by from_osm_to_sqlite.py --dictionary after data_wrangling_schema.schema.sql.
+-- The tag tables become views over *_tags_encoded with the same columns, the keys and types are interned in tag_keys
+-- and the values found in tag_values are stored by id, the other values inline.
+
+DROP TABLE nodes_tags;
+DROP TABLE ways_tags;
+DROP TABLE relations_tags;
+
+CREATE TABLE tag_keys (
+    id INTEGER PRIMARY KEY NOT NULL,
+    key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    UNIQUE (key, type)
+);
+
+CREATE TABLE tag_values (
+    id INTEGER PRIMARY KEY NOT NULL,
+    value TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE nodes_tags_encoded (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES nodes(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id)
+);
+
+CREATE VIEW nodes_tags AS
+    SELECT nodes_tags_encoded.id AS id, tag_keys.key AS key, COALESCE(tag_values.value, nodes_tags_encoded.value) AS value,
+           tag_keys.type AS type
+    FROM nodes_tags_encoded
+    JOIN tag_keys ON tag_keys.id = nodes_tags_encoded.key_id
+    LEFT JOIN tag_values ON tag_values.id = nodes_tags_encoded.value_id;
+
+CREATE TRIGGER nodes_tags_insert INSTEAD OF INSERT ON nodes_tags
+BEGIN
+    INSERT OR IGNORE INTO tag_keys (key, type) VALUES (NEW.key, NEW.type);
+    INSERT INTO nodes_tags_encoded (id, key_id, value_id, value)
+    SELECT NEW.id, (SELECT id FROM tag_keys WHERE key = NEW.key AND type = NEW.type), tag_values.id,
+           CASE WHEN tag_values.id IS NULL THEN NEW.value END
+    FROM (SELECT 1) LEFT JOIN tag_values ON tag_values.value = NEW.value;
+END;
+
+CREATE TRIGGER nodes_tags_delete INSTEAD OF DELETE ON nodes_tags
+BEGIN
+    DELETE FROM nodes_tags_encoded
+    WHERE id = OLD.id
+    AND key_id = (SELECT id FROM tag_keys WHERE key = OLD.key AND type = OLD.type)
+    AND COALESCE((SELECT value FROM tag_values WHERE tag_values.id = value_id), value) = OLD.value;
+END;
+
+CREATE TABLE ways_tags_encoded (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id)
+);
+
+CREATE VIEW ways_tags AS
+    SELECT ways_tags_encoded.id AS id, tag_keys.key AS key, COALESCE(tag_values.value, ways_tags_encoded.value) AS value,
+           tag_keys.type AS type
+    FROM ways_tags_encoded
+    JOIN tag_keys ON tag_keys.id = ways_tags_encoded.key_id
+    LEFT JOIN tag_values ON tag_values.id = ways_tags_encoded.value_id;
+
+CREATE TRIGGER ways_tags_insert INSTEAD OF INSERT ON ways_tags
+BEGIN
+    INSERT OR IGNORE INTO tag_keys (key, type) VALUES (NEW.key, NEW.type);
+    INSERT INTO ways_tags_encoded (id, key_id, value_id, value)
+    SELECT NEW.id, (SELECT id FROM tag_keys WHERE key = NEW.key AND type = NEW.type), tag_values.id,
+           CASE WHEN tag_values.id IS NULL THEN NEW.value END
+    FROM (SELECT 1) LEFT JOIN tag_values ON tag_values.value = NEW.value;
+END;
+
+CREATE TRIGGER ways_tags_delete INSTEAD OF DELETE ON ways_tags
+BEGIN
+    DELETE FROM ways_tags_encoded
+    WHERE id = OLD.id
+    AND key_id = (SELECT id FROM tag_keys WHERE key = OLD.key AND type = OLD.type)
+    AND COALESCE((SELECT value FROM tag_values WHERE tag_values.id = value_id), value) = OLD.value;
+END;
+
+CREATE TABLE relations_tags_encoded (
+    id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    value_id INTEGER,
+    value TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id),
+    FOREIGN KEY (key_id) REFERENCES tag_keys(id),
+    FOREIGN KEY (value_id) REFERENCES tag_values(id)
+);
+
+CREATE VIEW relations_tags AS
+    SELECT relations_tags_encoded.id AS id, tag_keys.key AS key, COALESCE(tag_values.value, relations_tags_encoded.value) AS value,
+           tag_keys.type AS type
+    FROM relations_tags_encoded
+    JOIN tag_keys ON tag_keys.id = relations_tags_encoded.key_id
+    LEFT JOIN tag_values ON tag_values.id = relations_tags_encoded.value_id;
+
+CREATE TRIGGER relations_tags_insert INSTEAD OF INSERT ON relations_tags
+BEGIN
+    INSERT OR IGNORE INTO tag_keys (key, type) VALUES (NEW.key, NEW.type);
+    INSERT INTO relations_tags_encoded (id, key_id, value_id, value)
+    SELECT NEW.id, (SELECT id FROM tag_keys WHERE key = NEW.key AND type = NEW.type), tag_values.id,
+           CASE WHEN tag_values.id IS NULL THEN NEW.value END
+    FROM (SELECT 1) LEFT JOIN tag_values ON tag_values.value = NEW.value;
+END;
+
+CREATE TRIGGER relations_tags_delete INSTEAD OF DELETE ON relations_tags
+BEGIN
+    DELETE FROM relations_tags_encoded
+    WHERE id = OLD.id
+    AND key_id = (SELECT id FROM tag_keys WHERE key = OLD.key AND type = OLD.type)
+    AND COALESCE((SELECT value FROM tag_values WHERE tag_values.id = value_id), value) = OLD.value;
+END;
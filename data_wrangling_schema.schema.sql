@@ -40,4 +40,43 @@ CREATE TABLE ways_nodes (
     position INTEGER NOT NULL,
     FOREIGN KEY (id) REFERENCES ways(id),
     FOREIGN KEY (node_id) REFERENCES nodes(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE ways_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    length REAL,
+    centroid_lat REAL,
+    centroid_lon REAL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    missing_nodes INTEGER,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+
+CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+);
+
+CREATE TABLE relations_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+
+CREATE TABLE relations_members (
+    id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    role TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
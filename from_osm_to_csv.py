@@ -1,15 +1,30 @@
 # Import libraries
+import argparse
 import csv
 import codecs
+import io
+import json
+import multiprocessing
+import os
 import pprint
 import re
-import xml.etree.cElementTree as ET
-import cerberus
-from collections import defaultdict
+import shutil
+import tempfile
+import time
+from array import array
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from functools import partial
 
 # Import Schema for validation
 
+import osm_bbox
+import osm_locations
+import osm_metrics
+import osm_parsers
+import osm_pbf
 import schema
+from schema_validator import CompiledValidator
 
 # OSM fil path
 OSM_PATH = "maps-xml/london_full.osm"
@@ -20,6 +35,10 @@ NODE_TAGS_PATH = "center_of_london_nodes_tags.csv"
 WAYS_PATH = "center_of_london_ways.csv"
 WAY_NODES_PATH = "center_of_london_ways_nodes.csv"
 WAY_TAGS_PATH = "center_of_london_ways_tags.csv"
+RELATIONS_PATH = "center_of_london_relations.csv"
+RELATION_MEMBERS_PATH = "center_of_london_relations_members.csv"
+RELATION_TAGS_PATH = "center_of_london_relations_tags.csv"
+WAY_GEOMETRY_PATH = "center_of_london_ways_geometry.csv"
 
 # Regular expressions
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
@@ -69,13 +88,34 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_GEOMETRY_FIELDS = ['id', 'length', 'centroid_lat', 'centroid_lon', 'min_lat', 'min_lon', 'max_lat', 'max_lon',
+                       'missing_nodes']
+
+# Shaped element keys, their csv paths and fields, in the order the csv(s) are opened
+# (way_geometry only gets rows when the conversion keeps the node locations)
+CSV_KEYS = ['node', 'node_tags', 'way', 'way_nodes', 'way_tags', 'relation', 'relation_members', 'relation_tags',
+            'way_geometry']
+CSV_PATHS = [NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+             RELATIONS_PATH, RELATION_MEMBERS_PATH, RELATION_TAGS_PATH, WAY_GEOMETRY_PATH]
+CSV_FIELDS = [NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS,
+              RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS, WAY_GEOMETRY_FIELDS]
+
+# Top level elements converted to csv(s)
+ELEMENT_TAGS = ('node', 'way', 'relation')
 
 counterNone = {'nod': 0, 'nod_tags': 0, 'wy': 0, 'wy_tag': 0, 'way_nod': 0}
 
+# Maximum number of distinct values remembered by each cleaning cache
+CLEANING_CACHE_SIZE = 100000
 
-# Clean and shape node or way XML element to Python dict
+
+# Clean and shape node or way XML element to Python dict, with an osm_locations store the nodes are
+# remembered in it and the ways get their way_geometry
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', locations=None):
     node_attribs = {}
     way_attribs = {}
     way_nodes = []
@@ -121,9 +161,9 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 node_tags_dict['type'] = attribute_list[0]
                 node_tags_dict['key'] = attribute_list[1]
                 if node_tags_dict['key'] == "street":
-                    node_tags_dict['value'] = update_street_name(child_attr_value)
+                    node_tags_dict['value'] = clean_street_name(child_attr_value)
                 elif node_tags_dict['key'] == "postal_code":
-                    node_tags_dict['value'] = update_postal_code(child_attr_value)
+                    node_tags_dict['value'] = clean_postal_code(child_attr_value)
                 else:
                     node_tags_dict['value'] = child_attr_value
             # Deal with all attributes
@@ -131,15 +171,18 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 node_tags_dict['type'] = default_tag_type
                 node_tags_dict['key'] = child_attr_key
                 if node_tags_dict['key'] == "street":
-                    node_tags_dict['value'] = update_street_name(child_attr_value)
+                    node_tags_dict['value'] = clean_street_name(child_attr_value)
                 elif node_tags_dict['key'] == "postal_code":
-                    node_tags_dict['value'] = update_postal_code(child_attr_value)
+                    node_tags_dict['value'] = clean_postal_code(child_attr_value)
                 else:
                     node_tags_dict['value'] = child_attr_value
 
             # Append new tag row
             tags.append(node_tags_dict)
 
+        if locations is not None:
+            locations.add(node_attribs['id'], node_attribs['lat'], node_attribs['lon'])
+
         # print {'node': node_attribs, 'node_tags': tags}
         return {'node': node_attribs, 'node_tags': tags}
 
@@ -177,9 +220,9 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 way_tags_dict['type'] = attribute_list[0]
                 way_tags_dict['key'] = attribute_list[1]
                 if way_tags_dict['key'] == "street":
-                    way_tags_dict['value'] = update_street_name(tag_attr_value)
+                    way_tags_dict['value'] = clean_street_name(tag_attr_value)
                 elif way_tags_dict['key'] == "postal_code":
-                    way_tags_dict['value'] = update_postal_code(tag_attr_value)
+                    way_tags_dict['value'] = clean_postal_code(tag_attr_value)
                 else:
                     way_tags_dict['value'] = tag_attr_value
             # Deal with all attributes
@@ -187,9 +230,9 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 way_tags_dict['type'] = default_tag_type
                 way_tags_dict['key'] = tag_attr_key
                 if way_tags_dict['key'] == "street":
-                    way_tags_dict['value'] = update_street_name(tag_attr_value)
+                    way_tags_dict['value'] = clean_street_name(tag_attr_value)
                 elif way_tags_dict['key'] == "postal_code":
-                    way_tags_dict['value'] = update_postal_code(tag_attr_value)
+                    way_tags_dict['value'] = clean_postal_code(tag_attr_value)
                 else:
                     way_tags_dict['value'] = tag_attr_value
             # Append new tag row
@@ -213,7 +256,45 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
             # Append new nd row
             way_nodes.append(nd_tags_dict)
 
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        shaped = {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        if locations is not None:
+            geometry = osm_locations.way_geometry(way_attribs['id'], [nd['node_id'] for nd in way_nodes], locations)
+            if geometry:
+                shaped['way_geometry'] = geometry
+        return shaped
+
+    # Relation tag elements
+    elif element.tag == 'relation':
+        # Get element attributes
+        element_attributes = element.attrib
+        relation_id = int(element_attributes['id'])
+
+        # Get element relation attributes
+        relation_attribs = {'id': relation_id,
+                            'user': element_attributes['user'],
+                            'uid': int(element_attributes['uid']),
+                            'version': element_attributes['version'],
+                            'changeset': int(element_attributes['changeset']),
+                            'timestamp': element_attributes['timestamp']}
+
+        # Tags are cleaned the same way as the node and way tags
+        for tag in element.iter('tag'):
+            cleaned = clean_tag(tag.attrib['k'], tag.attrib['v'], default_tag_type)
+            if cleaned:
+                tag_key, tag_value, tag_type = cleaned
+                tags.append({'id': relation_id, 'key': tag_key, 'value': tag_value, 'type': tag_type})
+
+        # Members keep their order in the relation
+        relation_members = []
+        for position, member in enumerate(element.iter('member')):
+            member_attributes = member.attrib
+            relation_members.append({'id': relation_id,
+                                     'member_id': int(member_attributes['ref']),
+                                     'type': member_attributes['type'],
+                                     'role': member_attributes.get('role', ''),
+                                     'position': position})
+
+        return {'relation': relation_attribs, 'relation_members': relation_members, 'relation_tags': tags}
 
     # ================================================== #
 
@@ -293,6 +374,66 @@ def update_name(name):
     return name
 
 
+class LRUCache(object):
+    """Size bounded least recently used cache in front of a single argument cleaning function"""
+
+    def __init__(self, function, maxsize):
+        self.function = function
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, value):
+        try:
+            result = self.cache[value]
+        except KeyError:
+            self.misses += 1
+            result = self.cache[value] = self.function(value)
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.cache.move_to_end(value)
+        return result
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.cache), 'maxsize': self.maxsize}
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# Cached cleaning functions used by shape_element.
+# update_street_name only rewrites a name whose street type is a mapping key, and expected_list only ever grows with
+# types that are not mapping keys, so the cleaned value does not depend on the order the names are seen in.
+# A cache hit skips the street_types bookkeeping, which already holds that name from the first call.
+clean_street_name = LRUCache(update_street_name, CLEANING_CACHE_SIZE)
+clean_postal_code = LRUCache(update_postal_code, CLEANING_CACHE_SIZE)
+
+
+@contextmanager
+def timed_cleaning(metrics):
+    """Add the time spent in the cleaning functions to the clean timer of metrics, and the time of their cache misses,
+    where the street and postcode regexes run, to regex.street and regex.postcode while the context is active"""
+    global clean_street_name, clean_postal_code
+    street_cache, postcode_cache = clean_street_name, clean_postal_code
+    street_cache.function = metrics.timed(update_street_name, 'regex.street')
+    postcode_cache.function = metrics.timed(update_postal_code, 'regex.postcode')
+    clean_street_name = metrics.timed(street_cache, 'clean')
+    clean_postal_code = metrics.timed(postcode_cache, 'clean')
+    try:
+        yield
+    finally:
+        street_cache.function = update_street_name
+        postcode_cache.function = update_postal_code
+        clean_street_name, clean_postal_code = street_cache, postcode_cache
+
+
 # Function that updates street value
 # def update_street(street_name):
 #     # Case 1: Abbreviations
@@ -315,21 +456,17 @@ def update_name(name):
 #         return street_name
 
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
-
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+def get_element(osm_file, tags=('node', 'way', 'relation'), backend='etree', workers=1):
+    """Yield element if it is the right type of tag, parsed by the named backend of osm_parsers
+    or decoded by osm_pbf on workers processes for .osm.pbf files, .bz2/.gz/.xz files are decompressed on the fly.
+    Streams through osm_parsers.iter_osm, which holds one element at a time."""
+    return osm_parsers.iter_osm(osm_file, tags, backend, workers)
 
 
 def validate_element(element, validator, schema=SCHEMA):
     """Raise ValidationError if element does not match schema"""
     if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
+        field, errors = next(iter(validator.errors.items()))
         message_string = "\nElement of type '{0}' has the following errors:\n{1}"
         error_string = pprint.pformat(errors)
 
@@ -353,50 +490,713 @@ class UnicodeDictWriter(csv.DictWriter, object):
 
 
 # ================================================== #
-#               Main Function                        #
+#               Columnar Functions                   #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-    '''
-    encoding = 'utf8' has been addedd
-    '''
 
-    with codecs.open(NODES_PATH, 'w', encoding='utf8') as nodes_file, \
-            codecs.open(NODE_TAGS_PATH, 'w', encoding='utf8') as nodes_tags_file, \
-            codecs.open(WAYS_PATH, 'w', encoding='utf8') as ways_file, \
-            codecs.open(WAY_NODES_PATH, 'w', encoding='utf8') as way_nodes_file, \
-            codecs.open(WAY_TAGS_PATH, 'w', encoding='utf8') as way_tags_file:
+# Array typecodes of the numeric schema types, the other columns are kept in lists
+COLUMN_TYPECODES = {'integer': 'q', 'float': 'd'}
+
+# Elements shaped by the columnar path before the batches are written
+COLUMN_BATCH_ELEMENTS = 1000
+
+
+class ColumnBatch(object):
+    """Rows of one table stored column by column, numeric columns in arrays"""
+    __slots__ = ('fields', 'typecodes', 'columns')
+
+    def __init__(self, fields, field_schema):
+        self.fields = fields
+        self.typecodes = [COLUMN_TYPECODES.get(field_schema[field]['type']) for field in fields]
+        self.columns = [array(typecode) if typecode else [] for typecode in self.typecodes]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def clear(self):
+        self.columns = [array(typecode) if typecode else [] for typecode in self.typecodes]
+
+
+def new_column_batches():
+    """One ColumnBatch per shaped element key"""
+    batches = {}
+    for key, fields in zip(CSV_KEYS, CSV_FIELDS):
+        rule = SCHEMA[key]['schema']
+        batches[key] = ColumnBatch(fields, rule['schema'] if rule.get('type') == 'dict' else rule)
+    return batches
+
+
+def clean_tag(tag_key, tag_value, default_tag_type='regular'):
+    """Return the (key, value, type) of a tag the same way shape_element cleans it, or None to drop it"""
+    # Get rid of attribute keys with problematic characters
+    if PROBLEMCHARS.match(tag_key):
+        return None
+    # Clean attribute keys with colons
+    elif LOWER_COLON.match(tag_key):
+        attribute_list = tag_key.split(':')
+        tag_type = attribute_list[0]
+        tag_key = attribute_list[1]
+    else:
+        tag_type = default_tag_type
+
+    if tag_key == "street":
+        tag_value = clean_street_name(tag_value)
+    elif tag_key == "postal_code":
+        tag_value = clean_postal_code(tag_value)
+    return tag_key, tag_value, tag_type
+
+
+def shape_element_columns(element, batches, default_tag_type='regular', locations=None):
+    """Append the rows of a node, way or relation XML element to the column batches without building dicts,
+    remembering the nodes in and computing the way geometry from the locations store if given"""
+    element_attributes = element.attrib
+    element_id = int(element_attributes['id'])
+
+    if element.tag == 'node':
+        try:
+            user = element_attributes['user']
+            uid = int(element_attributes['uid'])
+        except (KeyError, ValueError):
+            user = "unknown"
+            uid = -1
+        lat, lon = float(element_attributes['lat']), float(element_attributes['lon'])
+        batches['node'].append((element_id, lat, lon, user, uid, element_attributes['version'],
+                                int(element_attributes['changeset']), element_attributes['timestamp']))
+        tags_batch = batches['node_tags']
+        if locations is not None:
+            locations.add(element_id, lat, lon)
+
+    elif element.tag == 'way':
+        batches['way'].append((element_id, element_attributes['user'], int(element_attributes['uid']),
+                               element_attributes['version'], int(element_attributes['changeset']),
+                               element_attributes['timestamp']))
+        tags_batch = batches['way_tags']
+
+        node_refs = [int(nd.attrib['ref']) for nd in element.iter('nd')]
+        ids, node_ids, positions = batches['way_nodes'].columns
+        ids.extend([element_id] * len(node_refs))
+        node_ids.extend(node_refs)
+        positions.extend(range(len(node_refs)))
+
+        if locations is not None:
+            geometry = osm_locations.way_geometry(element_id, node_refs, locations)
+            if geometry:
+                batches['way_geometry'].append([geometry[field] for field in WAY_GEOMETRY_FIELDS])
+
+    elif element.tag == 'relation':
+        batches['relation'].append((element_id, element_attributes['user'], int(element_attributes['uid']),
+                                    element_attributes['version'], int(element_attributes['changeset']),
+                                    element_attributes['timestamp']))
+        tags_batch = batches['relation_tags']
+
+        members_batch = batches['relation_members']
+        for position, member in enumerate(element.iter('member')):
+            member_attributes = member.attrib
+            members_batch.append((element_id, int(member_attributes['ref']), member_attributes['type'],
+                                  member_attributes.get('role', ''), position))
+
+    else:
+        return
+
+    for tag in element.iter('tag'):
+        cleaned = clean_tag(tag.attrib['k'], tag.attrib['v'], default_tag_type)
+        if cleaned:
+            tags_batch.append((element_id,) + cleaned)
 
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
 
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
+class CsvColumnWriters(object):
+    """Write column batches to the csv(s) in paths, in the order of CSV_PATHS, with plain csv.writer objects"""
 
-        validator = cerberus.Validator()
+    def __init__(self, paths, write_header=True, mode='w'):
+        self.files = [codecs.open(path, mode, encoding='utf8') for path in paths]
+        self.writers = dict((key, csv.writer(csv_file)) for key, csv_file in zip(CSV_KEYS, self.files))
+        self.batches = new_column_batches()
 
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+        if write_header:
+            for key in CSV_KEYS:
+                self.writers[key].writerow(self.batches[key].fields)
+
+    def flush(self):
+        for key, batch in self.batches.items():
+            self.writers[key].writerows(batch.rows())
+            batch.clear()
+
+    def close(self):
+        self.flush()
+        for csv_file in self.files:
+            csv_file.close()
+
+
+def write_csvs_columnar(elements, paths, validate, write_header=True, validate_every=1, mode='w', metrics=None,
+                        locations=None):
+    """Shape each XML element into column batches and write them to the csv(s) in paths,
+    return the tag and id of the last element"""
+    writers = CsvColumnWriters(paths, write_header, mode)
+    last_element = None
+    try:
+        validator = CompiledValidator()
+        batches = writers.batches
+        pending = 0
+
+        # only the validated elements are shaped to dicts as well
+        def validate_columns(element):
+            validate_element(shape_element(element), validator)
+
+        def flush():
+            for key, batch in batches.items():
+                metrics.count_rows(key, len(batch))
+            writers.flush()
+
+        shape_columns, check, write = shape_element_columns, validate_columns, writers.flush
+        if locations is not None:
+            shape_columns = partial(shape_element_columns, locations=locations)
+        if metrics is not None:
+            elements = metrics.timed_elements(elements)
+            shape_columns = metrics.timed(shape_columns, 'shape')
+            check = metrics.timed(validate_columns, 'validate')
+            write = metrics.timed(flush, 'write')
+
+        for index, element in enumerate(elements):
+            if validate is True and index % validate_every == 0:
+                check(element)
+
+            shape_columns(element, batches)
+            last_element = (element.tag, element.attrib['id'])
+            pending += 1
+            if pending >= COLUMN_BATCH_ELEMENTS:
+                write()
+                pending = 0
+        write()
+    finally:
+        writers.close()
+    return last_element
+
+
+# ================================================== #
+#               Sharding Functions                   #
+# ================================================== #
+
+# Byte tokens which open the top level elements that the file can be cut on
+SHARD_TOKENS = (b'<node', b'<way', b'<relation')
+
+# Bytes that may follow a shard token in a real element start tag
+SHARD_TOKEN_ENDINGS = b' \t\r\n/>'
+
+# Size of the chunks read while looking for a shard boundary
+SHARD_SCAN_CHUNK = 1 << 20
+
+
+def find_next_element(osm_file, offset, end):
+    """Return the offset of the first <node, <way or <relation start tag at or after offset, or end"""
+    overlap = max(len(token) for token in SHARD_TOKENS)
+    position = offset
+    while position < end:
+        osm_file.seek(position)
+        chunk = osm_file.read(SHARD_SCAN_CHUNK + overlap)
+        if not chunk:
+            break
+        candidates = []
+        for token in SHARD_TOKENS:
+            index = chunk.find(token)
+            while index != -1:
+                ending = chunk[index + len(token):index + len(token) + 1]
+                if ending and ending in SHARD_TOKEN_ENDINGS:
+                    candidates.append(index)
+                    break
+                index = chunk.find(token, index + 1)
+        if candidates:
+            return min(position + min(candidates), end)
+        position += SHARD_SCAN_CHUNK
+    return end
+
+
+def find_elements_end(osm_file, size):
+    """Return the offset where the closing root tag starts, the end of the last element"""
+    osm_file.seek(max(size - SHARD_SCAN_CHUNK, 0))
+    tail = osm_file.read()
+    return size - len(tail) + tail.rfind(b'</osm>') if b'</osm>' in tail else size
+
+
+def find_shard_boundaries(file_in, workers):
+    """Split an .osm file into byte ranges which start on a <node or <way element"""
+    size = os.path.getsize(file_in)
+    with open(file_in, 'rb') as osm_file:
+        end = find_elements_end(osm_file, size)
+        offsets = [find_next_element(osm_file, 0, end)]
+        for shard in range(1, workers):
+            offset = find_next_element(osm_file, max(size * shard // workers, offsets[-1]), end)
+            if offset > offsets[-1]:
+                offsets.append(offset)
+        if offsets[-1] < end:
+            offsets.append(end)
+
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+class ShardFile(object):
+    """Read-only file object exposing a byte range of an .osm file wrapped in its own <osm> root"""
+
+    def __init__(self, file_in, start, end):
+        self.osm_file = open(file_in, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.prefix = b'<osm>'
+        self.suffix = b'</osm>'
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.prefix) + self.remaining + len(self.suffix)
+        data = self.prefix[:size]
+        self.prefix = self.prefix[len(data):]
+        if len(data) < size and self.remaining > 0:
+            chunk = self.osm_file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(chunk)
+            data += chunk
+        if len(data) < size and self.remaining == 0:
+            tail = self.suffix[:size - len(data)]
+            self.suffix = self.suffix[len(tail):]
+            data += tail
+        return data
+
+    def close(self):
+        self.osm_file.close()
+
+
+def process_shard(args):
+    """Convert one byte range of the .osm file into headerless csv(s)"""
+    file_in, start, end, shard_paths, validate, validate_every, backend, columnar = args
+    write = write_csvs_columnar if columnar else write_csvs
+    shard_file = ShardFile(file_in, start, end)
+    try:
+        write(get_element(shard_file, tags=ELEMENT_TAGS, backend=backend), shard_paths, validate,
+              write_header=False, validate_every=validate_every)
+    finally:
+        shard_file.close()
+    return shard_paths
+
+
+# ================================================== #
+#               Checkpoint Functions                 #
+# ================================================== #
+
+# Checkpoint file of a resumable conversion
+CHECKPOINT_PATH = "center_of_london.checkpoint.json"
+
+# Bytes of input converted between two checkpoints
+CHECKPOINT_BYTES = 64 << 20
+
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    """Atomically replace the checkpoint file"""
+    temporary_path = checkpoint_path + '.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=2)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_path, checkpoint_path)
+
+
+def sync_file(path):
+    """Return the size of a file once its content is on disk"""
+    with open(path, 'rb+') as synced_file:
+        os.fsync(synced_file.fileno())
+    return os.path.getsize(path)
+
+
+def process_map_checkpointed(file_in, validate, resume=False, validate_every=1, backend='etree', columnar=False,
+                             checkpoint_path=CHECKPOINT_PATH, metrics=None):
+    """Convert the XML file in byte ranges of CHECKPOINT_BYTES, saving a checkpoint after every range"""
+    if osm_pbf.is_pbf(file_in) or osm_parsers.is_compressed(file_in):
+        raise ValueError("checkpointed conversion needs an uncompressed .osm file")
+
+    paths = CSV_PATHS
+    write = write_csvs_columnar if columnar else write_csvs
+    size = os.path.getsize(file_in)
+
+    with open(file_in, 'rb') as osm_file:
+        end = find_elements_end(osm_file, size)
+
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if checkpoint['input'] != os.path.abspath(file_in) or checkpoint['input_size'] != size:
+                raise ValueError("checkpoint {0} belongs to another input file".format(checkpoint_path))
+            # drop whatever was written after the last checkpoint
+            for path, position in zip(paths, checkpoint['positions']):
+                with open(path, 'rb+') as csv_file:
+                    csv_file.truncate(position)
+            offset = checkpoint['offset']
+        else:
+            CsvWriters(paths).close()
+            checkpoint = {'input': os.path.abspath(file_in), 'input_size': size, 'last_element': None}
+            offset = find_next_element(osm_file, 0, end)
+
+        while offset < end:
+            next_offset = find_next_element(osm_file, offset + CHECKPOINT_BYTES, end)
+            range_file = ShardFile(file_in, offset, next_offset)
+            try:
+                last_element = write(get_element(range_file, tags=ELEMENT_TAGS, backend=backend), paths,
+                                     validate, write_header=False, validate_every=validate_every, mode='a',
+                                     metrics=metrics)
+            finally:
+                range_file.close()
+
+            offset = next_offset
+            checkpoint['offset'] = offset
+            checkpoint['last_element'] = last_element or checkpoint['last_element']
+            checkpoint['positions'] = [sync_file(path) for path in paths]
+            write_checkpoint(checkpoint_path, checkpoint)
+
+    os.remove(checkpoint_path)
+
+
+# ================================================== #
+#               Pipeline Functions                   #
+# ================================================== #
+
+# Bytes of input converted by one task of the pipeline and tasks in flight per converting process
+PIPELINE_RANGE_BYTES = 4 << 20
+PIPELINE_RANGES_PER_WORKER = 2
+
+
+def iter_element_ranges(file_in, range_bytes=PIPELINE_RANGE_BYTES):
+    """Yield consecutive byte ranges of the .osm file of about range_bytes, which start on a <node, <way or <relation
+    element, the first at the first element and the last ending where the closing root tag starts"""
+    with open(file_in, 'rb') as osm_file:
+        end = find_elements_end(osm_file, os.path.getsize(file_in))
+        offset = find_next_element(osm_file, 0, end)
+        while offset < end:
+            next_offset = find_next_element(osm_file, offset + range_bytes, end)
+            yield offset, next_offset
+            offset = next_offset
+
+
+def convert_range(args):
+    """Parse, shape, validate and format as csv rows one byte range of the .osm file on a worker of the pipeline,
+    return the utf8 text of every csv, the CPU seconds of each stage and the elements by tag"""
+    file_in, start, end, validate, validate_every, backend = args
+    start_time = time.process_time()
+    metrics = osm_metrics.Metrics(progress_every=0)
+    buffers = [io.StringIO() for _ in CSV_PATHS]
+    range_file = ShardFile(file_in, start, end)
+    try:
+        # validate_every counts the elements of the range, as the shards of process_map_sharded do
+        write_csvs(get_element(range_file, tags=ELEMENT_TAGS, backend=backend), buffers, validate, write_header=False,
+                   validate_every=validate_every, metrics=metrics)
+        texts = [buffer.getvalue().encode('utf8') for buffer in buffers]
+    finally:
+        range_file.close()
+    # the timers count wall clock time, which the other processes stretch when they share a core, the CPU time of
+    # the range is split between the stages in their proportions
+    cpu_seconds = time.process_time() - start_time
+    timed_seconds = sum(metrics.seconds.values()) or 1.0
+    return texts, dict((name, cpu_seconds * value / timed_seconds) for name, value in metrics.seconds.items()), \
+        dict(metrics.elements)
+
+
+def process_map_pipelined(file_in, validate, workers, validate_every=1, backend='etree'):
+    """Convert byte ranges of the .osm file on workers processes, each one parsing, shaping, validating and formatting
+    its range, while this process appends the csv text of the ranges already converted to the csv(s) in file order.
+    Return the CPU seconds of every stage summed over the processes, the seconds the writes waited for a range and
+    the overlap of the stages against the wall clock seconds"""
+    if osm_pbf.is_pbf(file_in) or osm_parsers.is_compressed(file_in):
+        raise ValueError("pipelined conversion needs an uncompressed .osm file")
+
+    paths = CSV_PATHS
+    stats = dict(elements=0, ranges=0, parse_seconds=0.0, shape_seconds=0.0, validate_seconds=0.0,
+                 format_seconds=0.0, write_seconds=0.0, write_wait_seconds=0.0)
+    start_time = time.perf_counter()
+    CsvWriters(paths).close()
+    csv_files = [open(path, 'ab') for path in paths]
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = ((file_in, start, end, validate, validate_every, backend)
+                 for start, end in iter_element_ranges(file_in))
+        # the ranges converted ahead of the writes are bounded, the results come back in the order of the file
+        results = osm_parsers.imap_bounded(pool, convert_range, tasks, workers * PIPELINE_RANGES_PER_WORKER)
+        while True:
+            wait_time = time.perf_counter()
+            try:
+                texts, seconds, elements = next(results)
+            except StopIteration:
+                break
+            stats['write_wait_seconds'] += time.perf_counter() - wait_time
+            write_time = time.process_time()
+            for csv_file, text in zip(csv_files, texts):
+                csv_file.write(text)
+            stats['write_seconds'] += time.process_time() - write_time
+            # the write timer of a worker formats the rows into its buffers
+            for name, value in seconds.items():
+                stats[('format' if name == 'write' else name) + '_seconds'] += value
+            stats['elements'] += sum(elements.values())
+            stats['ranges'] += 1
+    finally:
+        # every result is taken by now, unless an error or an interrupt left conversions running
+        pool.terminate()
+        pool.join()
+        for csv_file in csv_files:
+            csv_file.close()
+
+    seconds = time.perf_counter() - start_time
+    report = dict((key, round(value, 3)) for key, value in stats.items())
+    report['seconds'] = round(seconds, 3)
+    # the time the stages would take one after the other over the time they took running side by side
+    report['overlap'] = round(sum(value for key, value in stats.items()
+                                  if key.endswith('_seconds') and key != 'write_wait_seconds') / seconds, 2)
+    return report
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+
+# Default paths of the --metrics report and the --profile stats
+METRICS_PATH = "center_of_london.metrics.json"
+PROFILE_PATH = "center_of_london.prof"
+
+
+class CsvWriters(object):
+    """Open the csv(s) in paths, in the order of CSV_PATHS, and write shaped elements to them"""
+    '''
+    encoding = 'utf8' has been addedd
+    '''
+
+    def __init__(self, paths, write_header=True, mode='w'):
+        # an open text file may stand for a path, it is written to and left open by close()
+        self.files = [codecs.open(path, mode, encoding='utf8') if isinstance(path, str) else path for path in paths]
+        self.opened = [csv_file for csv_file, path in zip(self.files, paths) if isinstance(path, str)]
+        nodes_file, nodes_tags_file, ways_file, way_nodes_file, way_tags_file, \
+            relations_file, relation_members_file, relation_tags_file, way_geometry_file = self.files
+
+        self.nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
+        self.node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
+        self.ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
+        self.way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
+        self.way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
+        self.relations_writer = UnicodeDictWriter(relations_file, RELATION_FIELDS)
+        self.relation_members_writer = UnicodeDictWriter(relation_members_file, RELATION_MEMBERS_FIELDS)
+        self.relation_tags_writer = UnicodeDictWriter(relation_tags_file, RELATION_TAGS_FIELDS)
+        self.way_geometry_writer = UnicodeDictWriter(way_geometry_file, WAY_GEOMETRY_FIELDS)
+
+        if write_header:
+            self.nodes_writer.writeheader()
+            self.node_tags_writer.writeheader()
+            self.ways_writer.writeheader()
+            self.way_nodes_writer.writeheader()
+            self.way_tags_writer.writeheader()
+            self.relations_writer.writeheader()
+            self.relation_members_writer.writeheader()
+            self.relation_tags_writer.writeheader()
+            self.way_geometry_writer.writeheader()
+
+    def write(self, el):
+        if 'node' in el:
+            self.nodes_writer.writerow(el['node'])
+            self.node_tags_writer.writerows(el['node_tags'])
+        elif 'way' in el:
+            self.ways_writer.writerow(el['way'])
+            self.way_nodes_writer.writerows(el['way_nodes'])
+            self.way_tags_writer.writerows(el['way_tags'])
+            if 'way_geometry' in el:
+                self.way_geometry_writer.writerow(el['way_geometry'])
+        elif 'relation' in el:
+            self.relations_writer.writerow(el['relation'])
+            self.relation_members_writer.writerows(el['relation_members'])
+            self.relation_tags_writer.writerows(el['relation_tags'])
+
+    def close(self):
+        for csv_file in self.opened:
+            csv_file.close()
+
+
+def write_csvs(elements, paths, validate, write_header=True, validate_every=1, mode='w', metrics=None,
+               locations=None):
+    """Shape each XML element and write it to the csv(s) in paths, validating every validate_every-th element,
+    return the tag and id of the last element. With an osm_metrics.Metrics object every stage is timed, with an
+    osm_locations store the ways get their way_geometry rows."""
+    writers = CsvWriters(paths, write_header, mode)
+    last_element = None
+    try:
+        validator = CompiledValidator()
+
+        shape, check, write = shape_element, validate_element, writers.write
+        if locations is not None:
+            shape = partial(shape_element, locations=locations)
+        if metrics is not None:
+            elements = metrics.timed_elements(elements)
+            shape = metrics.timed(shape, 'shape')
+            check = metrics.timed(validate_element, 'validate')
+            write = metrics.timed(metrics.counted_write(writers.write), 'write')
+
+        for index, element in enumerate(elements):
+            el = shape(element)
             if el:
-                if validate is True:
-                    validate_element(el, validator)
+                if validate is True and index % validate_every == 0:
+                    check(el, validator)
+                write(el)
+                last_element = (element.tag, element.attrib['id'])
+    finally:
+        writers.close()
+    return last_element
+
+
+def process_map_sharded(file_in, validate, workers, validate_every=1, backend='etree', columnar=False):
+    """Convert byte range shards of the XML file in parallel and merge the csv(s) in file order"""
+    paths = CSV_PATHS
+    fields = CSV_FIELDS
+
+    # keep the shard csv(s) next to the output so the merge does not cross disks
+    shard_dir = tempfile.mkdtemp(prefix='osm_shards_', dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+    try:
+        tasks = []
+        for index, (start, end) in enumerate(find_shard_boundaries(file_in, workers)):
+            shard_paths = [os.path.join(shard_dir, '{0}_{1}'.format(index, os.path.basename(path)))
+                           for path in paths]
+            tasks.append((file_in, start, end, shard_paths, validate, validate_every, backend, columnar))
 
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
+        pool = multiprocessing.Pool(workers)
+        try:
+            # map() returns the shards in the order of the input file
+            shards = pool.map(process_shard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        for table, (path, field_names) in enumerate(zip(paths, fields)):
+            with codecs.open(path, 'w', encoding='utf8') as out_file:
+                UnicodeDictWriter(out_file, field_names).writeheader()
+            with open(path, 'ab') as out_file:
+                for shard_paths in shards:
+                    with open(shard_paths[table], 'rb') as shard_file:
+                        shutil.copyfileobj(shard_file, out_file)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def process_map(file_in, validate, workers=1, validate_every=1, backend='etree', columnar=False, checkpoint=False,
+                resume=False, metrics=None, bbox=None, locations=None, pipeline=0):
+    """Iteratively process each XML element and write to csv(s), timing the stages in metrics if given, keeping
+    only the elements of bbox = (min_lat, min_lon, max_lat, max_lon) if given and computing the way geometry from
+    the node locations remembered in the osm_locations store if given. With pipeline converting processes the
+    conversion of the byte ranges overlaps with the writing and the report of process_map_pipelined is returned."""
+    sharded = workers > 1 and not osm_pbf.is_pbf(file_in) and not osm_parsers.is_compressed(file_in)
+    if pipeline:
+        # the pipeline converts byte ranges on processes of its own, away from the node locations, the ids kept by
+        # the clipping and the metrics
+        if checkpoint or resume or sharded or columnar or metrics is not None or locations is not None or \
+                bbox is not None:
+            raise ValueError("--pipeline needs a single process run of the dict writers without checkpoints, "
+                             "--metrics, --bbox or --geometry")
+        return process_map_pipelined(file_in, validate, pipeline, validate_every, backend)
+    # the ids kept by the clipping live in one process and are not saved by the checkpoints
+    if bbox is not None and (checkpoint or resume or sharded):
+        raise ValueError("--bbox needs a single process run without checkpoints")
+    # so do the node locations, and the ways of a shard reference the nodes of the others
+    if locations is not None and (checkpoint or resume or sharded):
+        raise ValueError("--geometry needs a single process run without checkpoints")
+
+    # checkpointed runs convert the byte ranges one after the other
+    if checkpoint or resume:
+        if metrics is None:
+            return process_map_checkpointed(file_in, validate, resume, validate_every, backend, columnar)
+        with timed_cleaning(metrics):
+            return process_map_checkpointed(file_in, validate, resume, validate_every, backend, columnar,
+                                            metrics=metrics)
+
+    # .osm.pbf and compressed files are not sharded, their blocks or bz2 streams are decoded on the workers instead
+    if sharded:
+        if metrics is not None:
+            raise ValueError("metrics are only collected in the main process, run the sharded conversion without them")
+        return process_map_sharded(file_in, validate, workers, validate_every, backend, columnar)
+
+    paths = CSV_PATHS
+    write = write_csvs_columnar if columnar else write_csvs
+    elements = get_element(file_in, tags=ELEMENT_TAGS, backend=backend, workers=workers)
+    if bbox is not None:
+        elements = osm_bbox.clip_elements(elements, bbox)
+    if metrics is None:
+        return write(elements, paths, validate, validate_every=validate_every, locations=locations)
+    with timed_cleaning(metrics):
+        return write(elements, paths, validate, validate_every=validate_every, metrics=metrics, locations=locations)
 
 
 if __name__ == '__main__':
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(OSM_PATH, validate=False)
+    parser = argparse.ArgumentParser(description='Convert an OSM XML file into csv(s)')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm, .osm.bz2/.gz/.xz or .osm.pbf file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes converting byte range shards of the file, '
+                             'or decoding .osm.pbf blocks and .bz2 streams')
+    parser.add_argument('--validate', action='store_true', help='validate the shaped elements against the schema')
+    parser.add_argument('--validate-every', type=int, default=1, metavar='N',
+                        help='validate only every Nth element')
+    parser.add_argument('--parser', default='etree', choices=sorted(osm_parsers.BACKENDS),
+                        help='XML parser backend')
+    parser.add_argument('--columnar', action='store_true',
+                        help='shape elements into column batches written with csv.writer instead of dicts')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save a checkpoint to {0} after every converted byte range'.format(CHECKPOINT_PATH))
+    parser.add_argument('--resume', action='store_true', help='resume from the last checkpoint')
+    parser.add_argument('--metrics', nargs='?', const=METRICS_PATH, metavar='PATH',
+                        help='time every stage and save the JSON report (default path: {0})'.format(METRICS_PATH))
+    parser.add_argument('--progress-every', type=float, default=10.0, metavar='SECONDS',
+                        help='seconds between two progress lines of --metrics, 0 to turn them off')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PATH, metavar='PATH',
+                        help='run under cProfile and save the stats (default path: {0})'.format(PROFILE_PATH))
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                        help='keep the nodes inside the box and the ways and relations referencing them')
+    parser.add_argument('--geometry', action='store_true',
+                        help='keep the node locations in memory and write the length, centroid and bbox of the ways '
+                             'to {0}'.format(WAY_GEOMETRY_PATH))
+    parser.add_argument('--locations-file', metavar='PATH',
+                        help='keep the node locations of --geometry in a memory-mapped file indexed by node id, '
+                             'for extracts whose nodes do not fit in memory')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='WORKERS',
+                        help='parse and shape byte ranges of a plain .osm file on WORKERS processes while the ranges '
+                             'already converted are written')
+    args = parser.parse_args()
+    single_process = not (args.checkpoint or args.resume or args.workers > 1 and not osm_pbf.is_pbf(args.osm_file)
+                          and not osm_parsers.is_compressed(args.osm_file))
+    if args.bbox and not single_process:
+        parser.error("--bbox needs --workers 1 on plain .osm files and no checkpoints")
+    if (args.geometry or args.locations_file) and not single_process:
+        parser.error("--geometry needs --workers 1 on plain .osm files and no checkpoints")
+    plain_osm = not osm_pbf.is_pbf(args.osm_file) and not osm_parsers.is_compressed(args.osm_file)
+    if args.pipeline and (not single_process or not plain_osm or args.columnar or args.metrics or args.bbox or
+                          args.geometry or args.locations_file):
+        parser.error("--pipeline needs --workers 1 on a plain .osm file, the dict writers and no checkpoints, "
+                     "--metrics, --bbox or --geometry")
+
+    metrics = osm_metrics.Metrics(args.progress_every) if args.metrics else None
+    if metrics is not None and args.workers > 1 and not osm_pbf.is_pbf(args.osm_file) \
+            and not osm_parsers.is_compressed(args.osm_file):
+        parser.error("--metrics needs --workers 1 on plain .osm files")
+
+    # Note: Validation uses the validator compiled from schema.schema, sample it with --validate-every
+    # on very large extracts, or run it on a small extract written by sample_osm.py.
+    locations = osm_locations.open_locations(args.locations_file) \
+        if args.geometry or args.locations_file else None
+    options = dict(validate=args.validate, workers=args.workers, validate_every=args.validate_every,
+                   backend=args.parser, columnar=args.columnar, checkpoint=args.checkpoint, resume=args.resume,
+                   metrics=metrics, bbox=args.bbox, locations=locations, pipeline=args.pipeline)
+    try:
+        if args.profile:
+            osm_metrics.run_profiled(args.profile, process_map, args.osm_file, **options)
+        elif args.pipeline:
+            pprint.pprint(process_map(args.osm_file, **options))
+        else:
+            process_map(args.osm_file, **options)
+    finally:
+        if locations is not None:
+            locations.close()
+
+    if metrics is not None:
+        report = metrics.save(args.metrics)
+        # the RSS samples stay in the saved report only
+        report['rss_mib'].pop('samples')
+        pprint.pprint(report)
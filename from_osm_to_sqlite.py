@@ -0,0 +1,316 @@
+# Import libraries
+import argparse
+import os
+import pprint
+import sqlite3
+import time
+from functools import partial
+
+# Import the shaping and cleaning functions of the csv conversion
+import osm_bbox
+import osm_locations
+import osm_metrics
+import osm_reports
+import osm_spatial
+from from_osm_to_csv import get_element, shape_element, validate_element, timed_cleaning, OSM_PATH, METRICS_PATH, \
+    ELEMENT_TAGS, NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS, \
+    RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS, WAY_GEOMETRY_FIELDS
+from schema_validator import CompiledValidator
+
+# SQLite database path and the schema it is created with
+DB_PATH = "center_of_london.db"
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_wrangling_schema.schema.sql")
+
+# Schema of the dictionary encoded tag storage, run after SCHEMA_PATH by the --dictionary loads
+DICTIONARY_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                      "data_wrangling_schema.dictionary.sql")
+
+# Values interned in tag_values: the short ones, which are the ones repeated over and over (yes, residential,
+# street names, postcodes...), until the dictionary holds VALUE_DICTIONARY_SIZE of them; the others stay inline
+VALUE_INTERN_MAX_LENGTH = 32
+VALUE_DICTIONARY_SIZE = 1 << 20
+
+# Rows buffered per table before an executemany and rows inserted per transaction
+BATCH_SIZE = 10000
+TRANSACTION_ROWS = 1000000
+
+# PRAGMAs used while bulk loading, the database is rebuilt from scratch if the load dies
+BULK_LOAD_PRAGMAS = ["PRAGMA journal_mode = OFF",
+                     "PRAGMA synchronous = OFF",
+                     "PRAGMA cache_size = -1048576",
+                     "PRAGMA temp_store = MEMORY",
+                     "PRAGMA foreign_keys = OFF"]
+
+# PRAGMAs restored once the data is in
+DEFAULT_PRAGMAS = ["PRAGMA journal_mode = DELETE",
+                   "PRAGMA synchronous = FULL",
+                   "PRAGMA foreign_keys = ON"]
+
+# Indexes built after the load, on the columns used to join tags, way nodes and relation members
+INDEXES = ["CREATE INDEX IF NOT EXISTS ways_nodes_id ON ways_nodes (id)",
+           "CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id)",
+           "CREATE INDEX IF NOT EXISTS relations_members_id ON relations_members (id)",
+           "CREATE INDEX IF NOT EXISTS relations_members_member ON relations_members (type, member_id)"]
+TAG_INDEXES = ["CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags (id)",
+               "CREATE INDEX IF NOT EXISTS ways_tags_id ON ways_tags (id)",
+               "CREATE INDEX IF NOT EXISTS relations_tags_id ON relations_tags (id)"]
+
+# Indexes of the dictionary encoded tag tables, the key_id ones serve the queries on a key through the views
+ENCODED_TAG_INDEXES = ["CREATE INDEX IF NOT EXISTS nodes_tags_encoded_id ON nodes_tags_encoded (id)",
+                       "CREATE INDEX IF NOT EXISTS nodes_tags_encoded_key ON nodes_tags_encoded (key_id)",
+                       "CREATE INDEX IF NOT EXISTS ways_tags_encoded_id ON ways_tags_encoded (id)",
+                       "CREATE INDEX IF NOT EXISTS ways_tags_encoded_key ON ways_tags_encoded (key_id)",
+                       "CREATE INDEX IF NOT EXISTS relations_tags_encoded_id ON relations_tags_encoded (id)"]
+
+# Tables and columns in the order the shaped element keys are written
+TABLES = [('node', 'nodes', NODE_FIELDS),
+          ('node_tags', 'nodes_tags', NODE_TAGS_FIELDS),
+          ('way', 'ways', WAY_FIELDS),
+          ('way_nodes', 'ways_nodes', WAY_NODES_FIELDS),
+          ('way_tags', 'ways_tags', WAY_TAGS_FIELDS),
+          ('relation', 'relations', RELATION_FIELDS),
+          ('relation_members', 'relations_members', RELATION_MEMBERS_FIELDS),
+          ('relation_tags', 'relations_tags', RELATION_TAGS_FIELDS),
+          ('way_geometry', 'ways_geometry', WAY_GEOMETRY_FIELDS)]
+
+# Tag tables of the dictionary encoded storage, their columns and the rows of the two dictionaries
+TAG_KEYS = ('node_tags', 'way_tags', 'relation_tags')
+ENCODED_TAG_FIELDS = ['id', 'key_id', 'value_id', 'value']
+DICTIONARY_TABLES = [('tag_key', 'tag_keys', ['id', 'key', 'type']),
+                     ('tag_value', 'tag_values', ['id', 'value'])]
+
+
+class TagDictionary(object):
+    """Assign the tag_keys and tag_values ids of the loaded tags and encode the tag rows with them"""
+
+    def __init__(self):
+        self.keys = {}
+        self.values = {}
+        # rows of the dictionary entries added since the last take_new_entries()
+        self.new_keys = []
+        self.new_values = []
+
+    def encode(self, row):
+        """The (id, key_id, value_id, value) row of a shaped tag row, value is None if the value is interned"""
+        key = (row['key'], row['type'])
+        key_id = self.keys.get(key)
+        if key_id is None:
+            key_id = self.keys[key] = len(self.keys) + 1
+            self.new_keys.append((key_id,) + key)
+
+        value = row['value']
+        value_id = self.values.get(value)
+        if value_id is None and len(value) <= VALUE_INTERN_MAX_LENGTH and len(self.values) < VALUE_DICTIONARY_SIZE:
+            value_id = self.values[value] = len(self.values) + 1
+            self.new_values.append((value_id, value))
+        if value_id is None:
+            return row['id'], key_id, None, value
+        return row['id'], key_id, value_id, None
+
+    def take_new_entries(self):
+        new_entries = {'tag_key': self.new_keys, 'tag_value': self.new_values}
+        self.new_keys = []
+        self.new_values = []
+        return new_entries
+
+
+class SQLiteBulkLoader(object):
+    """Stream shaped elements into the SQLite tables with batched inserts inside large transactions"""
+
+    def __init__(self, db_path=DB_PATH, schema_path=SCHEMA_PATH, batch_size=BATCH_SIZE,
+                 transaction_rows=TRANSACTION_ROWS, dictionary=False):
+        # the database is rebuilt from scratch, the same way the csv(s) are opened in 'w' mode
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        self.connection = sqlite3.connect(db_path, isolation_level=None)
+        self.batch_size = batch_size
+        self.transaction_rows = transaction_rows
+        self.pending_rows = 0
+
+        for pragma in BULK_LOAD_PRAGMAS:
+            self.connection.execute(pragma)
+
+        # the foreign keys are declared by the schema but only enforced once the load has finished
+        with open(schema_path) as schema_file:
+            self.connection.executescript(schema_file.read())
+
+        # the dictionary encoded tag rows go to the *_tags_encoded tables behind the tag views
+        self.dictionary = None
+        self.tables = TABLES
+        if dictionary:
+            with open(DICTIONARY_SCHEMA_PATH) as schema_file:
+                self.connection.executescript(schema_file.read())
+            self.dictionary = TagDictionary()
+            self.tables = [(key, table + '_encoded', ENCODED_TAG_FIELDS) if key in TAG_KEYS else (key, table, fields)
+                           for key, table, fields in TABLES] + DICTIONARY_TABLES
+
+        self.statements = {}
+        self.batches = {}
+        self.rows = {}
+        self.seconds = {}
+        for key, table, fields in self.tables:
+            self.statements[key] = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                table, ', '.join(fields), ', '.join('?' * len(fields)))
+            self.batches[key] = []
+            self.rows[key] = 0
+            self.seconds[key] = 0.0
+
+        self.fields = dict((key, fields) for key, _, fields in TABLES)
+        self.start_time = time.time()
+        self.connection.execute("BEGIN")
+
+    def write(self, el):
+        """Buffer the rows of one shaped element"""
+        for key, rows in el.items():
+            fields = self.fields[key]
+            batch = self.batches[key]
+            if self.dictionary is not None and key in TAG_KEYS:
+                batch.extend(self.dictionary.encode(row) for row in rows)
+                for entry_key, entries in self.dictionary.take_new_entries().items():
+                    self.batches[entry_key].extend(entries)
+            elif isinstance(rows, dict):
+                batch.append(tuple(rows[field] for field in fields))
+            else:
+                batch.extend(tuple(row[field] for field in fields) for row in rows)
+            if len(batch) >= self.batch_size:
+                self.flush(key)
+
+    def flush(self, key):
+        """Insert the buffered rows of one table and commit when the transaction is large enough"""
+        batch = self.batches[key]
+        if not batch:
+            return
+        start_time = time.time()
+        self.connection.executemany(self.statements[key], batch)
+        self.seconds[key] += time.time() - start_time
+        self.rows[key] += len(batch)
+        self.pending_rows += len(batch)
+        self.batches[key] = []
+
+        if self.pending_rows >= self.transaction_rows:
+            self.connection.execute("COMMIT")
+            self.connection.execute("BEGIN")
+            self.pending_rows = 0
+
+    def finish(self):
+        """Flush the batches, build the indexes, the R*Tree spatial index and the report summaries, check the foreign
+        keys and return the load report"""
+        for key, _, _ in self.tables:
+            self.flush(key)
+        self.connection.execute("COMMIT")
+        load_seconds = time.time() - self.start_time
+
+        start_time = time.time()
+        for index in INDEXES + (TAG_INDEXES if self.dictionary is None else ENCODED_TAG_INDEXES):
+            self.connection.execute(index)
+        index_seconds = time.time() - start_time
+
+        start_time = time.time()
+        osm_spatial.build_spatial_index(self.connection)
+        spatial_index_seconds = time.time() - start_time
+
+        start_time = time.time()
+        with self.connection:
+            osm_reports.build_summaries(self.connection)
+        summary_seconds = time.time() - start_time
+        self.connection.execute("ANALYZE")
+
+        for pragma in DEFAULT_PRAGMAS:
+            self.connection.execute(pragma)
+        foreign_key_violations = {}
+        for table, _, _, _ in self.connection.execute("PRAGMA foreign_key_check"):
+            foreign_key_violations[table] = foreign_key_violations.get(table, 0) + 1
+        self.connection.close()
+
+        report = {'load_seconds': round(load_seconds, 3),
+                  'index_seconds': round(index_seconds, 3),
+                  'spatial_index_seconds': round(spatial_index_seconds, 3),
+                  'summary_seconds': round(summary_seconds, 3),
+                  'foreign_key_violations': foreign_key_violations,
+                  'tables': {}}
+        for key, table, _ in self.tables:
+            seconds = self.seconds[key]
+            report['tables'][table] = {'rows': self.rows[key],
+                                       'insert_seconds': round(seconds, 3),
+                                       'rows_per_sec': int(self.rows[key] / seconds) if seconds else 0}
+        return report
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map_to_sqlite(file_in, db_path, validate, metrics=None, bbox=None, locations=None, dictionary=False,
+                          validate_every=1):
+    """Iteratively process each XML element and load it into the SQLite database, validating every
+    validate_every-th element if validate is set, timing the stages in metrics if given (the index build of
+    finish() counts as write), keeping only the elements of bbox if given, filling ways_geometry from the node
+    locations remembered in the osm_locations store if given and storing the tags dictionary encoded if dictionary
+    is set"""
+    loader = SQLiteBulkLoader(db_path, dictionary=dictionary)
+    validator = CompiledValidator()
+    elements = get_element(file_in, tags=ELEMENT_TAGS)
+    if bbox is not None:
+        elements = osm_bbox.clip_elements(elements, bbox)
+
+    shape, check, write, finish = shape_element, validate_element, loader.write, loader.finish
+    if locations is not None:
+        shape = partial(shape_element, locations=locations)
+    if metrics is not None:
+        elements = metrics.timed_elements(elements)
+        shape = metrics.timed(shape, 'shape')
+        check = metrics.timed(validate_element, 'validate')
+        write = metrics.timed(metrics.counted_write(loader.write), 'write')
+        finish = metrics.timed(loader.finish, 'write')
+
+    for index, element in enumerate(elements):
+        el = shape(element)
+        if el:
+            if validate is True and index % validate_every == 0:
+                check(el, validator)
+            write(el)
+
+    return finish()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load an OSM XML file straight into SQLite')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm file')
+    parser.add_argument('--db', default=DB_PATH, help='output SQLite database')
+    parser.add_argument('--validate', action='store_true', help='validate the shaped elements against the schema')
+    parser.add_argument('--validate-every', type=int, default=1, metavar='N',
+                        help='validate only every Nth element')
+    parser.add_argument('--metrics', nargs='?', const=METRICS_PATH, metavar='PATH',
+                        help='time every stage and save the JSON report (default path: {0})'.format(METRICS_PATH))
+    parser.add_argument('--progress-every', type=float, default=10.0, metavar='SECONDS',
+                        help='seconds between two progress lines of --metrics, 0 to turn them off')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                        help='keep the nodes inside the box and the ways and relations referencing them')
+    parser.add_argument('--geometry', action='store_true',
+                        help='keep the node locations in memory and fill the ways_geometry table while loading')
+    parser.add_argument('--locations-file', metavar='PATH',
+                        help='keep the node locations of --geometry in a memory-mapped file indexed by node id')
+    parser.add_argument('--dictionary', action='store_true',
+                        help='store the tag keys, types and short values once in tag_keys and tag_values and '
+                             'reference them by id, the tag tables become views with the same columns')
+    args = parser.parse_args()
+
+    locations = osm_locations.open_locations(args.locations_file) \
+        if args.geometry or args.locations_file else None
+    try:
+        if args.metrics:
+            metrics = osm_metrics.Metrics(args.progress_every)
+            with timed_cleaning(metrics):
+                pprint.pprint(process_map_to_sqlite(args.osm_file, args.db, args.validate, metrics=metrics,
+                                                    bbox=args.bbox, locations=locations, dictionary=args.dictionary,
+                                                    validate_every=args.validate_every))
+            report = metrics.save(args.metrics)
+            report['rss_mib'].pop('samples')
+            pprint.pprint(report)
+        else:
+            pprint.pprint(process_map_to_sqlite(args.osm_file, args.db, args.validate, bbox=args.bbox,
+                                                locations=locations, dictionary=args.dictionary,
+                                                validate_every=args.validate_every))
+    finally:
+        if locations is not None:
+            locations.close()
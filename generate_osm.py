@@ -0,0 +1,167 @@
+"""
+Seeded generator of synthetic OSM XML files for the benchmarks.
+
+The same seed and parameters always write the same file. Nodes lie inside the London bounding box along short
+random walks, as consecutive nodes of a real street do, and ways reference a run of consecutive nodes. A dirty_share
+of the addr:street and postal_code tags carries the abbreviations and malformed postcodes that the cleaning
+functions of from_osm_to_csv have to fix.
+"""
+import argparse
+import random
+from xml.sax.saxutils import quoteattr
+
+from from_osm_to_csv import mapping
+
+# Bounding box of the synthetic map (min lat, min lon, max lat, max lon)
+BBOX = (51.2550, -0.8253, 51.7573, 0.5699)
+
+# Nodes of one random walk and the length of a step in degrees
+WALK_NODES = 50
+WALK_STEP = 0.0002
+
+# Building blocks of the street names, the dirty endings are the keys of the cleaning mapping
+STREET_NAMES = ["Baker", "Oxford", "Abbey", "Mill", "Kings", "Market", "Church", "Park", "Station", "Victoria",
+                "Queens", "Albert", "George", "Green", "Bridge", "Castle", "Chapel", "Manor", "Grange", "Orchard"]
+CLEAN_STREET_ENDINGS = ["Street", "Road", "Avenue", "Lane", "Close", "Crescent", "Square", "Walk", "Place", "Hill"]
+DIRTY_STREET_ENDINGS = sorted(mapping) + ["12a", "3"]
+
+# Postcode areas, the dirty postcodes drop the space, use lower case or are no postcode at all
+POSTCODE_AREAS = ["SW1A", "EC1A", "N1", "W1D", "SE1", "E14", "NW3", "WC2N"]
+DIRTY_POSTCODES = ["unknown", "London", "SW1", "12345"]
+
+# Keys and values of the filler tags
+TAG_VALUES = {'amenity': ["cafe", "restaurant", "pub", "bank", "school"],
+              'building': ["yes", "house", "retail"],
+              'highway': ["residential", "primary", "footway"],
+              'cuisine': ["indian", "italian", "british"],
+              'name': ["The Crown", "Corner Shop", "Station House"],
+              'source': ["survey", "bing"],
+              'created_by': ["JOSM", "Potlatch 0.10f"],
+              'fixme': ["check"],
+              'addr:housenumber': ["1", "12", "221b"],
+              'addr:city': ["London"],
+              'is_in:country': ["UK"],
+              'bad key': ["x"]}
+
+
+def street_name(rng, dirty_share):
+    ending = rng.choice(DIRTY_STREET_ENDINGS if rng.random() < dirty_share else CLEAN_STREET_ENDINGS)
+    return "{0} {1}".format(rng.choice(STREET_NAMES), ending)
+
+
+def postal_code(rng, dirty_share):
+    if rng.random() < dirty_share:
+        postcode = "{0}{1}{2}".format(rng.choice(POSTCODE_AREAS), rng.randint(0, 9), rng.choice(["AA", "BB", "GU"]))
+        return rng.choice([postcode, postcode.lower(), rng.choice(DIRTY_POSTCODES)])
+    return "{0} {1}{2}".format(rng.choice(POSTCODE_AREAS), rng.randint(0, 9), rng.choice(["AA", "BB", "GU"]))
+
+
+def element_tags(rng, tags_per_element, dirty_share):
+    """A random number of tags with tags_per_element on average, a third of them addresses"""
+    count = int(rng.expovariate(1.0 / tags_per_element)) if tags_per_element > 0 else 0
+    tags = {}
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            tags['addr:street'] = street_name(rng, dirty_share)
+        elif kind < 0.33:
+            tags['postal_code'] = postal_code(rng, dirty_share)
+        else:
+            key = rng.choice(sorted(TAG_VALUES))
+            tags[key] = rng.choice(TAG_VALUES[key])
+    return sorted(tags.items())
+
+
+def write_element(osm_file, tag, attributes, children):
+    attribute_text = ' '.join('{0}={1}'.format(key, quoteattr(str(value))) for key, value in attributes)
+    if not children:
+        osm_file.write('  <{0} {1}/>\n'.format(tag, attribute_text))
+        return
+    osm_file.write('  <{0} {1}>\n'.format(tag, attribute_text))
+    for child_tag, child_attributes in children:
+        osm_file.write('    <{0} {1}/>\n'.format(child_tag, ' '.join(
+            '{0}={1}'.format(key, quoteattr(str(value))) for key, value in child_attributes)))
+    osm_file.write('  </{0}>\n'.format(tag))
+
+
+def generate_osm(path, nodes=100000, way_ratio=0.15, tags_per_element=1.0, dirty_share=0.2, nodes_per_way=6,
+                 relation_ratio=0.01, seed=1):
+    """Write a synthetic OSM XML file and return the number of nodes, ways and relations in it"""
+    rng = random.Random(seed)
+    ways = int(nodes * way_ratio)
+    relations = int(ways * relation_ratio)
+    min_lat, min_lon, max_lat, max_lon = BBOX
+
+    with open(path, 'w', encoding='utf8') as osm_file:
+        osm_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        osm_file.write('<osm version="0.6" generator="generate_osm.py">\n')
+        osm_file.write('  <bounds minlat="{0}" minlon="{1}" maxlat="{2}" maxlon="{3}"/>\n'.format(*BBOX))
+
+        lat = lon = None
+        for node_id in range(1, nodes + 1):
+            if node_id % WALK_NODES == 1:
+                lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+            else:
+                lat = min(max(lat + rng.uniform(-WALK_STEP, WALK_STEP), min_lat), max_lat)
+                lon = min(max(lon + rng.uniform(-WALK_STEP, WALK_STEP), min_lon), max_lon)
+            user = rng.randint(1, 500)
+            write_element(osm_file, 'node',
+                          [('id', node_id),
+                           ('lat', '{0:.7f}'.format(lat)),
+                           ('lon', '{0:.7f}'.format(lon)),
+                           ('version', rng.randint(1, 9)),
+                           ('timestamp', '2016-{0:02d}-{1:02d}T12:00:00Z'.format(rng.randint(1, 12),
+                                                                                rng.randint(1, 28))),
+                           ('changeset', rng.randint(1, 40000000)),
+                           ('uid', user),
+                           ('user', 'user_{0}'.format(user))],
+                          [('tag', [('k', key), ('v', value)])
+                           for key, value in element_tags(rng, tags_per_element, dirty_share)])
+
+        for way_id in range(nodes + 1, nodes + ways + 1):
+            user = rng.randint(1, 500)
+            length = min(rng.randint(2, 2 * nodes_per_way - 2), nodes)
+            first = rng.randint(1, nodes - length + 1)
+            refs = [('nd', [('ref', ref)]) for ref in range(first, first + length)]
+            write_element(osm_file, 'way',
+                          [('id', way_id),
+                           ('version', rng.randint(1, 9)),
+                           ('timestamp', '2016-{0:02d}-{1:02d}T12:00:00Z'.format(rng.randint(1, 12),
+                                                                                rng.randint(1, 28))),
+                           ('changeset', rng.randint(1, 40000000)),
+                           ('uid', user),
+                           ('user', 'user_{0}'.format(user))],
+                          refs + [('tag', [('k', key), ('v', value)])
+                                  for key, value in element_tags(rng, tags_per_element, dirty_share)])
+
+        for relation_id in range(nodes + ways + 1, nodes + ways + relations + 1):
+            members = [('member', [('type', 'way'), ('ref', rng.randint(nodes + 1, nodes + ways)), ('role', 'outer')]),
+                       ('member', [('type', 'node'), ('ref', rng.randint(1, nodes)), ('role', '')])]
+            write_element(osm_file, 'relation',
+                          [('id', relation_id),
+                           ('version', 1),
+                           ('timestamp', '2016-01-01T12:00:00Z'),
+                           ('changeset', rng.randint(1, 40000000)),
+                           ('uid', 1),
+                           ('user', 'user_1')],
+                          members + [('tag', [('k', 'type'), ('v', 'multipolygon')])])
+
+        osm_file.write('</osm>\n')
+
+    return {'nodes': nodes, 'ways': ways, 'relations': relations}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a seeded synthetic OSM XML file')
+    parser.add_argument('output', help='output .osm file')
+    parser.add_argument('--nodes', type=int, default=100000, help='number of nodes')
+    parser.add_argument('--way-ratio', type=float, default=0.15, help='ways per node')
+    parser.add_argument('--tags-per-element', type=float, default=1.0, help='average tags per node and way')
+    parser.add_argument('--dirty-share', type=float, default=0.2,
+                        help='share of street names and postcodes that need cleaning')
+    parser.add_argument('--nodes-per-way', type=int, default=6, help='average node references per way')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args()
+
+    print(generate_osm(args.output, args.nodes, args.way_ratio, args.tags_per_element, args.dirty_share,
+                       args.nodes_per_way, seed=args.seed))
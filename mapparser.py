@@ -1,17 +1,118 @@
-import xml.etree.cElementTree as ET
+import argparse
+import mmap
+import multiprocessing
+import os
 import pprint
-from collections import defaultdict
+import re
+from collections import Counter, defaultdict
+
+import osm_parsers
+import osm_pbf
+
+# Start of an element and its name. Comments, CDATA sections and processing instructions are matched whole, so the
+# markup they may hold is not counted; end tags and <!DOCTYPE ...> never match a name. A well formed OSM file has no
+# '<' in its attribute values and no text, every other '<' opens an element.
+START_TAG = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<([^\s/>!?]+)', re.DOTALL)
+
+# Openings and closings of the sections whose content is not markup, which the scan ranges must not cut
+SECTIONS = ((b'<!--', b'-->'), (b'<![CDATA[', b']]>'), (b'<?', b'?>'))
+
+# Bytes scanned per findall call, which keeps the list of names it builds small
+SCAN_CHUNK = 1 << 23
 
 
 def count_tags(filename):
     """ The top tags and how many of each"""
     counts = defaultdict(int)
-    for event, node in ET.iterparse(filename):
-        if event == 'end':
+    for element in osm_parsers.iter_osm(filename, tags=None):
+        for node in element.iter():
             counts[node.tag] += 1
-        node.clear()
+    # the root is not one of the streamed elements, .osm.pbf files have no XML root and keep their bbox in the header
+    counts['osm'] += 1
+    if osm_pbf.is_pbf(filename) and osm_pbf.read_header(filename)['bbox']:
+        counts['bounds'] += 1
     return counts
 
 
-filename = "maps-xml/London_full.osm"
-pprint.pprint(count_tags(filename))
+def next_cut(mapped, position, cut, end):
+    """First '<' at or after cut, or end, that lies outside the comments, CDATA sections and processing
+    instructions, found by scanning them from position, which lies outside of them too"""
+    cut = min(cut, end)
+    while position < cut:
+        # an opening starting before the cut may end after it
+        found = [(mapped.find(opening, position, min(cut + len(opening) - 1, end)), opening, closing)
+                 for opening, closing in SECTIONS]
+        found = [section for section in found if section[0] != -1]
+        if not found:
+            break
+        start, opening, closing = min(found)
+        close = mapped.find(closing, start + len(opening), end)
+        position = end if close == -1 else close + len(closing)
+        # a section holding the cut moves it to its end
+        cut = max(cut, position)
+    if cut == end:
+        return end
+    index = mapped.find(b'<', cut, end)
+    return end if index == -1 else index
+
+
+def scan_range(args):
+    """Count the element start tags of a byte range of the file cut by next_cut"""
+    filename, start, end = args
+    counts = Counter()
+    with open(filename, 'rb') as osm_file, mmap.mmap(osm_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        position = start
+        while position < end:
+            # the scan stops on a '<' outside of any section, so no start tag or section is cut in two
+            stop = next_cut(mapped, position, position + SCAN_CHUNK, end)
+            counts.update(START_TAG.findall(mapped, position, stop))
+            position = stop
+    # the comments, CDATA sections and processing instructions
+    del counts[b'']
+    return counts
+
+
+def count_tags_fast(filename, workers=None):
+    """count_tags without parsing: the memory-mapped bytes of a plain .osm file are scanned for start tags, in
+    ranges cut on a '<' outside of any comment, CDATA section or processing instruction and counted on workers
+    processes (one per core by default). The counts are the ones of count_tags on well formed OSM XML. Compressed
+    and .osm.pbf files cannot be mapped and are counted by count_tags."""
+    if osm_pbf.is_pbf(filename) or osm_parsers.is_compressed(filename):
+        return count_tags(filename)
+
+    workers = workers or multiprocessing.cpu_count()
+    size = os.path.getsize(filename)
+    counts = Counter()
+    if size:
+        with open(filename, 'rb') as osm_file, mmap.mmap(osm_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offsets = [0]
+            for worker in range(1, workers):
+                offsets.append(next_cut(mapped, offsets[-1], max(size * worker // workers, offsets[-1]), size))
+        ranges = [(filename, start, end) for start, end in zip(offsets, offsets[1:] + [size]) if start < end]
+        if workers == 1:
+            results = map(scan_range, ranges)
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(scan_range, ranges)
+            finally:
+                pool.close()
+                pool.join()
+        for range_counts in results:
+            counts.update(range_counts)
+    return defaultdict(int, ((name.decode('utf8'), count) for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Count the elements of an OSM file by tag name')
+    parser.add_argument('osm_file', nargs='?', default="maps-xml/London_full.osm",
+                        help='input .osm, .osm.bz2/.gz/.xz or .osm.pbf file')
+    parser.add_argument('--fast', action='store_true',
+                        help='scan the raw bytes of a plain .osm file for start tags instead of parsing it')
+    parser.add_argument('--workers', type=int, metavar='N', help='processes of --fast (default: one per core)')
+    args = parser.parse_args()
+
+    if args.fast:
+        pprint.pprint(count_tags_fast(args.osm_file, args.workers))
+    else:
+        pprint.pprint(count_tags(args.osm_file))
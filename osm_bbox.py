@@ -0,0 +1,105 @@
+"""
+Bounding box clipping of the element stream.
+
+clip_elements() drops the nodes outside the box while the file streams and keeps every way that references at least
+one kept node and every relation with at least one kept member. The kept ids are remembered in IdSet objects, a
+sorted array('q') of 8 bytes per kept id instead of the ~70 bytes of a Python set entry, whatever the spread of the
+ids over the planet's id range. The file has to list the nodes before the ways and the ways before the relations, as
+OSM files do, so the kept ids arrive in increasing order and are appended to the array.
+"""
+import bisect
+import sys
+from array import array
+
+# Out of order ids held in a set before they are merged into the sorted array, at least PENDING_IDS and at most
+# an eighth of the array, so the merges cost O(1) per id amortized
+PENDING_IDS = 4096
+
+
+class IdSet(object):
+    """Set of integer ids stored in a sorted array, the ids added in increasing order are appended to it"""
+    __slots__ = ('ids', 'pending')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.pending = set()
+
+    def add(self, element_id):
+        ids = self.ids
+        if not ids or element_id > ids[-1]:
+            ids.append(element_id)
+        elif element_id not in self:
+            self.pending.add(element_id)
+            if len(self.pending) > max(PENDING_IDS, len(ids) >> 3):
+                self.merge()
+
+    def merge(self):
+        self.ids = array('q', sorted(self.ids + array('q', self.pending)))
+        self.pending = set()
+
+    def __contains__(self, element_id):
+        ids = self.ids
+        index = bisect.bisect_left(ids, element_id)
+        return (index < len(ids) and ids[index] == element_id) or element_id in self.pending
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def nbytes(self):
+        """Bytes taken by the array and the set of pending ids"""
+        return self.ids.buffer_info()[1] * self.ids.itemsize + sys.getsizeof(self.pending) + \
+            len(self.pending) * sys.getsizeof(1 << 40)
+
+
+def in_bbox(lat, lon, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+
+class BBoxClipper(object):
+    """Decide element by element whether it belongs to the clipped extract"""
+
+    def __init__(self, bbox):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("the bounding box minimum is above its maximum: {0}".format(bbox))
+        self.bbox = bbox
+        self.kept = {'node': IdSet(), 'way': IdSet(), 'relation': IdSet()}
+        self.dropped = {'node': 0, 'way': 0, 'relation': 0}
+
+    def keep(self, element):
+        tag = element.tag
+        attributes = element.attrib
+        if tag == 'node':
+            keep = in_bbox(float(attributes['lat']), float(attributes['lon']), self.bbox)
+        elif tag == 'way':
+            nodes = self.kept['node']
+            keep = any(int(nd.attrib['ref']) in nodes for nd in element.iter('nd'))
+        elif tag == 'relation':
+            keep = any(int(member.attrib['ref']) in self.kept[member.attrib['type']]
+                       for member in element.iter('member'))
+        else:
+            return True
+
+        if keep:
+            # negative ids of not yet uploaded edits are never referenced by the kept elements of a clipped extract
+            element_id = int(attributes['id'])
+            if element_id >= 0:
+                self.kept[tag].add(element_id)
+        else:
+            self.dropped[tag] += 1
+        return keep
+
+    def report(self):
+        return {'kept': dict((tag, len(ids)) for tag, ids in self.kept.items()),
+                'dropped': dict(self.dropped),
+                'kept_id_bytes': sum(ids.nbytes() for ids in self.kept.values())}
+
+
+def clip_elements(elements, bbox, clipper=None):
+    """Yield the elements of the extract clipped to bbox = (min_lat, min_lon, max_lat, max_lon)"""
+    clipper = clipper or BBoxClipper(bbox)
+    keep = clipper.keep
+    for element in elements:
+        if keep(element):
+            yield element
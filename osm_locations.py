@@ -0,0 +1,191 @@
+"""
+Node id -> (lat, lon) stores filled while the nodes stream, used to compute the geometry of the ways that follow.
+
+Coordinates are kept as OSM does, in int32 units of 1e-7 degree.
+- NodeLocations appends to sorted id, lat and lon arrays, 16 bytes per node, and looks ids up by bisection.
+- DenseNodeLocations keeps 8 bytes per possible id in a memory-mapped file indexed by id, the file is sparse on disk
+  and the pages of the ids that do not exist are never written, which suits country and planet extracts.
+- SQLiteNodeLocations reads the nodes table of a loaded database, for apply_osm_change.
+"""
+import bisect
+import mmap
+import os
+from array import array
+
+import osm_spatial
+
+# Units per degree of the stored coordinates
+COORDINATE_SCALE = 10000000
+
+# Added to the stored latitude of the dense store so that the zero filled pages of unknown ids read as missing
+DENSE_LAT_OFFSET = 90 * COORDINATE_SCALE + 1
+
+# Ids the dense file grows by at least
+DENSE_GROWTH_IDS = 1 << 20
+
+
+def to_fixed(degrees):
+    return int(round(degrees * COORDINATE_SCALE))
+
+
+class NodeLocations(object):
+    """In-memory store of sorted parallel arrays"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.lats = array('i')
+        self.lons = array('i')
+        self.sorted = True
+
+    def add(self, node_id, lat, lon):
+        if self.ids and node_id <= self.ids[-1]:
+            self.sorted = False
+        self.ids.append(node_id)
+        self.lats.append(to_fixed(lat))
+        self.lons.append(to_fixed(lon))
+
+    def sort(self):
+        """Sort the arrays by id, the last location added for an id wins"""
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        kept = [index for position, index in enumerate(order)
+                if position + 1 == len(order) or self.ids[order[position + 1]] != self.ids[index]]
+        self.ids = array('q', (self.ids[index] for index in kept))
+        self.lats = array('i', (self.lats[index] for index in kept))
+        self.lons = array('i', (self.lons[index] for index in kept))
+        self.sorted = True
+
+    def get(self, node_id):
+        """(lat, lon) of a node or None"""
+        if not self.sorted:
+            self.sort()
+        index = bisect.bisect_left(self.ids, node_id)
+        if index < len(self.ids) and self.ids[index] == node_id:
+            return self.lats[index] / COORDINATE_SCALE, self.lons[index] / COORDINATE_SCALE
+        return None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.ids, self.lats, self.lons))
+
+    def close(self):
+        pass
+
+
+class DenseNodeLocations(object):
+    """Memory-mapped file of (lat, lon) int32 pairs indexed by node id"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.map = None
+        self.values = None
+        self.capacity = 0
+        self.count = 0
+        # negative ids of not yet uploaded edits do not fit the file
+        self.negative = {}
+        self.grow(DENSE_GROWTH_IDS)
+
+    def grow(self, capacity):
+        if self.values is not None:
+            self.values.release()
+            self.map.close()
+        self.file.truncate(capacity * 8)
+        self.map = mmap.mmap(self.file.fileno(), capacity * 8)
+        self.values = memoryview(self.map).cast('i')
+        self.capacity = capacity
+
+    def add(self, node_id, lat, lon):
+        if node_id < 0:
+            self.negative[node_id] = (to_fixed(lat), to_fixed(lon))
+            self.count += 1
+            return
+        if node_id >= self.capacity:
+            self.grow(max(node_id + 1, self.capacity * 2, self.capacity + DENSE_GROWTH_IDS))
+        if self.values[2 * node_id] == 0:
+            self.count += 1
+        self.values[2 * node_id] = to_fixed(lat) + DENSE_LAT_OFFSET
+        self.values[2 * node_id + 1] = to_fixed(lon)
+
+    def get(self, node_id):
+        """(lat, lon) of a node or None"""
+        if node_id < 0:
+            location = self.negative.get(node_id)
+            return (location[0] / COORDINATE_SCALE, location[1] / COORDINATE_SCALE) if location else None
+        if node_id >= self.capacity:
+            return None
+        lat = self.values[2 * node_id]
+        if lat == 0:
+            return None
+        return (lat - DENSE_LAT_OFFSET) / COORDINATE_SCALE, self.values[2 * node_id + 1] / COORDINATE_SCALE
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        """Bytes of the file, most of them are holes that take no disk space"""
+        return self.capacity * 8
+
+    def close(self):
+        """Unmap and remove the file"""
+        if self.values is not None:
+            self.values.release()
+            self.map.close()
+            self.values = None
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SQLiteNodeLocations(object):
+    """Read-only store over the nodes table of a loaded database"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get(self, node_id):
+        """(lat, lon) of a node or None"""
+        return self.connection.execute(
+            "SELECT lat, lon FROM nodes WHERE id = ? AND lat IS NOT NULL AND lon IS NOT NULL", (node_id,)).fetchone()
+
+
+def open_locations(path=None):
+    """A DenseNodeLocations on path, or an in-memory NodeLocations without one"""
+    return DenseNodeLocations(path) if path else NodeLocations()
+
+
+def way_geometry(way_id, node_refs, locations):
+    """The ways_geometry row of a way from the locations of its nodes, or None if none of them is known
+
+    The length adds the great circle distances between consecutive known nodes, the centroid is the mean of the
+    known nodes and missing_nodes counts the references without a location.
+    """
+    points = []
+    missing = 0
+    length = 0.0
+    previous = None
+    for ref in node_refs:
+        location = locations.get(ref)
+        if location is None:
+            missing += 1
+            previous = None
+            continue
+        if previous is not None:
+            length += osm_spatial.distance(previous[0], previous[1], location[0], location[1])
+        points.append(location)
+        previous = location
+    if not points:
+        return None
+
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    return {'id': way_id,
+            'length': round(length, 2),
+            'centroid_lat': round(sum(lats) / len(lats), 7),
+            'centroid_lon': round(sum(lons) / len(lons), 7),
+            'min_lat': min(lats),
+            'min_lon': min(lons),
+            'max_lat': max(lats),
+            'max_lon': max(lons),
+            'missing_nodes': missing}
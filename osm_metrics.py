@@ -0,0 +1,169 @@
+"""
+Opt-in metrics of the conversion pipeline.
+
+A Metrics object wraps the functions of one run: timed() adds the wall time of a function to a named timer,
+timed_elements() times the parser while counting elements by tag and counted_write() counts the rows written per
+table. The RSS is sampled and a progress line printed at regular intervals, report() returns everything as a dict
+and save() writes it as JSON. Runs without a Metrics object call the plain functions and pay nothing.
+"""
+import cProfile
+import io
+import json
+import pstats
+import resource
+import sys
+import time
+from collections import defaultdict
+
+# Elements parsed between two looks at the clock
+CLOCK_CHECK_ELEMENTS = 1000
+
+# Seconds between two RSS samples
+RSS_SAMPLE_SECONDS = 1.0
+
+
+def current_rss_mib():
+    """Resident set size of this process, the peak where /proc is not available"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+
+class Metrics(object):
+    """Timers, counters and RSS samples of one run"""
+
+    def __init__(self, progress_every=10.0, stream=sys.stderr):
+        self.progress_every = progress_every
+        self.stream = stream
+        self.seconds = defaultdict(float)
+        self.elements = defaultdict(int)
+        # wall time of the run spent on the elements of each tag
+        self.element_seconds = defaultdict(float)
+        self.rows = defaultdict(int)
+        self.rss_samples = []
+        self.start_time = time.perf_counter()
+        self.next_sample = self.start_time
+        self.next_progress = self.start_time + progress_every if progress_every else None
+
+    def timed(self, function, name):
+        """Wrap function so that its wall time adds to the timer name"""
+        seconds = self.seconds
+
+        def timed_function(*args):
+            start_time = time.perf_counter()
+            result = function(*args)
+            seconds[name] += time.perf_counter() - start_time
+            return result
+        return timed_function
+
+    def timed_elements(self, elements, name='parse'):
+        """Yield the elements, timing the parser and counting the elements by tag. The time from one element to the
+        next, its processing and the parsing of the next one, goes to the element_seconds of its tag"""
+        seconds = self.seconds
+        counts = self.elements
+        element_seconds = self.element_seconds
+        iterator = iter(elements)
+        index = 0
+        tag, tag_time = None, time.perf_counter()
+        while True:
+            start_time = time.perf_counter()
+            try:
+                element = next(iterator)
+            except StopIteration:
+                end_time = time.perf_counter()
+                seconds[name] += end_time - start_time
+                if tag is not None:
+                    element_seconds[tag] += end_time - tag_time
+                break
+            end_time = time.perf_counter()
+            seconds[name] += end_time - start_time
+            if tag is not None:
+                element_seconds[tag] += end_time - tag_time
+            tag, tag_time = element.tag, end_time
+            counts[tag] += 1
+            index += 1
+            if index % CLOCK_CHECK_ELEMENTS == 0:
+                self.tick()
+            yield element
+        self.tick(force=True)
+
+    def counted_write(self, write):
+        """Wrap the write(el) of a writer so that the rows of every shaped element are counted"""
+        rows = self.rows
+
+        def counted(el):
+            for key, value in el.items():
+                rows[key] += len(value) if isinstance(value, list) else 1
+            return write(el)
+        return counted
+
+    def count_rows(self, key, count):
+        self.rows[key] += count
+
+    def tick(self, force=False):
+        """Sample the RSS and print the progress line when their interval has passed"""
+        now = time.perf_counter()
+        if force or now >= self.next_sample:
+            self.rss_samples.append((round(now - self.start_time, 3), round(current_rss_mib(), 1)))
+            self.next_sample = now + RSS_SAMPLE_SECONDS
+        if self.next_progress is not None and (force or now >= self.next_progress):
+            self.stream.write(self.progress_line(now) + '\n')
+            self.stream.flush()
+            self.next_progress = now + self.progress_every
+
+    def progress_line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start_time
+        total = sum(self.elements.values())
+        counts = '  '.join('{0} {1}'.format(tag, count) for tag, count in sorted(self.elements.items()))
+        return "elapsed {0:.1f}s  {1}  elements/sec {2}  rss {3:.1f} MiB".format(
+            elapsed, counts, int(total / elapsed) if elapsed else 0,
+            self.rss_samples[-1][1] if self.rss_samples else current_rss_mib())
+
+    def report(self):
+        """Timers, rates, row counts and RSS of the run so far. The rate of a tag divides its elements by the time
+        spent on them, the total rate divides all the elements by the elapsed time of the run"""
+        elapsed = time.perf_counter() - self.start_time
+        total = sum(self.elements.values())
+        stages = dict((name, round(seconds, 3)) for name, seconds in self.seconds.items()
+                      if not name.startswith('regex.'))
+        # the cleaning functions run inside shape_element, the shape timer only keeps the time outside them
+        if 'shape' in stages and 'clean' in stages:
+            stages['shape'] = round(self.seconds['shape'] - self.seconds['clean'], 3)
+        peak = max([rss for _, rss in self.rss_samples] or [current_rss_mib()])
+        return {'seconds': round(elapsed, 3),
+                'stage_seconds': stages,
+                'regex_seconds': dict((name[len('regex.'):], round(seconds, 6))
+                                      for name, seconds in self.seconds.items() if name.startswith('regex.')),
+                'elements': dict(self.elements),
+                'element_seconds': dict((tag, round(seconds, 3)) for tag, seconds in self.element_seconds.items()),
+                'elements_per_sec': dict([(tag, int(count / self.element_seconds[tag])
+                                           if self.element_seconds[tag] else 0)
+                                          for tag, count in self.elements.items()] +
+                                         [('total', int(total / elapsed) if elapsed else 0)]),
+                'rows': dict(self.rows),
+                'rss_mib': {'peak': peak, 'samples': self.rss_samples}}
+
+    def save(self, path):
+        """Write the report as JSON and return it"""
+        report = self.report()
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+        return report
+
+
+def run_profiled(path, function, *args, **kwargs):
+    """Run function under cProfile, dump the stats to path and print the 20 slowest calls by cumulative time"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+        sys.stderr.write(output.getvalue())
@@ -0,0 +1,331 @@
+"""
+XML parser backends for streaming the top level elements of an OSM file.
+
+Every backend is a generator function backend(osm_file, tags) yielding the complete node, way or relation elements
+whose tag is in tags. The yielded objects offer the part of the ElementTree API used by shape_element and the audit
+functions: .tag, .attrib, .get() and .iter(tag).
+
+iter_elements wraps the backends and streams .bz2, .gz and .xz files without decompressing them to disk, iter_osm
+also decodes .osm.pbf files with osm_pbf and is the iterator every script streams its input with. tags=None yields
+every top level element, <bounds> included.
+
+Peak memory: only the children of the root are ever yielded, and every one of them, wanted or not, is dropped from
+the tree as soon as the element after it starts to be handed out. The memory held by the iterator is therefore the
+element being yielded plus the parser buffers (EXPAT_CHUNK_SIZE, one .bz2 stream or .osm.pbf block per worker in
+flight), whatever the size of the file, as long as the caller does not keep the elements. An ElementTree element
+stays complete until the next one is requested, so it must be copied to be kept.
+"""
+import bz2
+import collections
+import gzip
+import lzma
+import multiprocessing
+import re
+import xml.etree.cElementTree as ET
+import xml.parsers.expat
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# Top level elements of an OSM file
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+# Bytes read from the file per expat Parse call
+EXPAT_CHUNK_SIZE = 1 << 16
+
+
+def iter_etree(osm_file, tags=TOP_LEVEL_TAGS):
+    """Stdlib ElementTree backend"""
+    # iterparse only hands out the root on its start event, which is needed to clear the elements already handled
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        # a child of a top level element is still part of an element being built
+        if depth == 0:
+            if tags is None or elem.tag in tags:
+                yield elem
+            root.clear()
+
+
+class OSMElement(object):
+    """Light element record built by the expat backend"""
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = []
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self.children:
+            for elem in child.iter(tag):
+                yield elem
+
+    def clear(self):
+        self.attrib = {}
+        self.children = []
+
+
+def iter_expat(osm_file, tags=TOP_LEVEL_TAGS):
+    """Expat push parser backend building OSMElement records for the wanted elements only"""
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    completed = []
+    # stack[0] is the root, the wanted element and its children follow, None marks a skipped element
+    stack = []
+
+    def start_element(name, attrs):
+        if len(stack) == 1:
+            stack.append(OSMElement(name, attrs) if tags is None or name in tags else None)
+        elif len(stack) > 1 and stack[-1] is not None:
+            elem = OSMElement(name, attrs)
+            stack[-1].children.append(elem)
+            stack.append(elem)
+        else:
+            stack.append(None)
+
+    def end_element(name):
+        elem = stack.pop()
+        if len(stack) == 1 and elem is not None:
+            completed.append(elem)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    opened = not hasattr(osm_file, 'read')
+    if opened:
+        osm_file = open(osm_file, 'rb')
+    try:
+        while True:
+            chunk = osm_file.read(EXPAT_CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            for elem in completed:
+                yield elem
+            del completed[:]
+            if not chunk:
+                break
+    finally:
+        if opened:
+            osm_file.close()
+
+
+def iter_lxml(osm_file, tags=TOP_LEVEL_TAGS):
+    """lxml backend with end-only events, available when lxml is installed"""
+    if lxml_etree is None:
+        raise ImportError("the lxml parser backend needs the lxml package")
+
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',)):
+        parent = elem.getparent()
+        # only the children of the root are complete elements, the others are still part of one
+        if parent is not None and parent.getparent() is None:
+            if tags is None or elem.tag in tags:
+                yield elem
+            # drop the element and the already handled siblings before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+# Backends selectable by name
+BACKENDS = {'etree': iter_etree, 'expat': iter_expat, 'lxml': iter_lxml}
+
+
+def available_backends():
+    """Names of the backends that can run with the installed packages"""
+    return sorted(name for name in BACKENDS if name != 'lxml' or lxml_etree is not None)
+
+
+# ================================================== #
+#               Compressed Input                     #
+# ================================================== #
+
+# Start of every bzip2 stream: 'BZh', the block size digit and the block header magic
+BZ2_STREAM_MAGIC = re.compile(b'BZh[1-9]\x31\x41\x59\x26\x53\x59')
+
+# Bytes scanned for stream starts and read per decompression step
+BZ2_SCAN_CHUNK = 1 << 22
+
+# Streams in flight per bz2 worker
+BZ2_CHUNKSIZE = 2
+
+
+def imap_bounded(pool, function, iterable, window):
+    """pool.imap that keeps at most window tasks submitted and not yet consumed
+
+    pool.imap reads its whole input as fast as it can and queues every result the consumer has not taken yet, so
+    a slow consumer holds the whole file in memory; here a new task is only submitted when a result is taken.
+    """
+    pending = collections.deque()
+    for args in iterable:
+        if len(pending) == window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(function, (args,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def is_compressed(osm_file):
+    """Whether a path names a .bz2, .gz or .xz file"""
+    return isinstance(osm_file, str) and osm_file.lower().endswith(('.bz2', '.gz', '.xz'))
+
+
+def find_bz2_streams(path):
+    """Yield the offsets where a bzip2 stream may start, a few may be false matches inside compressed data"""
+    overlap = 9
+    with open(path, 'rb') as bz2_file:
+        position = 0
+        while True:
+            bz2_file.seek(position)
+            chunk = bz2_file.read(BZ2_SCAN_CHUNK + overlap)
+            if not chunk:
+                return
+            for match in BZ2_STREAM_MAGIC.finditer(chunk):
+                if match.start() < BZ2_SCAN_CHUNK:
+                    yield position + match.start()
+            if len(chunk) <= BZ2_SCAN_CHUNK:
+                return
+            position += BZ2_SCAN_CHUNK
+
+
+def decompress_bz2_stream(args):
+    """Worker function, decompress the single bzip2 stream at offset and return (offset, end, data)"""
+    path, offset = args
+    decompressor = bz2.BZ2Decompressor()
+    parts = []
+    end = offset
+    try:
+        with open(path, 'rb') as bz2_file:
+            bz2_file.seek(offset)
+            while not decompressor.eof:
+                chunk = bz2_file.read(BZ2_SCAN_CHUNK)
+                if not chunk:
+                    return offset, None, b''
+                parts.append(decompressor.decompress(chunk))
+                end += len(chunk)
+    except (IOError, OSError, EOFError):
+        # a false stream start inside compressed data
+        return offset, None, b''
+    return offset, end - len(decompressor.unused_data), b''.join(parts)
+
+
+class ParallelBZ2Reader(object):
+    """Read-only file object decompressing the streams of a multi-stream .bz2 file on a process pool
+
+    Every stream is decompressed from each candidate offset, the results are joined in file order starting at the
+    end of the previous stream, so a false stream start only costs the work spent on it.
+    """
+
+    def __init__(self, path, workers=None):
+        self.pool = multiprocessing.Pool(workers)
+        self.results = imap_bounded(self.pool, decompress_bz2_stream,
+                                    ((path, offset) for offset in find_bz2_streams(path)),
+                                    (workers or multiprocessing.cpu_count()) * BZ2_CHUNKSIZE)
+        self.position = 0
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self.buffer[self.offset:]]
+            data = self.next_stream()
+            while data is not None:
+                parts.append(data)
+                data = self.next_stream()
+            self.buffer = b''
+            self.offset = 0
+            return b''.join(parts)
+
+        while self.offset >= len(self.buffer):
+            data = self.next_stream()
+            if data is None:
+                return b''
+            self.buffer = data
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def next_stream(self):
+        for offset, end, data in self.results:
+            if offset == self.position and end is not None:
+                self.position = end
+                return data
+        return None
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_multistream_bz2(path):
+    """Whether a second bzip2 stream starts within the first scan chunk of the file"""
+    with open(path, 'rb') as bz2_file:
+        chunk = bz2_file.read(BZ2_SCAN_CHUNK)
+    return BZ2_STREAM_MAGIC.search(chunk, 1) is not None
+
+
+def open_osm_file(osm_file, workers=None):
+    """Open an .osm file as a binary file object, decompressing .bz2 (on workers processes), .gz or .xz"""
+    lower = osm_file.lower()
+    if lower.endswith('.bz2'):
+        # a single stream file cannot be split, it is decompressed sequentially
+        if workers == 1 or not is_multistream_bz2(osm_file):
+            return bz2.open(osm_file, 'rb')
+        return ParallelBZ2Reader(osm_file, workers)
+    elif lower.endswith('.gz'):
+        return gzip.open(osm_file, 'rb')
+    elif lower.endswith('.xz'):
+        return lzma.open(osm_file, 'rb')
+    return open(osm_file, 'rb')
+
+
+def iter_elements(osm_file, tags=TOP_LEVEL_TAGS, backend='etree', workers=None):
+    """Yield the elements of an .osm file with the named backend, decompressing compressed files on the fly"""
+    if not is_compressed(osm_file):
+        for elem in BACKENDS[backend](osm_file, tags):
+            yield elem
+        return
+
+    with open_osm_file(osm_file, workers) as compressed_file:
+        for elem in BACKENDS[backend](compressed_file, tags):
+            yield elem
+
+
+def iter_osm(osm_file, tags=TOP_LEVEL_TAGS, backend='etree', workers=None):
+    """Yield the top level elements of an .osm, compressed .osm or .osm.pbf file whose tag is in tags, every one
+    with tags=None, holding no more than one element at a time (see the module docstring)"""
+    # imported here, osm_pbf builds its elements out of this module
+    import osm_pbf
+    if osm_pbf.is_pbf(osm_file):
+        return osm_pbf.iter_pbf(osm_file, TOP_LEVEL_TAGS if tags is None else tags, workers)
+    return iter_elements(osm_file, tags, backend, workers)
+
+
+def iterparse_osm(osm_file, events=None, workers=None):
+    """ET.iterparse over a plain or compressed .osm file"""
+    if not is_compressed(osm_file):
+        for event in ET.iterparse(osm_file, events):
+            yield event
+        return
+
+    with open_osm_file(osm_file, workers) as compressed_file:
+        for event in ET.iterparse(compressed_file, events):
+            yield event
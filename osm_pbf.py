@@ -0,0 +1,437 @@
+"""
+Reader of the OpenStreetMap PBF format (.osm.pbf).
+
+The file is a sequence of length prefixed BlobHeader/Blob pairs. The main process only splits the file into blobs,
+the blobs are decompressed and their PrimitiveBlocks decoded (string table, dense nodes, delta coded ways and
+relations) on a process pool. The decoded elements are osm_parsers.OSMElement records carrying the same string
+attributes and tag, nd and member children as the XML elements, so shape_element and the audit functions consume
+them unchanged.
+
+The protocol buffer wire format is decoded by hand, see https://wiki.openstreetmap.org/wiki/PBF_Format
+"""
+import lzma
+import multiprocessing
+import struct
+import time
+import zlib
+
+from osm_parsers import OSMElement, TOP_LEVEL_TAGS, imap_bounded
+
+# Blobs in flight per worker
+PBF_CHUNKSIZE = 4
+
+# Member type enum of the Relation message
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# Required features this reader understands
+SUPPORTED_FEATURES = ('OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation')
+
+
+def is_pbf(osm_file):
+    """Whether a path names a PBF file"""
+    return isinstance(osm_file, str) and osm_file.lower().endswith('.pbf')
+
+
+# ================================================== #
+#               Protocol Buffer Decoding             #
+# ================================================== #
+
+def read_varint(data, position):
+    """Return the varint at position and the position after it"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def zigzag(value):
+    """Decode a zigzag encoded sint32/sint64"""
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value):
+    """Decode a two's complement int32/int64 sent as a varint"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def iter_fields(data):
+    """Yield (field number, wire type, value) of a message, length delimited values are bytes"""
+    position = 0
+    end = len(data)
+    while position < end:
+        key, position = read_varint(data, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = read_varint(data, position)
+        elif wire_type == 2:
+            length, position = read_varint(data, position)
+            value = data[position:position + length]
+            position += length
+        elif wire_type == 1:
+            value = data[position:position + 8]
+            position += 8
+        elif wire_type == 5:
+            value = data[position:position + 4]
+            position += 4
+        else:
+            raise ValueError("unsupported protocol buffer wire type {0}".format(wire_type))
+        yield field, wire_type, value
+
+
+def packed_varints(data):
+    """Decode a packed repeated varint field"""
+    values = []
+    position = 0
+    end = len(data)
+    while position < end:
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+
+def packed_sint(data):
+    return [zigzag(value) for value in packed_varints(data)]
+
+
+def delta_decode(values):
+    total = 0
+    decoded = []
+    for value in values:
+        total += value
+        decoded.append(total)
+    return decoded
+
+
+def repeated_varints(fields, wire_type, value):
+    """Append a repeated varint field which may or may not be packed"""
+    if wire_type == 2:
+        fields.extend(packed_varints(value))
+    else:
+        fields.append(value)
+
+
+# ================================================== #
+#               Element Decoding                     #
+# ================================================== #
+
+def format_degrees(nanodegrees):
+    """Write nanodegrees as the exact decimal string of degrees"""
+    sign = '-' if nanodegrees < 0 else ''
+    whole, fraction = divmod(abs(nanodegrees), 1000000000)
+    fraction = '{0:09d}'.format(fraction).rstrip('0')
+    return '{0}{1}.{2}'.format(sign, whole, fraction or '0')
+
+
+def format_timestamp(milliseconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(milliseconds // 1000))
+
+
+def info_attributes(attrib, version, timestamp, changeset, uid, user, date_granularity):
+    """Set the metadata attributes in the XML attribute order"""
+    if version is not None:
+        attrib['version'] = str(version)
+    if timestamp is not None:
+        attrib['timestamp'] = format_timestamp(timestamp * date_granularity)
+    if changeset is not None:
+        attrib['changeset'] = str(changeset)
+    # anonymous edits have neither uid nor user in the XML either
+    if uid or user:
+        attrib['uid'] = str(uid)
+        attrib['user'] = user
+
+
+def decode_info(data, strings, attrib, date_granularity):
+    info = {1: None, 2: None, 3: None, 4: 0, 5: 0}
+    for field, _, value in iter_fields(data):
+        if field in info:
+            info[field] = value
+    info_attributes(attrib, info[1], info[2] and signed(info[2]), info[3] and signed(info[3]),
+                    signed(info[4]), strings[info[5]], date_granularity)
+
+
+def add_tags(elem, strings, keys, vals):
+    for key, val in zip(keys, vals):
+        elem.children.append(OSMElement('tag', {'k': strings[key], 'v': strings[val]}))
+
+
+def decode_dense(data, strings, block, tags):
+    if 'node' not in tags:
+        return []
+
+    ids = lats = lons = keys_vals = []
+    dense_info = None
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            ids = delta_decode(packed_sint(value))
+        elif field == 5:
+            dense_info = value
+        elif field == 8:
+            lats = delta_decode(packed_sint(value))
+        elif field == 9:
+            lons = delta_decode(packed_sint(value))
+        elif field == 10:
+            keys_vals = packed_varints(value)
+
+    infos = None
+    if dense_info is not None:
+        columns = {}
+        for field, _, value in iter_fields(dense_info):
+            columns[field] = value
+        versions = packed_varints(columns.get(1, b''))
+        timestamps = delta_decode(packed_sint(columns.get(2, b'')))
+        changesets = delta_decode(packed_sint(columns.get(3, b'')))
+        uids = delta_decode(packed_sint(columns.get(4, b'')))
+        user_sids = delta_decode(packed_sint(columns.get(5, b'')))
+        infos = (versions, timestamps, changesets, uids, user_sids)
+
+    granularity, lat_offset, lon_offset, date_granularity = block
+    elements = []
+    position = 0
+    for index, node_id in enumerate(ids):
+        attrib = {'id': str(node_id),
+                  'lat': format_degrees(lat_offset + granularity * lats[index]),
+                  'lon': format_degrees(lon_offset + granularity * lons[index])}
+        if infos is not None:
+            versions, timestamps, changesets, uids, user_sids = infos
+            info_attributes(attrib, versions[index] if versions else None,
+                            timestamps[index] if timestamps else None,
+                            changesets[index] if changesets else None,
+                            uids[index] if uids else 0,
+                            strings[user_sids[index]] if user_sids else '', date_granularity)
+        elem = OSMElement('node', attrib)
+        # keys_vals holds key, value pairs of each node terminated by a 0
+        while position < len(keys_vals) and keys_vals[position] != 0:
+            elem.children.append(OSMElement('tag', {'k': strings[keys_vals[position]],
+                                                    'v': strings[keys_vals[position + 1]]}))
+            position += 2
+        position += 1
+        elements.append(elem)
+    return elements
+
+
+def decode_node(data, strings, block):
+    granularity, lat_offset, lon_offset, date_granularity = block
+    node_id = lat = lon = 0
+    keys = []
+    vals = []
+    info = None
+    for field, wire_type, value in iter_fields(data):
+        if field == 1:
+            node_id = zigzag(value)
+        elif field == 2:
+            repeated_varints(keys, wire_type, value)
+        elif field == 3:
+            repeated_varints(vals, wire_type, value)
+        elif field == 4:
+            info = value
+        elif field == 8:
+            lat = zigzag(value)
+        elif field == 9:
+            lon = zigzag(value)
+    attrib = {'id': str(node_id),
+              'lat': format_degrees(lat_offset + granularity * lat),
+              'lon': format_degrees(lon_offset + granularity * lon)}
+    if info is not None:
+        decode_info(info, strings, attrib, date_granularity)
+    elem = OSMElement('node', attrib)
+    add_tags(elem, strings, keys, vals)
+    return elem
+
+
+def decode_way(data, strings, block):
+    way_id = 0
+    keys = []
+    vals = []
+    refs = []
+    info = None
+    for field, wire_type, value in iter_fields(data):
+        if field == 1:
+            way_id = value
+        elif field == 2:
+            repeated_varints(keys, wire_type, value)
+        elif field == 3:
+            repeated_varints(vals, wire_type, value)
+        elif field == 4:
+            info = value
+        elif field == 8:
+            refs = delta_decode(packed_sint(value))
+    attrib = {'id': str(signed(way_id))}
+    if info is not None:
+        decode_info(info, strings, attrib, block[3])
+    elem = OSMElement('way', attrib)
+    for ref in refs:
+        elem.children.append(OSMElement('nd', {'ref': str(ref)}))
+    add_tags(elem, strings, keys, vals)
+    return elem
+
+
+def decode_relation(data, strings, block):
+    relation_id = 0
+    keys = []
+    vals = []
+    roles = []
+    memids = []
+    types = []
+    info = None
+    for field, wire_type, value in iter_fields(data):
+        if field == 1:
+            relation_id = value
+        elif field == 2:
+            repeated_varints(keys, wire_type, value)
+        elif field == 3:
+            repeated_varints(vals, wire_type, value)
+        elif field == 4:
+            info = value
+        elif field == 8:
+            repeated_varints(roles, wire_type, value)
+        elif field == 9:
+            memids = delta_decode(packed_sint(value))
+        elif field == 10:
+            repeated_varints(types, wire_type, value)
+    attrib = {'id': str(signed(relation_id))}
+    if info is not None:
+        decode_info(info, strings, attrib, block[3])
+    elem = OSMElement('relation', attrib)
+    for member_type, ref, role in zip(types, memids, roles):
+        elem.children.append(OSMElement('member', {'type': MEMBER_TYPES[member_type], 'ref': str(ref),
+                                                   'role': strings[role]}))
+    add_tags(elem, strings, keys, vals)
+    return elem
+
+
+def decode_primitive_block(data, tags=TOP_LEVEL_TAGS):
+    """Decode the elements of a PrimitiveBlock, in file order"""
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset, date_granularity = 100, 0, 0, 1000
+    for field, _, value in iter_fields(data):
+        if field == 1:
+            strings = [s.decode('utf8') for _, _, s in iter_fields(value)]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 18:
+            date_granularity = value
+        elif field == 19:
+            lat_offset = signed(value)
+        elif field == 20:
+            lon_offset = signed(value)
+    block = (granularity, lat_offset, lon_offset, date_granularity)
+
+    elements = []
+    for group in groups:
+        for field, _, value in iter_fields(group):
+            if field == 1 and 'node' in tags:
+                elements.append(decode_node(value, strings, block))
+            elif field == 2:
+                elements.extend(decode_dense(value, strings, block, tags))
+            elif field == 3 and 'way' in tags:
+                elements.append(decode_way(value, strings, block))
+            elif field == 4 and 'relation' in tags:
+                elements.append(decode_relation(value, strings, block))
+    return elements
+
+
+def blob_data(blob):
+    """Decompress a Blob message"""
+    fields = dict((field, value) for field, _, value in iter_fields(blob))
+    if 1 in fields:
+        return fields[1]
+    if 3 in fields:
+        return zlib.decompress(fields[3])
+    if 4 in fields:
+        return lzma.decompress(fields[4])
+    raise ValueError("unsupported PBF blob compression")
+
+
+def decode_blob(args):
+    """Worker function, decompress and decode one OSMData blob"""
+    blob, tags = args
+    return decode_primitive_block(blob_data(blob), tags)
+
+
+# ================================================== #
+#               File Reading                         #
+# ================================================== #
+
+def iter_blobs(pbf_file):
+    """Yield (blob type, raw blob) pairs of the file"""
+    while True:
+        length = pbf_file.read(4)
+        if len(length) < 4:
+            return
+        header = pbf_file.read(struct.unpack('>I', length)[0])
+        blob_type = None
+        datasize = 0
+        for field, _, value in iter_fields(header):
+            if field == 1:
+                blob_type = value.decode('utf8')
+            elif field == 3:
+                datasize = value
+        yield blob_type, pbf_file.read(datasize)
+
+
+def decode_header(blob):
+    """Return the bbox (or None) and the required features of an OSMHeader blob"""
+    header = {'bbox': None, 'required_features': []}
+    for field, _, value in iter_fields(blob_data(blob)):
+        if field == 1:
+            # HeaderBBox holds left, right, top, bottom in nanodegrees
+            bbox = dict((key, format_degrees(zigzag(side))) for key, _, side in iter_fields(value))
+            header['bbox'] = {'minlon': bbox.get(1), 'maxlon': bbox.get(2),
+                              'maxlat': bbox.get(3), 'minlat': bbox.get(4)}
+        elif field == 4:
+            header['required_features'].append(value.decode('utf8'))
+    return header
+
+
+def check_header(blob):
+    """Raise if the OSMHeader lists a required feature this reader does not implement"""
+    for feature in decode_header(blob)['required_features']:
+        if feature not in SUPPORTED_FEATURES:
+            raise ValueError("unsupported PBF required feature '{0}'".format(feature))
+
+
+def read_header(osm_file):
+    """Return the decoded OSMHeader of a PBF file, the equivalent of the XML <bounds> element"""
+    with open(osm_file, 'rb') as pbf_file:
+        for blob_type, blob in iter_blobs(pbf_file):
+            if blob_type == 'OSMHeader':
+                return decode_header(blob)
+    return {'bbox': None, 'required_features': []}
+
+
+def iter_data_blobs(osm_file, tags):
+    for blob_type, blob in iter_blobs(osm_file):
+        if blob_type == 'OSMHeader':
+            check_header(blob)
+        elif blob_type == 'OSMData':
+            yield blob, tags
+
+
+def iter_pbf(osm_file, tags=TOP_LEVEL_TAGS, workers=None):
+    """Yield the elements of a PBF file whose tag is in tags, decoding the blobs on a pool of workers"""
+    tags = tuple(tags)
+    with open(osm_file, 'rb') as pbf_file:
+        if workers == 1:
+            for args in iter_data_blobs(pbf_file, tags):
+                for elem in decode_blob(args):
+                    yield elem
+            return
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            # the blocks come back in file order and only a few of them are read ahead of the caller
+            for elements in imap_bounded(pool, decode_blob, iter_data_blobs(pbf_file, tags),
+                                         (workers or multiprocessing.cpu_count()) * PBF_CHUNKSIZE):
+                for elem in elements:
+                    yield elem
+        finally:
+            pool.terminate()
+            pool.join()
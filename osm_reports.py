@@ -0,0 +1,194 @@
+"""
+Summary tables of the notebook reports and the prepared queries that read them.
+
+The case study recomputes its reports with UNION ALL scans of nodes, ways and their tags. build_summaries() fills
+small tables with the answers once, SQLiteBulkLoader.finish() calls it at the end of every load, and
+apply_osm_change keeps them up to date element by element with remove_element() before a change and add_element()
+after it. The report functions run the same constant SQL every time, which the sqlite3 statement cache of the
+connection prepares once; with summary=False they run the original scans instead, which is what --compare checks
+the summaries against.
+"""
+import argparse
+import pprint
+import sqlite3
+import time
+
+# Summary tables, dropped and refilled by build_summaries
+SUMMARY_TABLES = [
+    # elements of each type
+    "CREATE TABLE summary_elements (type TEXT PRIMARY KEY NOT NULL, count INTEGER NOT NULL)",
+    # nodes and ways of each contributor
+    "CREATE TABLE summary_contributors (uid INTEGER NOT NULL, user TEXT NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (uid, user))",
+    # node and way tags of each key and value
+    "CREATE TABLE summary_tag_values (key TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (key, value))",
+    # the tags of the nodes of each amenity value
+    "CREATE TABLE summary_amenity_tags (amenity TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+    "count INTEGER NOT NULL, PRIMARY KEY (amenity, key, value))"]
+
+# Element tables of each element type and the tag tables summarized with them
+ELEMENT_TABLES = {'node': 'nodes', 'way': 'ways', 'relation': 'relations'}
+TAG_TABLES = {'node': 'nodes_tags', 'way': 'ways_tags'}
+
+# Rows counted by the summaries, of every element of a type or of the element whose id is the parameter
+ELEMENT_ROWS = "SELECT '{type}', {sign}COUNT(*) FROM {elements} {where}"
+CONTRIBUTOR_ROWS = "SELECT uid, user, {sign}COUNT(*) FROM {elements} {where} GROUP BY uid, user"
+TAG_VALUE_ROWS = "SELECT key, value, {sign}COUNT(*) FROM {tags} {where} GROUP BY key, value"
+# a node tagged amenity=x and disused:amenity=x counts once for x, as in the DISTINCT of the notebook scan
+AMENITY_TAG_ROWS = """
+    SELECT amenity.value, tags.key, tags.value, {sign}COUNT(*)
+    FROM (SELECT DISTINCT id, value FROM {tags} WHERE key = 'amenity' {and_where}) amenity
+    JOIN {tags} tags ON tags.id = amenity.id GROUP BY amenity.value, tags.key, tags.value"""
+
+# Summary tables, their key columns, the rows they count and the element types these rows are counted for
+SUMMARIES = [('summary_elements', 'type', ELEMENT_ROWS, ('node', 'way', 'relation')),
+             ('summary_contributors', 'uid, user', CONTRIBUTOR_ROWS, ('node', 'way')),
+             ('summary_tag_values', 'key, value', TAG_VALUE_ROWS, ('node', 'way')),
+             ('summary_amenity_tags', 'amenity, key, value', AMENITY_TAG_ROWS, ('node',))]
+
+# Add counted rows to a summary table, the WHERE of the SELECT keeps the parser from reading ON as a join
+UPSERT_SQL = "INSERT INTO {0} ({1}, count) SELECT * FROM ({2}) WHERE true " \
+             "ON CONFLICT ({1}) DO UPDATE SET count = count + excluded.count"
+
+# The notebook queries, answered from the summaries or with the original scans
+REPORTS = {
+    'unique_contributors': (
+        "SELECT COUNT(DISTINCT uid) FROM summary_contributors",
+        "SELECT COUNT(DISTINCT e.uid) FROM (SELECT uid FROM nodes UNION ALL SELECT uid FROM ways) e"),
+    'top_contributors': (
+        "SELECT user, SUM(count) AS num FROM summary_contributors GROUP BY user ORDER BY num DESC, user LIMIT ?",
+        "SELECT e.user, COUNT(*) AS num FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e "
+        "GROUP BY e.user ORDER BY num DESC, e.user LIMIT ?"),
+    'element_counts': (
+        "SELECT type, count FROM summary_elements ORDER BY type",
+        "SELECT 'node', COUNT(*) FROM nodes UNION ALL SELECT 'relation', COUNT(*) FROM relations "
+        "UNION ALL SELECT 'way', COUNT(*) FROM ways"),
+    'tag_values': (
+        "SELECT value, SUM(count) AS num FROM summary_tag_values WHERE key LIKE ? "
+        "GROUP BY value ORDER BY num DESC, value LIMIT ?",
+        "SELECT tags.value, COUNT(*) AS num FROM (SELECT * FROM nodes_tags UNION ALL SELECT * FROM ways_tags) tags "
+        "WHERE tags.key LIKE ? GROUP BY tags.value ORDER BY num DESC, tags.value LIMIT ?"),
+    'amenity_tag_values': (
+        "SELECT value, count FROM summary_amenity_tags WHERE amenity = ? AND key = ? "
+        "ORDER BY count DESC, value LIMIT ?",
+        "SELECT nodes_tags.value, COUNT(*) AS num FROM nodes_tags "
+        "JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE key = 'amenity' AND value = ?) i ON nodes_tags.id = i.id "
+        "WHERE nodes_tags.key = ? GROUP BY nodes_tags.value ORDER BY num DESC, nodes_tags.value LIMIT ?"),
+}
+
+
+def summary_rows_sql(rows_sql, tag, sign='', element_id=False):
+    return rows_sql.format(type=tag, elements=ELEMENT_TABLES[tag], tags=TAG_TABLES.get(tag), sign=sign,
+                           where='WHERE id = ?' if element_id else '',
+                           and_where='AND id = ?' if element_id else '')
+
+
+def build_summaries(connection):
+    """Create and fill the summary tables from the element and tag tables"""
+    for statement in SUMMARY_TABLES:
+        connection.execute("DROP TABLE IF EXISTS {0}".format(statement.split()[2]))
+        connection.execute(statement)
+    for table, key_columns, rows_sql, tags in SUMMARIES:
+        for tag in tags:
+            connection.execute(UPSERT_SQL.format(table, key_columns, summary_rows_sql(rows_sql, tag)))
+
+
+def has_summaries(connection):
+    return connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN ({0})".format(
+        ', '.join("'{0}'".format(statement.split()[2]) for statement in SUMMARY_TABLES))).fetchone()[0] == \
+        len(SUMMARY_TABLES)
+
+
+def update_element(connection, tag, element_id, sign):
+    for table, key_columns, rows_sql, tags in SUMMARIES:
+        if tag in tags:
+            connection.execute(UPSERT_SQL.format(table, key_columns, summary_rows_sql(rows_sql, tag, sign, True)),
+                               (element_id,))
+            connection.execute("DELETE FROM {0} WHERE count <= 0".format(table))
+
+
+def add_element(connection, tag, element_id):
+    """Count the current rows of an element in the summaries"""
+    update_element(connection, tag, element_id, '')
+
+
+def remove_element(connection, tag, element_id):
+    """Take the current rows of an element out of the summaries, before they are replaced or deleted"""
+    update_element(connection, tag, element_id, '-')
+
+
+# ================================================== #
+#               Report Functions                     #
+# ================================================== #
+def run_report(connection, name, parameters=(), summary=True):
+    summary_sql, scan_sql = REPORTS[name]
+    return connection.execute(summary_sql if summary else scan_sql, parameters).fetchall()
+
+
+def unique_contributors(connection, summary=True):
+    return run_report(connection, 'unique_contributors', summary=summary)[0][0]
+
+
+def top_contributors(connection, limit=10, summary=True):
+    return run_report(connection, 'top_contributors', (limit,), summary)
+
+
+def element_counts(connection, summary=True):
+    return dict(run_report(connection, 'element_counts', summary=summary))
+
+
+def tag_values(connection, key_pattern, limit=10, summary=True):
+    """Most frequent values of the node and way tags whose key is LIKE key_pattern, e.g. '%tourism'"""
+    return run_report(connection, 'tag_values', (key_pattern, limit), summary)
+
+
+def amenity_tag_values(connection, amenity, key, limit=10, summary=True):
+    """Most frequent values of the key tag of the amenity nodes, e.g. ('restaurant', 'cuisine')"""
+    return run_report(connection, 'amenity_tag_values', (amenity, key, limit), summary)
+
+
+# The reports of the notebook and their arguments
+NOTEBOOK_REPORTS = [('unique_contributors', unique_contributors, ()),
+                    ('top_contributors', top_contributors, (10,)),
+                    ('element_counts', element_counts, ()),
+                    ('tourism_values', tag_values, ('%tourism', 10)),
+                    ('fast_food_names', amenity_tag_values, ('fast_food', 'name', 5)),
+                    ('restaurant_cuisines', amenity_tag_values, ('restaurant', 'cuisine', 10))]
+
+
+def notebook_reports(connection, compare=False):
+    """Answer the notebook reports from the summaries, with compare the scans run too and both are timed"""
+    reports = {}
+    for name, report, args in NOTEBOOK_REPORTS:
+        start_time = time.perf_counter()
+        answer = report(connection, *args)
+        if not compare:
+            reports[name] = answer
+            continue
+        summary_ms = (time.perf_counter() - start_time) * 1000
+        start_time = time.perf_counter()
+        scan_answer = report(connection, *args, summary=False)
+        scan_ms = (time.perf_counter() - start_time) * 1000
+        reports[name] = {'answer': answer, 'summary_ms': round(summary_ms, 3), 'scan_ms': round(scan_ms, 3),
+                         'same_answer': answer == scan_answer}
+    return reports
+
+
+if __name__ == '__main__':
+    from from_osm_to_sqlite import DB_PATH
+
+    parser = argparse.ArgumentParser(description='Answer the notebook reports from the summary tables')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database loaded by from_osm_to_sqlite.py')
+    parser.add_argument('--build', action='store_true', help='(re)build the summary tables first')
+    parser.add_argument('--compare', action='store_true', help='also run the original scans and time both')
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db)
+    try:
+        if args.build or not has_summaries(connection):
+            with connection:
+                build_summaries(connection)
+        pprint.pprint(notebook_reports(connection, args.compare))
+    finally:
+        connection.close()
@@ -0,0 +1,246 @@
+"""
+R*Tree spatial index of the SQLite database and the area queries that use it.
+
+nodes_rtree holds a point per node and ways_rtree the bounding box of every way, computed from ways_nodes joined to
+nodes, or read from ways_geometry when the load filled it. SQLiteBulkLoader.finish() builds both tables,
+build_spatial_index() (re)builds them in a database loaded any other way. Every query function takes indexed=False
+to run the same query with plain SQL on the lat/lon columns, which is what benchmark_spatial.py compares against.
+"""
+import argparse
+import math
+import pprint
+import sqlite3
+
+# Metres per degree of latitude and mean Earth radius used by the distance functions
+METRES_PER_DEGREE = 111320.0
+EARTH_RADIUS = 6371008.8
+
+# R*Tree tables, dropped and refilled by build_spatial_index. The R*Tree keeps 32 bit floats rounded outwards, the
+# auxiliary (+) columns keep the exact coordinates for the final test.
+SPATIAL_TABLES = [
+    "CREATE VIRTUAL TABLE nodes_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon, +lat, +lon)",
+    "CREATE VIRTUAL TABLE ways_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon, "
+    "+exact_min_lat, +exact_max_lat, +exact_min_lon, +exact_max_lon)"]
+
+FILL_NODES_RTREE = "INSERT INTO nodes_rtree SELECT id, lat, lat, lon, lon, lat, lon FROM nodes WHERE lat IS NOT NULL"
+
+# Way bounding boxes from the nodes they reference, a way without any known node has no box
+WAY_BBOX_SQL = """
+    SELECT ways_nodes.id AS id, MIN(nodes.lat) AS min_lat, MAX(nodes.lat) AS max_lat,
+           MIN(nodes.lon) AS min_lon, MAX(nodes.lon) AS max_lon
+    FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+    {0}
+    GROUP BY ways_nodes.id"""
+
+FILL_WAYS_RTREE = "INSERT INTO ways_rtree SELECT id, min_lat, max_lat, min_lon, max_lon, " \
+                  "min_lat, max_lat, min_lon, max_lon FROM (" + WAY_BBOX_SQL + ")"
+
+# Way bounding boxes computed while loading, see osm_locations
+FILL_WAYS_RTREE_FROM_GEOMETRY = "INSERT INTO ways_rtree SELECT id, min_lat, max_lat, min_lon, max_lon, " \
+                                "min_lat, max_lat, min_lon, max_lon FROM ways_geometry"
+
+# Nodes inside and way boxes intersecting a box, with the R*Tree or with plain SQL; the parameters are
+# (max_lat, min_lat, max_lon, min_lon) for the R*Tree test followed by (min_lat, max_lat, min_lon, max_lon)
+NODES_IN_BBOX_INDEXED = """
+    SELECT id, lat, lon FROM nodes_rtree
+    WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?
+    AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?"""
+NODES_IN_BBOX_SQL = "SELECT id, lat, lon FROM nodes WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?"
+WAYS_IN_BBOX_INDEXED = """
+    SELECT id, exact_min_lat, exact_max_lat, exact_min_lon, exact_max_lon FROM ways_rtree
+    WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?
+    AND exact_min_lat <= ? AND exact_max_lat >= ? AND exact_min_lon <= ? AND exact_max_lon >= ?"""
+WAYS_IN_BBOX_SQL = """
+    SELECT * FROM (""" + WAY_BBOX_SQL.format('') + """)
+    WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?"""
+
+# Tag tables of the elements an amenity or a tag may be found on
+TAG_TABLES = {'node': 'nodes_tags', 'way': 'ways_tags'}
+
+
+def has_way_geometry(connection):
+    """Whether the ways_geometry table exists and was filled by the load"""
+    if not connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'ways_geometry'").fetchone()[0]:
+        return False
+    return connection.execute("SELECT 1 FROM ways_geometry LIMIT 1").fetchone() is not None
+
+
+def build_spatial_index(connection):
+    """Create and fill the R*Tree tables from the nodes table, and from ways_geometry if it was filled or else the
+    ways_nodes table"""
+    connection.execute("DROP TABLE IF EXISTS nodes_rtree")
+    connection.execute("DROP TABLE IF EXISTS ways_rtree")
+    for statement in SPATIAL_TABLES:
+        connection.execute(statement)
+    connection.execute(FILL_NODES_RTREE)
+    if has_way_geometry(connection):
+        connection.execute(FILL_WAYS_RTREE_FROM_GEOMETRY)
+    else:
+        connection.execute(FILL_WAYS_RTREE.format(''))
+
+
+def has_spatial_index(connection):
+    return connection.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name IN ('nodes_rtree', 'ways_rtree')").fetchone()[0] == 2
+
+
+def index_node(connection, node_id):
+    """Refresh the R*Tree point of one node"""
+    connection.execute("DELETE FROM nodes_rtree WHERE id = ?", (node_id,))
+    connection.execute(FILL_NODES_RTREE + " AND id = ?", (node_id,))
+
+
+def index_way(connection, way_id):
+    """Refresh the R*Tree box of one way"""
+    connection.execute("DELETE FROM ways_rtree WHERE id = ?", (way_id,))
+    connection.execute(FILL_WAYS_RTREE.format('WHERE ways_nodes.id = ?'), (way_id,))
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in metres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius):
+    """(min_lat, min_lon, max_lat, max_lon) of a box holding every point within radius metres"""
+    lat_delta = radius / METRES_PER_DEGREE
+    lon_delta = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return lat - lat_delta, lon - lon_delta, lat + lat_delta, lon + lon_delta
+
+
+def nodes_in_bbox(connection, bbox, indexed=True):
+    """Cursor of (id, lat, lon) of the nodes inside bbox"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    if indexed:
+        return connection.execute(NODES_IN_BBOX_INDEXED,
+                                  (max_lat, min_lat, max_lon, min_lon, min_lat, max_lat, min_lon, max_lon))
+    return connection.execute(NODES_IN_BBOX_SQL, (min_lat, max_lat, min_lon, max_lon))
+
+
+def ways_in_bbox(connection, bbox, indexed=True):
+    """Cursor of (id, min_lat, max_lat, min_lon, max_lon) of the ways whose bounding box intersects bbox"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    if indexed:
+        return connection.execute(WAYS_IN_BBOX_INDEXED,
+                                  (max_lat, min_lat, max_lon, min_lon, max_lat, min_lat, max_lon, min_lon))
+    return connection.execute(WAYS_IN_BBOX_SQL, (max_lat, min_lat, max_lon, min_lon))
+
+
+def elements_in_bbox(connection, bbox, indexed=True):
+    """Ids of the nodes inside and the ways intersecting bbox = (min_lat, min_lon, max_lat, max_lon)"""
+    return {'node': sorted(row[0] for row in nodes_in_bbox(connection, bbox, indexed)),
+            'way': sorted(row[0] for row in ways_in_bbox(connection, bbox, indexed))}
+
+
+def element_locations(connection, bbox, indexed=True):
+    """Yield (type, id, lat, lon) of the nodes in bbox and the centre of the way boxes intersecting it"""
+    for node_id, lat, lon in nodes_in_bbox(connection, bbox, indexed).fetchall():
+        yield 'node', node_id, lat, lon
+    for way_id, min_lat, max_lat, min_lon, max_lon in ways_in_bbox(connection, bbox, indexed).fetchall():
+        yield 'way', way_id, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def element_tags(connection, element_type, element_ids, key=None, value=None):
+    """{id: [(key, value)]} of the given elements, optionally only the tags with key (and value)"""
+    tags = {}
+    ids = list(element_ids)
+    conditions = ''
+    extra = []
+    if key is not None:
+        conditions += " AND key = ?"
+        extra.append(key)
+    if value is not None:
+        conditions += " AND value = ?"
+        extra.append(value)
+    # stay below the default limit of 999 SQL variables
+    for start in range(0, len(ids), 900):
+        chunk = ids[start:start + 900]
+        for element_id, tag_key, tag_value in connection.execute(
+                "SELECT id, key, value FROM {0} WHERE id IN ({1}){2}".format(
+                    TAG_TABLES[element_type], ', '.join('?' * len(chunk)), conditions), chunk + extra):
+            tags.setdefault(element_id, []).append((tag_key, tag_value))
+    return tags
+
+
+def within_radius(connection, lat, lon, radius, indexed=True):
+    """(type, id, distance) of the nodes and way box centres within radius metres, nearest first"""
+    found = []
+    for element_type, element_id, element_lat, element_lon in element_locations(
+            connection, radius_bbox(lat, lon, radius), indexed):
+        metres = distance(lat, lon, element_lat, element_lon)
+        if metres <= radius:
+            found.append((element_type, element_id, metres))
+    found.sort(key=lambda item: (item[2], item[0], item[1]))
+    return found
+
+
+def tags_within_radius(connection, lat, lon, radius, key=None, indexed=True):
+    """(type, id, key, value, distance) of the tags of the elements within radius metres, nearest first"""
+    found = within_radius(connection, lat, lon, radius, indexed)
+    result = []
+    for element_type in TAG_TABLES:
+        distances = dict((element_id, metres) for kind, element_id, metres in found if kind == element_type)
+        for element_id, tags in element_tags(connection, element_type, distances, key).items():
+            for tag_key, tag_value in tags:
+                result.append((element_type, element_id, tag_key, tag_value, round(distances[element_id], 1)))
+    result.sort(key=lambda item: (item[4], item[0], item[1], item[2], item[3]))
+    return result
+
+
+def nearest_amenity(connection, lat, lon, amenity=None, limit=1, start_radius=250.0, max_radius=50000.0,
+                    indexed=True):
+    """The limit nearest elements tagged amenity (= amenity if given) as (type, id, value, distance)
+
+    The search radius doubles until limit amenities lie within it, an amenity found within the radius is nearer
+    than any element outside of it, so the answer is exact up to max_radius.
+    """
+    radius = start_radius
+    while True:
+        found = within_radius(connection, lat, lon, radius, indexed)
+        amenities = []
+        for element_type in TAG_TABLES:
+            distances = dict((element_id, metres) for kind, element_id, metres in found if kind == element_type)
+            for element_id, tags in element_tags(connection, element_type, distances, 'amenity', amenity).items():
+                amenities.append((element_type, element_id, tags[0][1], round(distances[element_id], 1)))
+        if len(amenities) >= limit or radius >= max_radius:
+            amenities.sort(key=lambda item: (item[3], item[0], item[1]))
+            return amenities[:limit]
+        radius = min(radius * 2, max_radius)
+
+
+if __name__ == '__main__':
+    from from_osm_to_sqlite import DB_PATH
+
+    parser = argparse.ArgumentParser(description='Build the R*Tree spatial index or run an area query')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database loaded by from_osm_to_sqlite.py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='(re)build the R*Tree tables')
+    bbox_parser = subparsers.add_parser('bbox', help='elements in a bounding box')
+    bbox_parser.add_argument('bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    nearest_parser = subparsers.add_parser('nearest', help='nearest amenity to a point')
+    nearest_parser.add_argument('lat', type=float)
+    nearest_parser.add_argument('lon', type=float)
+    nearest_parser.add_argument('--amenity', help='amenity value, e.g. cafe')
+    nearest_parser.add_argument('--limit', type=int, default=1)
+    radius_parser = subparsers.add_parser('radius', help='tags within a radius of a point')
+    radius_parser.add_argument('lat', type=float)
+    radius_parser.add_argument('lon', type=float)
+    radius_parser.add_argument('radius', type=float, help='metres')
+    radius_parser.add_argument('--key', help='only the tags with this key')
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db)
+    if args.command == 'build':
+        with connection:
+            build_spatial_index(connection)
+    elif args.command == 'bbox':
+        pprint.pprint(elements_in_bbox(connection, args.bbox))
+    elif args.command == 'nearest':
+        pprint.pprint(nearest_amenity(connection, args.lat, args.lon, args.amenity, args.limit))
+    else:
+        pprint.pprint(tags_within_radius(connection, args.lat, args.lon, args.radius, args.key))
+    connection.close()
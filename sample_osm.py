@@ -0,0 +1,92 @@
+"""
+Stratified sample extracts of an OSM file, small enough to run the audit and the conversion in seconds.
+
+extract_sample() keeps every Kth node, every Kth way and every Kth relation, each type counted on its own, plus what
+the kept elements reference: the node and way members of the kept relations and the nodes of every kept way. Every
+way of the sample is therefore complete and every node or way reference resolves; relation members of type
+relation are not followed. The file is streamed three times: the relations pick their members, the ways pick their
+nodes, then the kept elements are written in file order. The kept ids live in osm_bbox.IdSet objects.
+"""
+import argparse
+import pprint
+import time
+
+import osm_parsers
+from from_osm_to_csv import get_element, OSM_PATH, ELEMENT_TAGS
+from generate_osm import write_element
+from osm_bbox import IdSet
+
+# Default output path of the sample
+SAMPLE_PATH = "center_of_london_sample.osm"
+
+# Children written for each element type, in the order OSM files list them
+CHILD_TAGS = {'node': ('tag',), 'way': ('nd', 'tag'), 'relation': ('member', 'tag')}
+
+
+def is_sampled(index, every):
+    return index % every == 0
+
+
+def select_elements(osm_file, every, backend='etree'):
+    """The ids of the nodes, ways and relations of the sample, keyed by element type"""
+    kept = {'node': IdSet(), 'way': IdSet(), 'relation': IdSet()}
+
+    # the relations come last in the file, so their members are picked in a pass of their own
+    for index, elem in enumerate(get_element(osm_file, tags=('relation',), backend=backend)):
+        if is_sampled(index, every):
+            kept['relation'].add(int(elem.attrib['id']))
+            for member in elem.iter('member'):
+                if member.attrib['type'] in ('node', 'way'):
+                    kept[member.attrib['type']].add(int(member.attrib['ref']))
+
+    for index, elem in enumerate(get_element(osm_file, tags=('way',), backend=backend)):
+        way_id = int(elem.attrib['id'])
+        if is_sampled(index, every) or way_id in kept['way']:
+            kept['way'].add(way_id)
+            for nd in elem.iter('nd'):
+                kept['node'].add(int(nd.attrib['ref']))
+
+    return kept
+
+
+def write_sample_element(osm_file, elem):
+    children = [(child.tag, list(child.attrib.items()))
+                for child_tag in CHILD_TAGS[elem.tag] for child in elem.iter(child_tag)]
+    write_element(osm_file, elem.tag, list(elem.attrib.items()), children)
+
+
+def extract_sample(osm_file, sample_path=SAMPLE_PATH, every=100, backend='etree'):
+    """Write the sample of osm_file keeping every Kth element and return the elements read and written per type"""
+    if every < 1:
+        raise ValueError("every must be a positive number of elements, not {0}".format(every))
+    start_time = time.time()
+    kept = select_elements(osm_file, every, backend)
+
+    read = dict((tag, 0) for tag in ELEMENT_TAGS)
+    written = dict((tag, 0) for tag in ELEMENT_TAGS)
+    with open(sample_path, 'w', encoding='utf8') as sample_file:
+        sample_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        sample_file.write('<osm version="0.6" generator="sample_osm.py">\n')
+        for elem in get_element(osm_file, tags=ELEMENT_TAGS, backend=backend):
+            tag = elem.tag
+            index = read[tag]
+            read[tag] += 1
+            # a node is kept for its own sake or for a kept way or relation, the ways and relations were picked above
+            if (tag == 'node' and is_sampled(index, every)) or int(elem.attrib['id']) in kept[tag]:
+                write_sample_element(sample_file, elem)
+                written[tag] += 1
+        sample_file.write('</osm>\n')
+
+    return {'read': read, 'written': written, 'seconds': round(time.time() - start_time, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a sample of an OSM file keeping every Kth element and the '
+                                                 'nodes and members they reference')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH, help='input .osm, .osm.bz2/.gz/.xz or .osm.pbf file')
+    parser.add_argument('--output', default=SAMPLE_PATH, help='output .osm sample')
+    parser.add_argument('--every', type=int, default=100, metavar='K', help='keep every Kth element of each type')
+    parser.add_argument('--parser', default='etree', choices=sorted(osm_parsers.BACKENDS), help='XML parser backend')
+    args = parser.parse_args()
+
+    pprint.pprint(extract_sample(args.osm_file, args.output, args.every, args.parser))
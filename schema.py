@@ -61,5 +61,55 @@ schema = {
                 'type': {'required': True, 'type': 'string'}
             }
         }
+    },
+    'way_geometry': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'length': {'required': True, 'type': 'float', 'coerce': float},
+            'centroid_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'centroid_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'min_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'min_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'max_lat': {'required': True, 'type': 'float', 'coerce': float},
+            'max_lon': {'required': True, 'type': 'float', 'coerce': float},
+            'missing_nodes': {'required': True, 'type': 'integer', 'coerce': int}
+        }
+    },
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'type': {'required': True, 'type': 'string'},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
     }
 }
\ No newline at end of file
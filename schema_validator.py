@@ -0,0 +1,156 @@
+"""
+Validator compiled ahead of time from schema.schema.
+
+The schema is turned into generated Python source with plain type and required field checks, which accepts a well
+shaped element without any per rule dispatch. Only an element that fails the fast check is walked again rule by rule to
+build the same errors dictionary as cerberus, so CompiledValidator can be passed to
+from_osm_to_csv.validate_element in place of cerberus.Validator.
+"""
+from collections.abc import Mapping, Sequence
+
+import schema
+
+# Python types accepted by the schema type names, bool is an int as it is for cerberus
+SCHEMA_TYPES = {'integer': (int,), 'float': (float, int), 'string': (str,), 'dict': (Mapping,), 'list': (Sequence,)}
+
+# Exact types accepted by the generated fast path, anything else is left to the full check
+FAST_TYPES = {'integer': 'int', 'float': 'float', 'string': 'str', 'dict': 'dict', 'list': 'list'}
+
+# Cerberus error messages, the errors of a field are sorted by the cerberus error code
+REQUIRED_FIELD = (0x02, 'required field')
+UNKNOWN_FIELD = (0x03, 'unknown field')
+NULL_VALUE = (0x22, 'null value not allowed')
+TYPE_ERROR = 0x24
+COERCION_FAILED = 0x61
+SCHEMA_ERROR = 0x81
+
+
+def compile_rule(rule, value, lines, indent, names):
+    """Append the source of a fast check that returns False unless value matches rule"""
+    pad = ' ' * indent
+    lines.append('{0}if type({1}) is not {2}:'.format(pad, value, FAST_TYPES[rule['type']]))
+    lines.append('{0}    return False'.format(pad))
+
+    if rule['type'] == 'dict' and 'schema' in rule:
+        fields = rule['schema']
+        # a dict holding exactly the required fields cannot hold an unknown one
+        required = [field for field in fields if fields[field].get('required')]
+        if len(required) == len(fields):
+            lines.append('{0}if len({1}) != {2}:'.format(pad, value, len(fields)))
+        else:
+            lines.append('{0}if not {1}.keys() <= {2!r}:'.format(pad, value, set(fields)))
+        lines.append('{0}    return False'.format(pad))
+        for field in fields:
+            name = '_v{0}'.format(len(names))
+            names.append(name)
+            if field in required:
+                lines.append('{0}{1} = {2}.get({3!r})'.format(pad, name, value, field))
+                compile_rule(fields[field], name, lines, indent, names)
+            else:
+                lines.append('{0}if {1!r} in {2}:'.format(pad, field, value))
+                lines.append('{0}    {1} = {2}[{3!r}]'.format(pad, name, value, field))
+                compile_rule(fields[field], name, lines, indent + 4, names)
+
+    elif rule['type'] == 'list' and 'schema' in rule:
+        name = '_v{0}'.format(len(names))
+        names.append(name)
+        lines.append('{0}for {1} in {2}:'.format(pad, name, value))
+        compile_rule(rule['schema'], name, lines, indent + 4, names)
+
+
+def compile_schema(document_schema):
+    """Generate and compile the fast check function of a document schema"""
+    lines = ['def fast_check(document):',
+             '    if type(document) is not dict:',
+             '        return False',
+             '    for field in document:',
+             '        value = document[field]']
+    names = []
+    for index, (field, rule) in enumerate(document_schema.items()):
+        lines.append('        {0} field == {1!r}:'.format('if' if index == 0 else 'elif', field))
+        compile_rule(rule, 'value', lines, 12, names)
+    lines.append('        else:')
+    lines.append('            return False')
+    lines.append('    return True')
+
+    source = '\n'.join(lines) + '\n'
+    namespace = {}
+    exec(compile(source, '<compiled schema>', 'exec'), namespace)
+    return namespace['fast_check'], source
+
+
+def rule_errors(field, rule, value):
+    """Return the sorted cerberus errors of a single value"""
+    errors = []
+    if value is None:
+        errors.append(NULL_VALUE)
+        if 'coerce' in rule:
+            try:
+                rule['coerce'](value)
+            except Exception as e:
+                errors.append((COERCION_FAILED, "field '{0}' cannot be coerced: {1}".format(field, e)))
+        return [message for _, message in sorted(errors, key=lambda error: error[0])]
+
+    if 'coerce' in rule:
+        try:
+            value = rule['coerce'](value)
+        except Exception as e:
+            errors.append((COERCION_FAILED, "field '{0}' cannot be coerced: {1}".format(field, e)))
+
+    rule_type = rule['type']
+    if not isinstance(value, SCHEMA_TYPES[rule_type]) or (rule_type == 'list' and isinstance(value, str)):
+        errors.append((TYPE_ERROR, 'must be of {0} type'.format(rule_type)))
+
+    elif rule_type == 'dict' and 'schema' in rule:
+        document_errors = dict_errors(rule['schema'], value)
+        if document_errors:
+            errors.append((SCHEMA_ERROR, document_errors))
+
+    elif rule_type == 'list' and 'schema' in rule:
+        item_errors = {}
+        for index, item in enumerate(value):
+            item_error = rule_errors(index, rule['schema'], item)
+            if item_error:
+                item_errors[index] = item_error
+        if item_errors:
+            errors.append((SCHEMA_ERROR, item_errors))
+
+    return [message for _, message in sorted(errors, key=lambda error: error[0])]
+
+
+def dict_errors(document_schema, document):
+    """Return the cerberus errors dictionary of a document"""
+    errors = {}
+    for field, value in document.items():
+        if field not in document_schema:
+            errors[field] = [UNKNOWN_FIELD[1]]
+        else:
+            field_errors = rule_errors(field, document_schema[field], value)
+            if field_errors:
+                errors[field] = field_errors
+    for field, rule in document_schema.items():
+        if rule.get('required') and field not in document:
+            errors[field] = [REQUIRED_FIELD[1]]
+    return dict((field, errors[field]) for field in sorted(errors))
+
+
+class CompiledValidator(object):
+    """Drop-in replacement of cerberus.Validator for the element schema"""
+
+    def __init__(self, document_schema=schema.schema):
+        self.schema = document_schema
+        self.fast_check, self.source = compile_schema(document_schema)
+        self.errors = {}
+
+    def validate(self, document, document_schema=None):
+        if document_schema is not None and document_schema is not self.schema:
+            self.schema = document_schema
+            self.fast_check, self.source = compile_schema(document_schema)
+
+        if self.fast_check(document):
+            self.errors = {}
+            return True
+
+        # slow path, rebuild the full errors dictionary
+        self.errors = dict_errors(self.schema, document)
+        return not self.errors